@@ -0,0 +1,82 @@
+"""
+リクエスト1件あたりのメモリ使用量を計測する
+合成したリクエストをパース → URL解決 → レスポンス生成 し、同時に処理中である想定で全て保持したまま
+tracemalloc で確保されているメモリ量とメモリブロック数を数える
+
+    $ python benchmarks/request_memory.py [リクエスト数]
+"""
+import os
+import sys
+import tracemalloc
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, ".."))
+
+from henango.http.cookie import Cookie
+from henango.http.response import HTTPResponse
+from henango.server.protocol import HTTPProtocol
+from henango.urls.resolver import URLResolver
+
+COUNT = 100_000
+
+PATHS = ["/now", "/show_request", "/user/123/profile", "/index.html", "/welcome"]
+
+
+def make_requests(count: int) -> list:
+    """
+    ブラウザが送るような形のリクエストを合成する(5件に1件はCookie付き)
+    """
+    requests = []
+    for i in range(count):
+        lines = [
+            f"GET {PATHS[i % len(PATHS)]}?page={i % 10} HTTP/1.1",
+            "Host: localhost:8080",
+            "User-Agent: Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+            "Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+            "Accept-Encoding: gzip, deflate, br",
+            "Accept-Language: ja,en-US;q=0.9,en;q=0.8",
+            "Connection: keep-alive",
+        ]
+        if i % 5 == 0:
+            lines.append(f"Cookie: username=user{i}; email=user{i}@example.com")
+        requests.append(("\r\n".join(lines) + "\r\n\r\n").encode())
+    return requests
+
+
+def handle(protocol: HTTPProtocol, resolver: URLResolver, raw: bytes):
+    """
+    viewは呼ばずに、サーバとviewがリクエスト/レスポンスに対して行う典型的な操作をなぞる
+    """
+    request = protocol.parse_http_request(raw)
+    resolver.resolve(request)
+    protocol.should_keep_alive(request)
+    response = HTTPResponse(body=b"<html>hello</html>", content_type="text/html; charset=UTF-8")
+    if "Cookie" in request.headers:
+        response.cookies.append(Cookie(name="username", value=request.cookies.get("username", ""), max_age=30))
+    return request, response
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else COUNT
+    protocol = HTTPProtocol()
+    resolver = URLResolver()
+    requests = make_requests(count)
+    # ルーティングテーブルの構築などの初回だけのメモリ確保を計測から除く
+    handle(protocol, resolver, requests[0])
+
+    handled = [None] * count
+    tracemalloc.start()
+    for i, raw in enumerate(requests):
+        handled[i] = handle(protocol, resolver, raw)
+    size, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    blocks = sum(stat.count for stat in snapshot.statistics("filename"))
+    print(f"requests: {count}")
+    print(f"  memory: {size / count:7.0f} bytes/request (peak {peak / 2 ** 20:.1f} MiB)")
+    print(f"  blocks: {blocks / count:7.1f} allocations/request")
+
+
+if __name__ == "__main__":
+    main()
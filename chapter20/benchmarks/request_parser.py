@@ -0,0 +1,64 @@
+"""
+リクエストのパースにかかる時間を計測する
+リポジトリ内の各章の server_recv.txt (実際にブラウザから受信したリクエスト)をコーパスとして使う
+
+    $ python benchmarks/request_parser.py
+"""
+import glob
+import os
+import sys
+import timeit
+import tracemalloc
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, ".."))
+
+from henango.server.protocol import HTTPProtocol
+
+NUMBER = 20_000
+
+
+def load_corpus() -> list:
+    """
+    パースできるリクエストのヘッダ部分を集める
+    """
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(BASE_DIR, "..", "..", "chapter*", "server_recv.txt"))):
+        with open(path, "rb") as f:
+            data = f.read()
+        head, separator, _ = data.partition(b"\r\n\r\n")
+        if separator and b" HTTP/1." in head.split(b"\r\n", 1)[0]:
+            corpus.append(head + separator)
+    return corpus
+
+
+def main():
+    protocol = HTTPProtocol()
+    corpus = load_corpus()
+
+    def parse_all():
+        for request in corpus:
+            protocol.parse_http_request(request)
+
+    def parse_and_read_cookies():
+        for request in corpus:
+            protocol.parse_http_request(request).cookies
+
+    for name, func in (("parse", parse_all), ("parse+cookies", parse_and_read_cookies)):
+        seconds = timeit.timeit(func, number=NUMBER)
+        print(f"{name:>14}: {seconds / NUMBER / len(corpus) * 1e9:7.0f} ns/request ({len(corpus)} requests)")
+
+    # パースしたリクエストを保持したまま、確保されたメモリを計測する
+    tracemalloc.start()
+    parsed = []
+    for _ in range(100):
+        for request in corpus:
+            parsed.append(protocol.parse_http_request(request))
+            parsed[-1].headers.get("Connection")
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{'memory':>14}: {size / len(parsed):7.0f} bytes/request (after a header lookup)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+レスポンスライン+ヘッダの構築にかかる時間を計測する
+
+    $ python benchmarks/response_header.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from henango.http.cookie import Cookie
+from henango.http.request import HTTPRequest
+from henango.http.response import HTTPResponse
+from henango.server.protocol import HTTPProtocol
+
+NUMBER = 200_000
+
+
+def main():
+    protocol = HTTPProtocol()
+    request = HTTPRequest(path="/welcome", method="GET", http_version="HTTP/1.1")
+    cases = {
+        "html": HTTPResponse(body=b"<html><body>hello</body></html>"),
+        "redirect+cookies": HTTPResponse(
+            status_code=302,
+            headers={"Location": "/welcome"},
+            cookies=[Cookie(name="username", value="TARO", max_age=30), Cookie(name="email", value="a@b.c", max_age=30)],
+        ),
+    }
+
+    for name, response in cases.items():
+        seconds = timeit.timeit(lambda: protocol.build_response(response, request, True), number=NUMBER)
+        print(f"{name:>16}: {seconds / NUMBER * 1e9:7.0f} ns/response")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+待ち受け用socketの設定(backlog / TCP_NODELAY)によるレイテンシの違いを計測する
+設定ごとにサーバを別プロセスで起動し、次の2つの負荷をかけて p50 / p99 / 最大値を比べる
+
+- burst: 多数のクライアントが同時に新しい接続を張ってリクエストする(backlogが溢れるとSYNの再送待ちで遅延する)
+- chunks: keep-aliveの接続で、小さなチャンクに分けて送られるレスポンスを繰り返し受け取る
+          (Nagleアルゴリズムが有効だと、クライアントの遅延ACKを待って後続のチャンクの送信が遅れる)
+
+    $ python benchmarks/socket_tuning.py
+"""
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, ".."))
+
+BASE_PORT = 18080
+
+# (名前, backlog, TCP_NODELAY, 負荷)
+SCENARIOS = [
+    ("backlog=10", 10, True, "burst"),
+    ("backlog=1024", 1024, True, "burst"),
+    ("nodelay=off", 1024, False, "chunks"),
+    ("nodelay=on", 1024, True, "chunks"),
+]
+
+BURST_CLIENTS = 200
+BURST_ROUNDS = 5
+CHUNKS_REQUESTS = 200
+CHUNKS_PER_CONNECTION = 50
+
+
+def serve(port: int, backlog: int, nodelay: bool) -> None:
+    """
+    サーバのプロセスで実行する
+    settingsを書き換えてから、小さなチャンクを返すviewを追加してサーバを起動する
+    """
+    import settings
+    import urls
+    from henango.http.response import HTTPResponse
+    from henango.server.server import Server
+    from henango.urls.pattern import URLPattern
+
+    settings.SERVER_PORT = port
+    settings.SERVER_BACKLOG = backlog
+    settings.SERVER_TCP_NODELAY = nodelay
+
+    def chunks(request):
+        return HTTPResponse(body=(b"x" * 100 for _ in range(3)), content_type="text/plain")
+
+    urls.url_patterns.append(URLPattern("/chunks", chunks))
+
+    # 接続ごとのログは計測の邪魔になるので捨てる
+    sys.stdout = open(os.devnull, "w")
+    Server().serve()
+
+
+def wait_for_server(port: int) -> None:
+    for _ in range(100):
+        try:
+            socket.create_connection(("localhost", port)).close()
+            return
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    raise RuntimeError("server did not start")
+
+
+def read_until_closed(client_socket: socket.socket) -> bytes:
+    data = b""
+    while True:
+        chunk = client_socket.recv(65536)
+        if not chunk:
+            return data
+        data += chunk
+
+
+def burst(port: int) -> tuple:
+    """
+    BURST_CLIENTS個のスレッドで同時に接続し、1リクエストずつ送ってレスポンスを受け取るまでの時間を計る
+    """
+    latencies, errors = [], []
+    request = b"GET /now HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n"
+
+    def client(barrier: threading.Barrier) -> None:
+        barrier.wait()
+        start = time.perf_counter()
+        try:
+            with socket.create_connection(("localhost", port), timeout=10) as client_socket:
+                client_socket.sendall(request)
+                read_until_closed(client_socket)
+        except OSError as e:
+            errors.append(e)
+            return
+        latencies.append(time.perf_counter() - start)
+
+    for _ in range(BURST_ROUNDS):
+        barrier = threading.Barrier(BURST_CLIENTS)
+        threads = [threading.Thread(target=client, args=(barrier,)) for _ in range(BURST_CLIENTS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # TIME_WAITの接続が増えすぎないよう、ラウンドの間を少し空ける
+        time.sleep(0.2)
+    return latencies, errors
+
+
+def chunks(port: int) -> tuple:
+    """
+    1つのkeep-aliveの接続で、チャンクに分けて送られるレスポンスを順に受け取るまでの時間を計る
+    """
+    latencies = []
+    request = b"GET /chunks HTTP/1.1\r\nHost: localhost\r\n\r\n"
+    # 1つの接続で処理されるリクエスト数(KEEP_ALIVE_MAX_REQUESTS)を超えないよう、途中で接続し直す
+    for _ in range(CHUNKS_REQUESTS // CHUNKS_PER_CONNECTION):
+        with socket.create_connection(("localhost", port)) as client_socket:
+            for _ in range(CHUNKS_PER_CONNECTION):
+                start = time.perf_counter()
+                client_socket.sendall(request)
+                data = b""
+                while not data.endswith(b"0\r\n\r\n"):
+                    chunk = client_socket.recv(65536)
+                    if not chunk:
+                        raise ConnectionError("server closed the connection")
+                    data += chunk
+                latencies.append(time.perf_counter() - start)
+    return latencies, []
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    loads = {"burst": burst, "chunks": chunks}
+    print(f"{'scenario':>14} {'load':>7} {'requests':>8} {'errors':>6} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+
+    for i, (name, backlog, nodelay, load) in enumerate(SCENARIOS):
+        port = BASE_PORT + i
+        server = subprocess.Popen(
+            [sys.executable, __file__, "--serve", str(port), str(backlog), str(int(nodelay))],
+            cwd=os.path.join(BASE_DIR, ".."),
+        )
+        try:
+            wait_for_server(port)
+            latencies, errors = loads[load](port)
+        finally:
+            server.terminate()
+            server.wait()
+
+        print(
+            f"{name:>14} {load:>7} {len(latencies):>8} {len(errors):>6} "
+            f"{percentile(latencies, 0.5) * 1e3:8.2f} {percentile(latencies, 0.99) * 1e3:8.2f} {max(latencies) * 1e3:8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == "--serve":
+        serve(int(sys.argv[2]), int(sys.argv[3]), bool(int(sys.argv[4])))
+    else:
+        main()
@@ -0,0 +1,65 @@
+"""
+静的ファイルの送信方式ごとのスループットとメモリ使用量を計測する
+
+    $ python benchmarks/static_sendfile.py
+
+read: ファイルを全て読み込んでレスポンスボディにする(STATIC_SENDFILE_MIN_SIZE を超える大きさにした場合)
+sendfile: FileResponse を使ってsendfileで送信する
+"""
+import os
+import socket
+import sys
+import tempfile
+import time
+import tracemalloc
+from threading import Thread
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import settings
+from henango.http.request import HTTPRequest
+from henango.server.worker import Worker
+from henango.views.static import static
+
+FILE_SIZE = 32 * 1024 * 1024
+REPEAT = 20
+
+
+def drain(sock: socket.socket, size: int) -> None:
+    received = 0
+    while received < size:
+        received += len(sock.recv(1024 * 1024))
+
+
+def bench(min_size: int) -> tuple:
+    settings.STATIC_SENDFILE_MIN_SIZE = min_size
+    server_socket, client_socket = socket.socketpair()
+    worker = Worker(server_socket, ("benchmark", 0))
+    request = HTTPRequest(path="/large.bin", method="GET", http_version="HTTP/1.1")
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        reader = Thread(target=drain, args=(client_socket, FILE_SIZE))
+        reader.start()
+        worker.send_response(static(request), request, keep_alive=True)
+        reader.join()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    server_socket.close()
+    client_socket.close()
+    return elapsed, peak
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as static_root:
+        with open(os.path.join(static_root, "large.bin"), "wb") as f:
+            f.write(os.urandom(FILE_SIZE))
+        settings.STATIC_ROOT = static_root
+
+        for name, min_size in (("read", FILE_SIZE + 1), ("sendfile", 0)):
+            elapsed, peak = bench(min_size)
+            throughput = FILE_SIZE * REPEAT / elapsed / 1024 / 1024
+            print(f"{name:>8}: {throughput:8.1f} MiB/s  peak traced memory {peak / 1024 / 1024:6.1f} MiB")
@@ -0,0 +1,107 @@
+"""
+STATIC_ROOT 以下の静的ファイルを、配信用に STATIC_COLLECT_ROOT へ書き出すコマンド
+
+    $ python -m henango.collectstatic
+
+- ファイルの内容のハッシュ値をファイル名に付与する ex) 'index.css' -> 'index.3f2a1b9c0d4e.css'
+- 圧縮が効くファイルは、gzipで圧縮した '.gz' ファイルも書き出す
+- 元のファイル名とフィンガープリント付きのファイル名の対応をマニフェスト(JSON)に書き出す
+
+ファイルごとの処理はプロセスプールで並列に実行する
+"""
+import gzip
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+import settings
+
+# ハッシュ値のうち、ファイル名に使う長さ
+HASH_LENGTH = 12
+
+# gzipで圧縮したファイルも書き出す拡張子
+COMPRESSIBLE_EXTENSIONS = {".html", ".css", ".js", ".json", ".svg", ".txt", ".xml"}
+
+
+def fingerprinted_name(relative_path: str, content: bytes) -> str:
+    """
+    ファイル名に内容のハッシュ値を付与する ex) 'css/index.css' -> 'css/index.3f2a1b9c0d4e.css'
+    """
+    digest = hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+    root, ext = os.path.splitext(relative_path)
+    return f"{root}.{digest}{ext}"
+
+
+def collect_file(source_root: str, output_root: str, relative_path: str) -> Tuple[str, str]:
+    """
+    1つのファイルをフィンガープリント付きの名前で書き出す
+    (元のファイル名, フィンガープリント付きのファイル名) を返す
+    """
+    with open(os.path.join(source_root, relative_path), "rb") as f:
+        content = f.read()
+
+    hashed_path = fingerprinted_name(relative_path, content)
+    output_path = os.path.join(output_root, hashed_path)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    # 同じ内容のファイルは既に書き出し済みなので、何もしない
+    if not os.path.exists(output_path):
+        with open(output_path, "wb") as f:
+            f.write(content)
+
+        if os.path.splitext(relative_path)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+            compressed = gzip.compress(content, compresslevel=9, mtime=0)
+            # 圧縮しても小さくならない場合は書き出さない
+            if len(compressed) < len(content):
+                with open(output_path + ".gz", "wb") as f:
+                    f.write(compressed)
+
+    return relative_path.replace(os.sep, "/"), hashed_path.replace(os.sep, "/")
+
+
+def find_files(source_root: str) -> List[str]:
+    """
+    source_root以下のファイルを、source_rootからの相対パスで列挙する
+    """
+    relative_paths = []
+    for dir_path, _, file_names in os.walk(source_root):
+        for file_name in file_names:
+            # 事前に圧縮されたファイルは、元のファイルとして扱わない
+            if file_name.endswith(".gz"):
+                continue
+            relative_paths.append(os.path.relpath(os.path.join(dir_path, file_name), source_root))
+    return sorted(relative_paths)
+
+
+def collect(source_root: str, output_root: str, manifest_path: str, max_workers: int = None) -> dict:
+    """
+    source_root以下のファイルを全て書き出し、マニフェストを出力する
+    """
+    relative_paths = find_files(source_root)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            collect_file,
+            [source_root] * len(relative_paths),
+            [output_root] * len(relative_paths),
+            relative_paths,
+        )
+        paths = dict(results)
+
+    # 書きかけのマニフェストを読まれないように、一時ファイルに書いてから置き換える
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump({"version": 1, "paths": paths}, f, indent=2, sort_keys=True)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    return paths
+
+
+if __name__ == "__main__":
+    paths = collect(settings.STATIC_ROOT, settings.STATIC_COLLECT_ROOT, settings.STATIC_MANIFEST)
+    for name, hashed_name in paths.items():
+        print(f"{name} -> {hashed_name}")
+    print(f"{len(paths)} files collected into {settings.STATIC_COLLECT_ROOT}", file=sys.stderr)
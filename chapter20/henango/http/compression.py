@@ -0,0 +1,217 @@
+import gzip
+import zlib
+from collections import OrderedDict
+from threading import Lock
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import settings
+from henango.http.request import HTTPRequest
+from henango.server.metrics import Collected
+
+# サーバが対応しているContent-Encoding(同じ優先度の場合は先にあるものを選ぶ)
+ENCODINGS = ("gzip", "deflate")
+
+# 圧縮するContent-Type
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+
+
+def choose_encoding(request: HTTPRequest) -> Optional[str]:
+    """
+    Accept-Encodingヘッダから、レスポンスに使うContent-Encodingを選ぶ
+    ex) 'gzip;q=0.5, deflate' -> 'deflate'
+    圧縮しない方がよい場合はNoneを返す
+    """
+    accept_encoding = request.headers.get("Accept-Encoding")
+    if not accept_encoding:
+        return None
+
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    """
+    圧縮する意味のあるContent-Typeかどうか(画像などは既に圧縮されているので対象外)
+    """
+    if not content_type:
+        return False
+    return content_type.lower().startswith(COMPRESSIBLE_TYPES)
+
+
+def add_vary(headers, field: str) -> None:
+    """
+    Varyヘッダにfieldを追加する
+    viewが既に設定しているVary(ex: Cookie)は残したまま、末尾に付け足す
+    """
+    vary = headers.get("Vary")
+    if not vary:
+        headers["Vary"] = field
+        return
+
+    fields = [value.strip().lower() for value in vary.split(",")]
+    if "*" in fields or field.lower() in fields:
+        return
+    headers["Vary"] = f"{vary}, {field}"
+
+
+def compress(data: bytes, encoding: str, level: int = None) -> bytes:
+    """
+    dataを指定されたContent-Encodingで圧縮する
+    """
+    if level is None:
+        level = getattr(settings, "COMPRESSION_LEVEL", 6)
+
+    if encoding == "gzip":
+        # 同じ内容からは同じ結果になるように、gzipヘッダの時刻は0にする
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    return zlib.compress(data, level)
+
+
+def compress_stream(chunks: Iterable[bytes], encoding: str, level: int = None) -> Iterator[bytes]:
+    """
+    チャンクのイテラブルを、順に圧縮しながら返す
+    チャンクごとにZ_SYNC_FLUSHで圧縮器に溜まった分を吐き出させ、生成したチャンクをすぐにクライアントへ届ける
+    (flushしないと、ボディ全体を圧縮し終えるまでヘッダ以外何も送られず、ストリーミングの意味がなくなる)
+    """
+    if level is None:
+        level = getattr(settings, "COMPRESSION_LEVEL", 6)
+
+    # wbits: 16+ はgzip形式、そうでなければzlib形式(HTTPのdeflate)
+    wbits = 16 + zlib.MAX_WBITS if encoding == "gzip" else zlib.MAX_WBITS
+    compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        if not chunk:
+            continue
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """
+    圧縮した結果のETagを生成する ex) '"abc"' -> '"abc-gzip"'
+    """
+    if etag.endswith('"'):
+        return f'{etag[:-1]}-{encoding}"'
+    return etag
+
+
+def decoded_etag(etag: str) -> str:
+    """
+    encoded_etagで生成したETagを、元のETagに戻す ex) '"abc-gzip"' -> '"abc"'
+    """
+    for encoding in ENCODINGS:
+        suffix = f'-{encoding}"'
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)] + '"'
+    return etag
+
+
+class CompressionCache:
+    """
+    圧縮した結果を (リソース, ETag, Content-Encoding) ごとに保持しておくクラス
+    ETagはファイル / 内容が変わると変わるので、同じ内容を圧縮するのは一度だけで済む
+    (ETagが一意なのは1つのリソースの中だけなので、リソース(リクエストのpath)もキーに含める)
+    合計サイズがmax_bytesを超えたら、最近使われていないものから捨てる(LRU)
+    """
+
+    def __init__(self, max_bytes: int = None):
+        if max_bytes is None:
+            max_bytes = getattr(settings, "COMPRESSION_CACHE_MAX_BYTES", 8 * 1024 * 1024)
+
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Tuple[str, str, str], bytes]" = OrderedDict()
+        self.bytes_resident = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+    def compress(self, resource: str, etag: str, data: bytes, encoding: str) -> bytes:
+        """
+        キャッシュにあればそれを返し、なければ圧縮してキャッシュする
+        """
+        compressed = self.get(resource, etag, encoding)
+        if compressed is None:
+            compressed = compress(data, encoding)
+            self.put(resource, etag, encoding, compressed)
+        return compressed
+
+    def get(self, resource: str, etag: str, encoding: str) -> Optional[bytes]:
+        """
+        キャッシュしている圧縮結果を返す(ない場合はNone)
+        ファイルのように、キャッシュになかった場合だけ内容を読み込みたい場合に使う
+        """
+        key = (resource, etag, encoding)
+        with self._lock:
+            compressed = self.entries.get(key)
+            if compressed is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return compressed
+
+    def put(self, resource: str, etag: str, encoding: str, compressed: bytes) -> None:
+        """
+        圧縮結果をキャッシュする(大きすぎる場合はキャッシュしない)
+        """
+        if len(compressed) > self.max_bytes:
+            return
+
+        key = (resource, etag, encoding)
+        with self._lock:
+            if key not in self.entries:
+                self.entries[key] = compressed
+                self.bytes_resident += len(compressed)
+            while self.bytes_resident > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes_resident -= len(evicted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes_resident": self.bytes_resident,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+    def collect_metrics(self) -> List[Collected]:
+        """
+        stats()の内容を、メトリクスとして返す
+        """
+        stats = self.stats()
+        return [
+            ("henango_compression_cache_hits_total", "counter", "Compressed bodies reused from the cache.", stats["hits"]),
+            ("henango_compression_cache_misses_total", "counter", "Compressed bodies not in the cache.", stats["misses"]),
+            ("henango_compression_cache_bytes", "gauge", "Bytes of compressed bodies held in memory.", stats["bytes_resident"]),
+        ]
+
+
+# サーバ全体で共有するキャッシュ
+compression_cache = CompressionCache()
@@ -0,0 +1,137 @@
+import hashlib
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from functools import wraps
+from typing import Callable, Optional, Union
+
+from henango.http.compression import decoded_etag
+from henango.http.headers import Headers
+from henango.http.request import HTTPRequest
+from henango.http.response import HTTPResponse
+
+
+def make_etag(stat: os.stat_result) -> str:
+    """
+    ファイルのinode・更新日時・サイズからETagを生成する
+    """
+    return f'"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def make_content_etag(body: bytes) -> str:
+    """
+    レスポンスボディのハッシュ値からETagを生成する
+    """
+    return f'"{hashlib.md5(body).hexdigest()}"'
+
+
+def http_date(timestamp: float) -> str:
+    """
+    UNIX時間をHTTPの日付の形式に変換する ex) 'Sat, 17 Oct 2026 01:24:25 GMT'
+    """
+    return formatdate(timestamp, usegmt=True)
+
+
+def is_not_modified(request: HTTPRequest, etag: Optional[str] = None, last_modified: Optional[float] = None) -> bool:
+    """
+    クライアントがキャッシュしているものから変更がない(304を返してよい)かどうかを判定する
+    If-None-Matchが送られてきた場合はETagで、そうでなければIf-Modified-Sinceで判定する
+    """
+    if request.method not in ("GET", "HEAD"):
+        return False
+
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        if etag is None:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        # 弱いETag(W/"...")や、圧縮したレスポンスに付与したETag('"...-gzip"')も同じものとして比較する
+        client_etags = {decoded_etag(tag.strip().removeprefix("W/")) for tag in if_none_match.split(",")}
+        return etag.removeprefix("W/") in client_etags
+
+    if_modified_since = request.headers.get("If-Modified-Since")
+    if if_modified_since is not None and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # HTTPの日付は秒単位なので、秒未満は切り捨てて比較する
+        return int(last_modified) <= since
+
+    return False
+
+
+def validator_headers(etag: Optional[str] = None, last_modified: Optional[float] = None) -> dict:
+    """
+    ETag / Last-Modified ヘッダを生成する
+    """
+    headers = {}
+    if etag is not None:
+        headers["ETag"] = etag
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+# 304にも付与するヘッダ(200で返す場合と同じ値にしないと、キャッシュが正しく更新されない)
+NOT_MODIFIED_HEADERS = ("cache-control", "content-location", "expires", "vary")
+
+
+def not_modified(
+    etag: Optional[str] = None, last_modified: Optional[float] = None, extra_headers: Union[Headers, dict] = None
+) -> HTTPResponse:
+    """
+    ボディを持たない304レスポンスを生成する
+    extra_headersを渡した場合は、200で返すはずだったヘッダのうちCache-Control / Vary などを引き継ぐ
+    (Content-Encodingなどボディに関するヘッダは付与しない)
+    """
+    headers = validator_headers(etag, last_modified)
+    if extra_headers:
+        for name, value in extra_headers.items():
+            if name.lower() in NOT_MODIFIED_HEADERS:
+                headers[name] = value
+    return HTTPResponse(status_code=304, headers=headers)
+
+
+def condition(
+    etag_func: Callable[[HTTPRequest], Optional[str]] = None,
+    last_modified_func: Callable[[HTTPRequest], Optional[float]] = None,
+):
+    """
+    viewにETag / Last-Modified を付与し、変更がなければ304を返すデコレータ
+
+    etag_func / last_modified_func を指定した場合は、viewを呼び出す前に判定するので描画も省ける
+    どちらも指定しない場合は、viewが返したボディのハッシュ値をETagとして判定する
+
+    ex)
+        @condition(last_modified_func=lambda request: os.stat(ARTICLE_PATH).st_mtime)
+        def article(request: HTTPRequest) -> HTTPResponse:
+            ...
+    """
+    def decorator(view: Callable[[HTTPRequest], HTTPResponse]) -> Callable[[HTTPRequest], HTTPResponse]:
+        @wraps(view)
+        def wrapper(request: HTTPRequest) -> HTTPResponse:
+            etag = etag_func(request) if etag_func else None
+            last_modified = last_modified_func(request) if last_modified_func else None
+
+            if etag is not None or last_modified is not None:
+                if is_not_modified(request, etag, last_modified):
+                    return not_modified(etag, last_modified)
+                response = view(request)
+            else:
+                response = view(request)
+                if response.status_code != 200 or response.is_streaming:
+                    return response
+                if isinstance(response.body, str):
+                    response.body = response.body.encode()
+                etag = make_content_etag(response.body)
+                if is_not_modified(request, etag):
+                    return not_modified(etag, extra_headers=response.headers)
+
+            if response.status_code == 200:
+                response.headers.update(validator_headers(etag, last_modified))
+            return response
+
+        return wrapper
+
+    return decorator
@@ -3,6 +3,8 @@ from typing import Optional
 
 
 class Cookie:
+    __slots__ = ("name", "value", "expires", "max_age", "domain", "path", "secure", "http_only")
+
     name: str
     value: str
     expires: Optional[datetime]
@@ -0,0 +1,156 @@
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+HeaderItems = Union[Iterable[Tuple[str, str]], Dict[str, str], "Headers", None]
+
+
+@lru_cache(maxsize=256)
+def lookup_key(name: str) -> bytes:
+    """
+    索引を引くためのキー(小文字のヘッダ名のbytes)を返す
+    コード中で参照するヘッダ名は限られているので、変換結果をキャッシュしておく
+    """
+    return name.encode("latin-1").lower()
+
+
+def to_bytes(value: Union[str, bytes]) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
+
+
+class Headers:
+    """
+    HTTPヘッダを保持するクラス
+    ヘッダ名の大文字 / 小文字を区別せずに参照できる ex) headers["cookie"] == headers["Cookie"]
+    同じ名前のヘッダを複数持つことができ、getall() で全ての値を取得できる
+
+    受け取ったバイト列のまま (ヘッダ名, 値) のリストで保持し、
+    名前で参照された時に初めて 小文字のヘッダ名 -> 位置 の索引を作る
+    値は参照された時にだけ前後の空白を取り除いてデコードする
+    """
+    __slots__ = ("_raw", "_index")
+
+    def __init__(self, items: HeaderItems = None):
+        if items is None:
+            raw = []
+        elif isinstance(items, Headers):
+            raw = list(items._raw)
+        else:
+            if isinstance(items, dict):
+                items = items.items()
+            raw = [(to_bytes(name), to_bytes(value)) for name, value in items]
+
+        self._raw: List[Tuple[bytes, bytes]] = raw
+        self._index: Optional[Dict[bytes, int]] = None
+
+    @classmethod
+    def from_raw(cls, raw: List[Tuple[bytes, bytes]]) -> "Headers":
+        """
+        パース済みの (ヘッダ名, 値) のbytesのリストを、コピーせずにそのまま保持する
+        値の前後の空白は残っていてよい
+        """
+        headers = cls.__new__(cls)
+        headers._raw = raw
+        headers._index = None
+        return headers
+
+    def _build_index(self) -> Dict[bytes, int]:
+        index = {}
+        for position, (name, _) in enumerate(self._raw):
+            # 同じ名前のヘッダが複数ある場合は、最初のものを指す
+            index.setdefault(name.lower(), position)
+        self._index = index
+        return index
+
+    def get_raw(self, name: str, default: Optional[bytes] = None) -> Optional[bytes]:
+        """
+        ヘッダの値をデコードせずにbytesのまま返す
+        """
+        index = self._index if self._index is not None else self._build_index()
+        position = index.get(lookup_key(name))
+        if position is None:
+            return default
+        return self._raw[position][1].strip()
+
+    def get(self, name: str, default=None):
+        value = self.get_raw(name)
+        if value is None:
+            return default
+        return value.decode()
+
+    def getall(self, name: str) -> List[str]:
+        """
+        同じ名前のヘッダの値を、受け取った順に全て返す
+        """
+        key = lookup_key(name)
+        return [value.strip().decode() for n, value in self._raw if n.lower() == key]
+
+    def add(self, name: str, value: str) -> None:
+        """
+        同じ名前のヘッダを置き換えずに追加する ex) Set-Cookie, Vary
+        """
+        raw_name = to_bytes(name)
+        self._raw.append((raw_name, to_bytes(value)))
+        if self._index is not None:
+            self._index.setdefault(raw_name.lower(), len(self._raw) - 1)
+
+    def raw_items(self) -> List[Tuple[bytes, bytes]]:
+        """
+        (ヘッダ名, 値) をbytesのまま返す(レスポンスヘッダの組み立て用)
+        """
+        return self._raw
+
+    def __getitem__(self, name: str) -> str:
+        value = self.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __setitem__(self, name: str, value: str) -> None:
+        # 同じ名前のヘッダは置き換える
+        self._remove(name)
+        self._raw.append((to_bytes(name), to_bytes(value)))
+
+    def __delitem__(self, name: str) -> None:
+        if name not in self:
+            raise KeyError(name)
+        self._remove(name)
+
+    def _remove(self, name: str) -> None:
+        key = lookup_key(name)
+        self._raw = [(n, v) for n, v in self._raw if n.lower() != key]
+        self._index = None
+
+    def __contains__(self, name) -> bool:
+        return isinstance(name, str) and self.get_raw(name) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return (name.decode() for name, _ in self._raw)
+
+    def __len__(self) -> int:
+        return len(self._raw)
+
+    def items(self) -> List[Tuple[str, str]]:
+        return [(name.decode(), value.strip().decode()) for name, value in self._raw]
+
+    def keys(self) -> List[str]:
+        return [name.decode() for name, _ in self._raw]
+
+    def values(self) -> List[str]:
+        return [value.strip().decode() for _, value in self._raw]
+
+    def update(self, other) -> None:
+        items = other.items() if hasattr(other, "items") else other
+        for name, value in items:
+            self[name] = value
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Headers):
+            return self.items() == other.items()
+        if isinstance(other, dict):
+            return dict(self.items()) == other
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"Headers({self.items()!r})"
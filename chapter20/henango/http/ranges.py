@@ -0,0 +1,108 @@
+from typing import List, Optional, Tuple
+
+import settings
+from henango.http.conditional import http_date
+from henango.http.request import HTTPRequest
+
+
+class RangeNotSatisfiable(Exception):
+    """
+    Rangeヘッダで指定された範囲が、どれもファイルの範囲外だった場合に送出される例外
+    """
+
+
+def parse_range_header(value: str, size: int, max_ranges: int = None) -> Optional[List[Tuple[int, int]]]:
+    """
+    Rangeヘッダをパースし、(開始位置, 終了位置) のリストを返す(終了位置も範囲に含む)
+    ex) 'bytes=0-99, -50' (size=1000) -> [(0, 99), (950, 999)]
+
+    重なっている範囲や隣接している範囲は1つにまとめ、開始位置の順に並べて返す
+    ex) 'bytes=500-599, 0-99, 50-149' -> [(0, 149), (500, 599)]
+
+    形式が不正な場合はNoneを返す(Rangeヘッダは無視して全体を返す)
+    1つのリクエストで同じ部分を何度も送らせる攻撃を防ぐため、
+    範囲の数がmax_rangesを超える場合や、範囲の合計がファイルのサイズを超える場合もNoneを返す
+    """
+    if max_ranges is None:
+        max_ranges = getattr(settings, "MAX_RANGES", 16)
+
+    unit, _, specs = value.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+
+    specs = specs.split(",")
+    if len(specs) > max_ranges:
+        return None
+
+    ranges = []
+    for spec in specs:
+        start, separator, end = spec.strip().partition("-")
+        if not separator:
+            return None
+
+        if start == "":
+            # 末尾からのバイト数の指定 ex) '-500'
+            if not is_digits(end):
+                return None
+            suffix_length = int(end)
+            # 長さ0の指定や、空のファイルの末尾は満たせない
+            if suffix_length == 0 or size == 0:
+                continue
+            ranges.append((max(size - suffix_length, 0), size - 1))
+            continue
+
+        if not is_digits(start) or (end and not is_digits(end)):
+            return None
+        first = int(start)
+        if end and int(end) < first:
+            return None
+        if first >= size:
+            continue
+        last = int(end) if end else size - 1
+        ranges.append((first, min(last, size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    if sum(last - first + 1 for first, last in ranges) > size:
+        return None
+
+    return merge_ranges(ranges)
+
+
+def merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    重なっている範囲と隣接している範囲をまとめ、開始位置の順に並べる
+    """
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def is_digits(value: str) -> bool:
+    """
+    ASCIIの数字だけからなる文字列かどうか
+    (str.isdigit()は '²' なども受け付けるが、int()では変換できない)
+    """
+    return value.isascii() and value.isdigit()
+
+
+def if_range_matches(request: HTTPRequest, etag: str, last_modified: float) -> bool:
+    """
+    If-Rangeヘッダの条件を満たすかどうか(Rangeヘッダに従ってよいかどうか)を判定する
+    If-Rangeが送られてきていない場合は常にTrue
+    """
+    if_range = request.headers.get("If-Range")
+    if if_range is None:
+        return True
+
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        # If-Rangeでは弱いETagは一致しないものとして扱う
+        return not if_range.startswith("W/") and if_range == etag
+
+    return if_range == http_date(last_modified)
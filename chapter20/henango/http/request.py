@@ -1,9 +1,21 @@
+import urllib.parse
+from typing import Optional, Union
+
+from henango.http.headers import Headers
+
+
 class HTTPRequest:
+    """
+    HTTPリクエスト
+    同時に多数保持されるため、__slots__ でインスタンスごとの __dict__ を持たないようにし、
+    ヘッダ / パスパラメータ / Cookie / クエリのコンテナは参照された時に初めて作る
+    """
+    __slots__ = ("path", "method", "http_version", "body", "_headers", "_params", "_cookies", "_query")
+
     path: str
     method: str
     http_version: str
-    headers: dict
-    cookies: dict
+    headers: Headers
     body: bytes
     params: dict
 
@@ -12,22 +24,82 @@ class HTTPRequest:
         path: str = "", 
         method: str = "", 
         http_version: str = "",
-        headers: dict = None,
+        headers: Union[Headers, dict] = None,
         cookies: dict = None,
         body: bytes = b"",
         params: dict = None,
     ):
-        if headers is None:
-            headers = {}
-        if cookies is None:
-            cookies = {}
-        if params is None:
-            params = {}
+        if headers is not None and not isinstance(headers, Headers):
+            headers = Headers(headers)
 
         self.path = path
         self.method = method
         self.http_version = http_version
-        self.headers = headers
-        self.cookies = cookies
         self.body = body
-        self.params = params
\ No newline at end of file
+        self._headers: Optional[Headers] = headers
+        self._params: Optional[dict] = params
+
+        # Cookie / クエリ文字列は、参照された時に初めてパースする
+        self._cookies: Optional[dict] = cookies
+        self._query: Optional[dict] = None
+
+    @property
+    def headers(self) -> Headers:
+        if self._headers is None:
+            self._headers = Headers()
+        return self._headers
+
+    @headers.setter
+    def headers(self, headers: Union[Headers, dict]) -> None:
+        self._headers = headers if isinstance(headers, Headers) else Headers(headers)
+
+    @property
+    def params(self) -> dict:
+        """
+        URLパターンのパスパラメータ ex) "/user/<int:user_id>/profile" => {"user_id": 1}
+        """
+        if self._params is None:
+            self._params = {}
+        return self._params
+
+    @params.setter
+    def params(self, params: dict) -> None:
+        self._params = params
+
+    @property
+    def cookies(self) -> dict:
+        """
+        Cookieヘッダをパースした結果
+        ex) "name1=value1; name2=value2" => {"name1": "value1", "name2": "value2"}
+        """
+        if self._cookies is None:
+            cookies = {}
+            cookie_header = self.headers.get("Cookie")
+            if cookie_header:
+                for cookie_string in cookie_header.split(";"):
+                    name, separator, value = cookie_string.strip().partition("=")
+                    if separator:
+                        cookies[name] = value
+            self._cookies = cookies
+        return self._cookies
+
+    @cookies.setter
+    def cookies(self, cookies: dict) -> None:
+        self._cookies = cookies
+
+    @property
+    def query_string(self) -> str:
+        """
+        pathの ? 以降の部分 ex) "/search?q=python" => "q=python"
+        """
+        return self.path.partition("?")[2]
+
+    @property
+    def query(self) -> dict:
+        """
+        クエリ文字列をパースした結果
+        ex) "/search?q=python&page=2" => {"q": ["python"], "page": ["2"]}
+        """
+        if self._query is None:
+            self._query = urllib.parse.parse_qs(self.query_string)
+        return self._query
@@ -1,29 +1,173 @@
-from typing import Optional, List
+import secrets
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple, Union
 
 from henango.http.cookie import Cookie
+from henango.http.headers import Headers
 
 class HTTPResponse:
+    """
+    HTTPレスポンス
+    __slots__ でインスタンスごとの __dict__ を持たないようにし、
+    ヘッダ / Cookie のコンテナは参照された時に初めて作る
+    """
+    __slots__ = ("status_code", "content_type", "body", "_headers", "_cookies")
+
     status_code: int
-    headers: dict
+    headers: Headers
     cookies: List[Cookie]
     content_type: Optional[str]
-    body: bytes
+    # bytes / str の他に、bytesのチャンクを順に返すイテラブルも指定できる
+    body: Union[bytes, str, Iterable[bytes]]
 
     def __init__(
         self,
         status_code: int = 200,
-        headers: dict = None,
+        headers: Union[Headers, dict] = None,
         cookies: List[Cookie] = None,
         content_type: str = None,
-        body: bytes = b""
+        body: Union[bytes, str, Iterable[bytes]] = b""
     ):
-        if headers is None:
-            headers = {}
-        if cookies is None:
-            cookies = []
-        
+        if headers is not None and not isinstance(headers, Headers):
+            headers = Headers(headers)
+
         self.status_code = status_code
-        self.headers = headers
-        self.cookies = cookies
         self.content_type = content_type
-        self.body = body
\ No newline at end of file
+        self.body = body
+        self._headers: Optional[Headers] = headers
+        self._cookies: Optional[List[Cookie]] = cookies
+
+    @property
+    def headers(self) -> Headers:
+        if self._headers is None:
+            self._headers = Headers()
+        return self._headers
+
+    @headers.setter
+    def headers(self, headers: Union[Headers, dict]) -> None:
+        self._headers = headers if isinstance(headers, Headers) else Headers(headers)
+
+    @property
+    def cookies(self) -> List[Cookie]:
+        if self._cookies is None:
+            self._cookies = []
+        return self._cookies
+
+    @cookies.setter
+    def cookies(self, cookies: List[Cookie]) -> None:
+        self._cookies = cookies
+
+    @property
+    def is_streaming(self) -> bool:
+        """
+        bodyがチャンクのイテラブル(Transfer-Encoding: chunkedで送信する)かどうか
+        """
+        return not isinstance(self.body, (bytes, bytearray, str))
+
+    @property
+    def content_length(self) -> int:
+        """
+        Content-Lengthヘッダに指定するボディのバイト数
+        """
+        return len(self.body)
+
+
+class FileResponse(HTTPResponse):
+    """
+    ファイルの内容をボディとするレスポンス
+    ボディをメモリに読み込まず、サーバがsendfileでファイルから直接送信する
+    """
+    __slots__ = ("file", "offset", "length")
+
+    file: BinaryIO
+    offset: int
+    length: int
+
+    def __init__(
+        self,
+        file: BinaryIO,
+        length: int,
+        offset: int = 0,
+        status_code: int = 200,
+        headers: Union[Headers, dict] = None,
+        cookies: List[Cookie] = None,
+        content_type: str = None,
+    ):
+        super().__init__(status_code=status_code, headers=headers, cookies=cookies, content_type=content_type)
+        self.file = file
+        self.offset = offset
+        self.length = length
+
+    @property
+    def content_length(self) -> int:
+        return self.length
+
+    def body_parts(self) -> Iterator[Union[bytes, Tuple[int, int]]]:
+        """
+        ボディを先頭から順に返す
+        bytesはそのまま送信し、(offset, length) はファイルのその範囲をsendfileで送信する
+        """
+        yield self.offset, self.length
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ByteRangesResponse(FileResponse):
+    """
+    ファイルの複数の範囲を multipart/byteranges で返すレスポンス(206 Partial Content)
+    """
+    __slots__ = ("ranges", "file_size", "boundary", "part_content_type")
+
+    ranges: List[Tuple[int, int]]
+    file_size: int
+    boundary: str
+    # 各パートのContent-Type(Noneの場合はサーバがpathから決める)
+    part_content_type: Optional[str]
+
+    def __init__(
+        self,
+        file: BinaryIO,
+        ranges: List[Tuple[int, int]],
+        file_size: int,
+        part_content_type: str = None,
+        headers: Union[Headers, dict] = None,
+        cookies: List[Cookie] = None,
+    ):
+        self.boundary = secrets.token_hex(16)
+        super().__init__(
+            file,
+            length=0,
+            status_code=206,
+            headers=headers,
+            cookies=cookies,
+            content_type=f"multipart/byteranges; boundary={self.boundary}",
+        )
+        self.ranges = ranges
+        self.file_size = file_size
+        self.part_content_type = part_content_type
+
+    def part_header(self, first: int, last: int) -> bytes:
+        return (
+            f"--{self.boundary}\r\n"
+            f"Content-Type: {self.part_content_type}\r\n"
+            f"Content-Range: bytes {first}-{last}/{self.file_size}\r\n"
+            "\r\n"
+        ).encode()
+
+    def closing_boundary(self) -> bytes:
+        return f"--{self.boundary}--\r\n".encode()
+
+    @property
+    def content_length(self) -> int:
+        length = len(self.closing_boundary())
+        for first, last in self.ranges:
+            # パートのヘッダ + 範囲のバイト数 + 末尾のCRLF
+            length += len(self.part_header(first, last)) + (last - first + 1) + 2
+        return length
+
+    def body_parts(self) -> Iterator[Union[bytes, Tuple[int, int]]]:
+        for i, (first, last) in enumerate(self.ranges):
+            # 2つ目以降のパートの前には、直前のパートのボディを終えるCRLFを付ける
+            yield (b"\r\n" if i else b"") + self.part_header(first, last)
+            yield first, last - first + 1
+        yield b"\r\n" + self.closing_boundary()
@@ -0,0 +1,143 @@
+import atexit
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from datetime import datetime
+from threading import Lock, Thread
+from typing import Optional, Tuple
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+
+class AccessLog:
+    """
+    リクエストごとに1行のアクセスログ(JSON)を書き出すクラス
+    ex) {"time": "2024-01-01T12:00:00.000000", "remote": "127.0.0.1", "method": "GET", "path": "/now",
+         "status": 200, "bytes": 345, "duration_ms": 0.812}
+
+    リクエストを処理するスレッドは記録をキューに積むだけで(ロックもI/Oも行わない)、
+    整形と書き込みはバックグラウンドのスレッドが一定間隔でまとめて行う
+    キューが満杯の場合は、新しい記録を捨てて数だけ数える(リクエストの処理を待たせない)
+    """
+
+    def __init__(
+        self,
+        enabled: bool = None,
+        path: Optional[str] = None,
+        buffer_size: int = None,
+        flush_interval: float = None,
+    ):
+        if enabled is None:
+            enabled = getattr(settings, "ACCESS_LOG_ENABLED", True)
+        if path is None:
+            path = getattr(settings, "ACCESS_LOG_FILE", None)
+        if buffer_size is None:
+            buffer_size = getattr(settings, "ACCESS_LOG_BUFFER_SIZE", 4096)
+        if flush_interval is None:
+            flush_interval = getattr(settings, "ACCESS_LOG_FLUSH_INTERVAL", 0.2)
+
+        self.enabled = enabled
+        # Noneの場合は標準出力に書き出す
+        self.path = path
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+
+        self.queue = deque()
+        self.dropped = 0
+        self._write_lock = Lock()
+        self._thread = None
+        self._reported_dropped = 0
+        # 終了時にキューに残っている記録を書き出す
+        atexit.register(self.flush)
+        # fork後の子プロセスには書き込みスレッドが引き継がれないので、必要になった時に起動し直す
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def log(
+        self,
+        address: Optional[Tuple[str, int]],
+        method: str,
+        path: str,
+        status: int,
+        size: int,
+        duration_ns: int,
+    ) -> None:
+        """
+        1リクエスト分の記録をキューに積む
+        """
+        if not self.enabled:
+            return
+        if len(self.queue) >= self.buffer_size:
+            self.dropped += 1
+            return
+
+        if self._thread is None:
+            self._start()
+        self.queue.append((time.time(), address, method, path, status, size, duration_ns))
+
+    def flush(self) -> None:
+        """
+        キューに積まれている記録を全て書き出す
+        """
+        records = []
+        while self.queue:
+            records.append(self.queue.popleft())
+        if records:
+            with self._write_lock:
+                self._write(records)
+
+    def _start(self) -> None:
+        with self._write_lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._write_loop, name="henango-access-log", daemon=True)
+                self._thread.start()
+
+    def _reset_after_fork(self) -> None:
+        self.queue.clear()
+        self._write_lock = Lock()
+        self._thread = None
+
+    def _write_loop(self) -> None:
+        """
+        一定間隔でキューに溜まった記録をまとめて書き出し続ける
+        """
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                # 書き込めなかった記録は捨てる(リクエストの処理には影響させない)
+                pass
+
+            if self.dropped != self._reported_dropped:
+                logger.warning("=== AccessLog: キューが溢れたため %d 件の記録を捨てました ===", self.dropped - self._reported_dropped)
+                self._reported_dropped = self.dropped
+
+    def _write(self, records: list) -> None:
+        lines = []
+        for logged_at, address, method, path, status, size, duration_ns in records:
+            lines.append(json.dumps({
+                "time": datetime.fromtimestamp(logged_at).isoformat(),
+                "remote": address[0] if address else None,
+                "method": method,
+                "path": path,
+                "status": status,
+                "bytes": size,
+                "duration_ms": round(duration_ns / 1e6, 3),
+            }, ensure_ascii=False))
+        text = "\n".join(lines) + "\n"
+
+        if self.path is None:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        else:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(text)
+
+
+# サーバ全体で共有するインスタンス
+access_log = AccessLog()
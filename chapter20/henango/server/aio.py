@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import time
+from asyncio import StreamReader, StreamWriter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import settings
+from henango.http.request import HTTPRequest
+from henango.http.response import HTTPResponse
+from henango.server.access_log import access_log
+from henango.server.capture import request_capture
+from henango.server.metrics import StageTimer, metrics
+from henango.server.protocol import FileSegment, HTTPProtocol
+from henango.server.reader import BadRequest, HTTPRequestReader
+from henango.server.server import Server
+from henango.urls.resolver import URLResolver
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncServer:
+    """
+    asyncioのイベントループ上で動くWebサーバを表すクラス
+    接続ごとにスレッドを生成せず、1スレッドで多数の接続を扱う
+    """
+
+    def serve(self):
+        """
+        サーバを起動する
+        """
+
+        logger.info("=== AsyncServer: サーバを起動します ===")
+
+        try:
+            asyncio.run(self.main())
+
+        finally:
+            logger.info("=== AsyncServer: サーバを停止します ===")
+
+    async def main(self) -> None:
+        # 同期的なviewを実行するためのスレッドプール
+        executor = ThreadPoolExecutor(max_workers=getattr(settings, "ASYNC_EXECUTOR_WORKERS", None))
+
+        # 待ち受け用のsocketはスレッドのエンジンと同じく、settingsに従って生成する
+        # (asyncioは待ち受けを始める時にlisten()し直すので、backlogも渡しておく)
+        server = await asyncio.start_server(
+            lambda reader, writer: AsyncWorker(reader, writer, executor).run(),
+            sock=Server().create_server_socket(),
+            backlog=getattr(settings, "SERVER_BACKLOG", 1024),
+        )
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            executor.shutdown(wait=False)
+
+
+class AsyncWorker(HTTPProtocol):
+    """
+    1つの接続を処理するコルーチンを持つクラス
+    """
+
+    def __init__(self, reader: StreamReader, writer: StreamWriter, executor: ThreadPoolExecutor):
+        self.reader = reader
+        self.writer = writer
+        self.executor = executor
+        self.client_address = writer.get_extra_info("peername")
+
+    async def run(self) -> None:
+        """
+        リクエストを処理してレスポンスを送信する
+        keep-aliveの場合は、同じ接続で続けて送られてくるリクエストも順に処理する
+        """
+        logger.debug("=== AsyncWorker: クライアントとの接続が完了しました remote_address: %s ===", self.client_address)
+
+        max_requests = getattr(settings, "KEEP_ALIVE_MAX_REQUESTS", 100)
+        # 受信したデータを溜めておき、リクエストの区切りを判定する
+        self.request_reader = HTTPRequestReader()
+        # リクエストの最初のデータを受信した時刻(メトリクスの受信時間の計測に使う)
+        self.first_byte_at: Optional[int] = None
+
+        metrics.connection_opened()
+        try:
+            handled_requests = 0
+            while True:
+                # ヘッダの終わりまで受信する
+                # 一定時間待ってもリクエストが来なければ接続を閉じる
+                # (最初のリクエストはREQUEST_READ_TIMEOUT、2つ目以降のリクエストはkeep-aliveのタイムアウトで区切る)
+                self.first_byte_at = None
+                if handled_requests > 0:
+                    timeout = getattr(settings, "KEEP_ALIVE_TIMEOUT", 5)
+                else:
+                    timeout = getattr(settings, "REQUEST_READ_TIMEOUT", 5)
+                request_head = await asyncio.wait_for(self.receive(self.request_reader.read_head), timeout)
+                if request_head is None:
+                    break
+                # アクセスログに記録する処理時間は、ヘッダを受信した時点から数える
+                started_at = time.perf_counter_ns()
+                # メトリクスの受信時間は、最初のデータを受信した時点から数える
+                timer = StageTimer(self.first_byte_at or started_at)
+                timer.lap("recv")
+                request = self.parse_http_request(request_head)
+                timer.lap("parse")
+
+                # Content-Lengthの分、またはchunked形式のボディを受信する
+                # (途中で送信が止まったクライアントは、スレッド / reactorのエンジンと同じく
+                #   次のデータをREQUEST_READ_TIMEOUTまで待って接続を閉じる)
+                content_length, chunked = self.get_body_framing(request)
+                if content_length or chunked:
+                    request.body = await self.receive(
+                        lambda: self.request_reader.read_body(content_length, chunked),
+                        getattr(settings, "REQUEST_READ_TIMEOUT", 5),
+                    )
+                    if request.body is None:
+                        break
+                    timer.lap("recv")
+
+                # デバッグ用にリクエストを記録する(無効な場合は何もしない)
+                if request_capture.enabled:
+                    request_capture.capture(request_head + request.body, self.client_address)
+
+                # URL解決を試みる
+                route, view = URLResolver().resolve_route(request)
+                timer.lap("resolve")
+
+                # レスポンスを生成する
+                response = await self.call_view(view, request)
+                timer.lap("view")
+
+                handled_requests += 1
+                keep_alive = self.should_keep_alive(request) and handled_requests < max_requests
+
+                # クライアントへレスポンスを送信する
+                sent = await self.send_response(response, request, keep_alive, timer)
+
+                # アクセスログを記録する(キューに積むだけで、書き出しは別のスレッドが行う)
+                access_log.log(
+                    self.client_address, request.method, request.path, response.status_code, sent,
+                    timer.last - started_at,
+                )
+                metrics.observe(route, response.status_code, len(request_head) + len(request.body), sent, timer.stages)
+
+                if not keep_alive:
+                    break
+
+        except (asyncio.TimeoutError, ConnectionError):
+            # クライアントが切断した場合や、keep-aliveのタイムアウトの場合は何もせず閉じる
+            pass
+
+        except BadRequest as e:
+            # リクエストが不正、または大きすぎる場合はエラーを返して接続を閉じる
+            error_response = self.build_error_response(e.status_code)
+            try:
+                self.writer.write(error_response)
+                await self.writer.drain()
+            except ConnectionError:
+                # エラーを返す前にクライアントが切断した場合は、送れなかったものとして閉じる
+                return
+            access_log.log(self.client_address, "-", "-", e.status_code, len(error_response), 0)
+            metrics.observe("-", e.status_code, 0, len(error_response), {})
+
+        except Exception:
+            # リクエストの処理中に例外が発生したらエラーを記録し、処理を続行
+            logger.exception("=== AsyncWorker: リクエストの処理中にエラーが発生しました ===")
+
+        finally:
+            # 例外の発生有無に関わらずTCP通信をclose
+            logger.debug("=== AsyncWorker: クライアントとの接続を終了します remote_address: %s ===", self.client_address)
+            self.writer.close()
+            metrics.connection_closed()
+
+    async def send_response(
+        self, response: HTTPResponse, request: HTTPRequest, keep_alive: bool = False, timer: StageTimer = None
+    ) -> int:
+        """
+        レスポンスをクライアントへ送信し、送信したバイト数を返す
+        ストリーミングの場合はボディを生成しながら順に送信し、
+        ファイルの場合はsendfileでカーネルから直接送信する
+        圧縮とヘッダの構築、ストリーミングのボディの生成はイベントループを止めないようにスレッドプールで行う
+        timerを渡した場合は、最初のバッファ(ヘッダ)ができるまでをbuild_header、残りをsendとして計る
+        """
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(self.executor, self.compress_response, response, request)
+        chunks = self.iter_response(response, request, keep_alive, compress=False)
+
+        sent = 0
+        try:
+            data = await loop.run_in_executor(self.executor, next, chunks, None)
+            if timer is not None:
+                timer.lap("build_header")
+            while data is not None:
+                if isinstance(data, FileSegment):
+                    sent += await loop.sendfile(self.writer.transport, data.file, data.offset, data.count)
+                else:
+                    self.writer.writelines(data)
+                    await self.writer.drain()
+                    sent += sum(len(buffer) for buffer in data)
+
+                # ストリーミングのボディはチャンクの生成・圧縮に時間がかかりうるので、スレッドプールで取り出す
+                if response.is_streaming:
+                    data = await loop.run_in_executor(self.executor, next, chunks, None)
+                else:
+                    data = next(chunks, None)
+        finally:
+            # 送信に失敗した場合も、開いたファイルを閉じる
+            chunks.close()
+
+        if timer is not None:
+            timer.lap("send")
+        return sent
+
+    async def receive(self, read: Callable[[], Optional[bytes]], timeout: Optional[float] = None) -> Optional[bytes]:
+        """
+        read()が値を返すまでクライアントからデータを受信する
+        揃う前に接続が閉じられた場合はNoneを返す
+        timeoutを渡した場合は、次のデータをtimeout秒待っても届かなければasyncio.TimeoutErrorとする
+        """
+        while True:
+            data = read()
+            if data is not None:
+                return data
+
+            chunk = await asyncio.wait_for(self.reader.read(getattr(settings, "RECV_BUFFER_SIZE", 16 * 1024)), timeout)
+            if not chunk:
+                return None
+            if self.first_byte_at is None:
+                self.first_byte_at = time.perf_counter_ns()
+            self.request_reader.feed(chunk)
+
+    async def call_view(self, view, request: HTTPRequest) -> HTTPResponse:
+        """
+        viewを呼び出す
+        async defで定義されたviewはイベントループ上でそのまま実行し、
+        通常のviewはイベントループを止めないようにスレッドプールで実行する
+        """
+        if asyncio.iscoroutinefunction(view):
+            return await view(request)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, view, request)
@@ -0,0 +1,123 @@
+import os
+import random
+from collections import deque
+from datetime import datetime
+from threading import Event, Lock, Thread
+
+import settings
+
+
+class RequestCapture:
+    """
+    受信したリクエストをデバッグ用にファイルへ書き出すクラス
+
+    リクエストを処理するスレッドはリングバッファに積むだけで、
+    ファイルへの書き込みはバックグラウンドのスレッドがまとめて行う
+    バッファが溢れた場合は古いものから捨てる
+    """
+
+    def __init__(
+        self,
+        enabled: bool = None,
+        sample_rate: float = None,
+        path: str = None,
+        max_bytes: int = None,
+        backup_count: int = None,
+        buffer_size: int = None,
+    ):
+        if enabled is None:
+            enabled = getattr(settings, "REQUEST_CAPTURE_ENABLED", False)
+        if sample_rate is None:
+            sample_rate = getattr(settings, "REQUEST_CAPTURE_SAMPLE_RATE", 1.0)
+        if path is None:
+            path = getattr(settings, "REQUEST_CAPTURE_FILE", "server_recv.txt")
+        if max_bytes is None:
+            max_bytes = getattr(settings, "REQUEST_CAPTURE_MAX_BYTES", 1024 * 1024)
+        if backup_count is None:
+            backup_count = getattr(settings, "REQUEST_CAPTURE_BACKUP_COUNT", 3)
+        if buffer_size is None:
+            buffer_size = getattr(settings, "REQUEST_CAPTURE_BUFFER_SIZE", 1024)
+
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+        self.ring = deque(maxlen=buffer_size)
+        self.dropped = 0
+        self._event = Event()
+        self._lock = Lock()
+        self._thread = None
+
+    def capture(self, data: bytes, address=None) -> None:
+        """
+        リクエストを書き出し待ちのバッファに積む
+        無効な場合や、サンプリングで外れた場合は何もしない
+        """
+        if not self.enabled:
+            return
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._write_loop, name="henango-capture", daemon=True)
+                self._thread.start()
+            if len(self.ring) == self.ring.maxlen:
+                self.dropped += 1
+            self.ring.append((datetime.now(), address, data))
+
+        self._event.set()
+
+    def _write_loop(self) -> None:
+        """
+        バッファに積まれたリクエストをファイルに書き出し続ける
+        """
+        while True:
+            self._event.wait()
+            self._event.clear()
+
+            records = []
+            with self._lock:
+                while self.ring:
+                    records.append(self.ring.popleft())
+
+            try:
+                self._write(records)
+            except OSError:
+                # 書き込めなかったリクエストは捨てる(リクエストの処理には影響させない)
+                self.dropped += len(records)
+
+    def _write(self, records: list) -> None:
+        """
+        リクエストをまとめてファイルに追記し、サイズが上限を超えたらローテートする
+        """
+        with open(self.path, "ab") as f:
+            for captured_at, address, data in records:
+                f.write(f"=== {captured_at.isoformat()} remote_address: {address} ===\r\n".encode())
+                f.write(data)
+                f.write(b"\r\n")
+            size = f.tell()
+
+        if size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self) -> None:
+        """
+        server_recv.txt -> server_recv.txt.1 -> server_recv.txt.2 ... の順にずらし、
+        backup_countを超えた古いファイルは削除する
+        """
+        if self.backup_count <= 0:
+            os.remove(self.path)
+            return
+
+        for i in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+
+# サーバ全体で共有するインスタンス
+request_capture = RequestCapture()
@@ -0,0 +1,433 @@
+import logging
+import marshal
+import mmap
+import struct
+import threading
+import time
+from bisect import bisect_left
+from threading import Lock, Thread
+from typing import Callable, Dict, List, Optional, Tuple
+
+import settings
+
+logger = logging.getLogger(__name__)
+
+# ヒストグラムのバケットの上限(秒)。最後に +Inf のバケットが付く
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# 計測値(ナノ秒)をそのまま比較できるように換算しておく
+BUCKETS_NS = tuple(int(bucket * 1e9) for bucket in BUCKETS)
+
+# collectorが返す1つのメトリクス (名前, 種類, 説明, 値)
+# 複数のプロセスの値は合計する(名前が "_max" で終わるものは最大値をとる)
+Collected = Tuple[str, str, str, float]
+
+
+class Histogram:
+    """
+    固定のバケットで計測値の分布を数えるヒストグラム
+    (計測値の数は、各バケットの数の合計から求める)
+    """
+    __slots__ = ("counts", "sum_ns")
+
+    def __init__(self):
+        self.counts: List[int] = [0] * (len(BUCKETS_NS) + 1)
+        self.sum_ns = 0
+
+    def observe(self, value_ns: int) -> None:
+        self.counts[bisect_left(BUCKETS_NS, value_ns)] += 1
+        self.sum_ns += value_ns
+
+
+class StageTimer:
+    """
+    1リクエストの処理を段階ごとに区切って時間を計る
+    lap()を呼ぶたびに、前回区切った時点からの経過時間(ナノ秒)をその段階に加算する
+    """
+    __slots__ = ("stages", "last")
+
+    def __init__(self, started_at: int = None):
+        self.stages: Dict[str, int] = {}
+        self.last = time.perf_counter_ns() if started_at is None else started_at
+
+    def lap(self, stage: str) -> int:
+        now = time.perf_counter_ns()
+        self.stages[stage] = self.stages.get(stage, 0) + now - self.last
+        self.last = now
+        return now
+
+
+class Shard:
+    """
+    1つのスレッドが集計している計測値
+    そのスレッドだけが書き込むので、加算する時にロックを取らない
+    """
+    __slots__ = ("latencies", "responses", "bytes_in", "bytes_out")
+
+    def __init__(self):
+        # ルート -> 段階 -> ヒストグラム("total" は受信の開始から送信の完了まで)
+        self.latencies: Dict[str, Dict[str, Histogram]] = {}
+        # ステータスコード -> レスポンス数
+        self.responses: Dict[int, int] = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+
+class SharedSnapshots:
+    """
+    preforkエンジンのワーカープロセスが、それぞれの集計結果(スナップショット)を書き込む共有メモリ
+    fork前に確保し、1つのプロセスが1つのスロットに書き込む
+    書き込み中のスロットを読まないよう、シーケンス番号(書き込み中は奇数)で確認する(seqlock)
+    ロックを使わないので、書き込み中にプロセスが強制終了されても他のプロセスは止まらない
+    """
+
+    HEADER = struct.Struct("qq")
+
+    def __init__(self, slots: int, slot_size: int):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.buffer = mmap.mmap(-1, slots * slot_size)
+
+    def write(self, slot: int, data: bytes) -> bool:
+        """
+        スロットにデータを書き込む
+        スロットに収まらない場合は書き込まずにFalseを返す
+        """
+        if self.HEADER.size + len(data) > self.slot_size:
+            return False
+
+        offset = slot * self.slot_size
+        sequence, _ = self.HEADER.unpack_from(self.buffer, offset)
+        sequence += sequence % 2
+        self.HEADER.pack_into(self.buffer, offset, sequence + 1, len(data))
+        start = offset + self.HEADER.size
+        self.buffer[start:start + len(data)] = data
+        self.HEADER.pack_into(self.buffer, offset, sequence + 2, len(data))
+        return True
+
+    def read(self, slot: int) -> Optional[bytes]:
+        """
+        スロットのデータを読む(まだ書き込まれていない場合や、読めなかった場合はNone)
+        """
+        offset = slot * self.slot_size
+        start = offset + self.HEADER.size
+        for _ in range(100):
+            sequence, length = self.HEADER.unpack_from(self.buffer, offset)
+            if sequence == 0:
+                return None
+            if sequence % 2:
+                time.sleep(0)
+                continue
+            data = self.buffer[start:start + length]
+            if self.HEADER.unpack_from(self.buffer, offset)[0] == sequence:
+                return data
+        return None
+
+
+class Metrics:
+    """
+    サーバ全体のメトリクスを集計し、Prometheusのテキスト形式で出力するクラス
+
+    - ルート(URLパターン)ごと、処理の段階ごとのレイテンシのヒストグラム
+    - ステータスコードごとのレスポンス数、受信 / 送信したバイト数
+    - 処理中の接続数、スレッド数
+
+    リクエストごとの計測値は、スレッドごとのShardにロックを取らずに加算し、render()でまとめる
+    Shardは接続を閉じる時にプロセス全体の集計(base)へ移す(ロックを取るのは接続ごとに1回)
+
+    preforkエンジンでは、各ワーカープロセスが共有メモリの自分のスロットに定期的にスナップショットを書き込み、
+    render()では全プロセスのスナップショットを合計して出力する
+    (どのプロセスがリクエストを受けても、同じ合計値が単調に増えていくように見える)
+    """
+
+    def __init__(self, enabled: bool = None):
+        if enabled is None:
+            enabled = getattr(settings, "METRICS_ENABLED", True)
+        self.enabled = enabled
+
+        self._lock = Lock()
+        self._local = threading.local()
+        # 計測中のスレッドのShard
+        self._shards: List[Shard] = []
+        # 閉じた接続の計測値をまとめたもの
+        self._base = Shard()
+        self.connections = 0
+        self.active_connections = 0
+        # render()の時に呼び出し、返ってきたメトリクスを出力に加える関数(ワーカープールの統計など)
+        self.collectors: List[Callable[[], List[Collected]]] = []
+
+        # preforkエンジンでスナップショットを書き込む共有メモリと、このプロセスのスロット
+        self.shared: Optional[SharedSnapshots] = None
+        self.slot: Optional[int] = None
+        # 前のワーカープロセスから引き継いだ、collectorのカウンタの値
+        self._carried: Dict[str, float] = {}
+        self._too_large_reported = False
+
+    def register_collector(self, collector: Callable[[], List[Collected]]) -> None:
+        self.collectors.append(collector)
+
+    def connection_opened(self) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self.connections += 1
+            self.active_connections += 1
+
+    def connection_closed(self) -> None:
+        """
+        接続数を減らし、このスレッドのShardをbaseに移す
+        (接続ごとにスレッドを生成する場合に、終了したスレッドのShardが溜まり続けないようにする)
+        """
+        if not self.enabled:
+            return
+        shard = getattr(self._local, "shard", None)
+        with self._lock:
+            self.active_connections -= 1
+            if shard is not None:
+                merge_shard(self._base, shard)
+                self._shards.remove(shard)
+        self._local.shard = None
+
+    def observe(self, route: str, status: int, bytes_in: int, bytes_out: int, stages: Dict[str, int]) -> None:
+        """
+        1リクエスト分の計測値を、このスレッドのShardに加算する
+        stagesには、計測した段階ごとの所要時間(ナノ秒)を渡す
+        ex) recv: 受信 / parse: パース / resolve: URL解決 / view: viewの実行 / build_header: ヘッダの構築(圧縮を含む) / send: 送信
+        stagesが空の場合(不正なリクエストへのエラーレスポンスなど)は、レイテンシは記録せずに数だけ数える
+        """
+        if not self.enabled:
+            return
+
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = Shard()
+            with self._lock:
+                self._shards.append(shard)
+
+        if stages:
+            histograms = shard.latencies.get(route)
+            if histograms is None:
+                histograms = shard.latencies[route] = {}
+            # リクエストごとに呼ばれるので、Histogram.observe()を呼ばずにその場で加算する
+            for stage, value_ns in (*stages.items(), ("total", sum(stages.values()))):
+                histogram = histograms.get(stage)
+                if histogram is None:
+                    histogram = histograms[stage] = Histogram()
+                histogram.counts[bisect_left(BUCKETS_NS, value_ns)] += 1
+                histogram.sum_ns += value_ns
+
+        shard.responses[status] = shard.responses.get(status, 0) + 1
+        shard.bytes_in += bytes_in
+        shard.bytes_out += bytes_out
+
+    def snapshot(self) -> dict:
+        """
+        このプロセスの集計結果を、共有メモリに書き込める形(marshalできる値だけ)で返す
+        """
+        merged = Shard()
+        with self._lock:
+            merge_shard(merged, self._base)
+            for shard in self._shards:
+                merge_shard(merged, shard)
+            connections, active_connections = self.connections, self.active_connections
+
+        collected = []
+        for collector in list(self.collectors):
+            for name, metric_type, description, value in collector():
+                if metric_type == "counter":
+                    value += self._carried.get(name, 0)
+                collected.append((name, metric_type, description, value))
+
+        return {
+            "latencies": {
+                route: {stage: (h.counts, h.sum_ns) for stage, h in histograms.items()}
+                for route, histograms in merged.latencies.items()
+            },
+            "responses": merged.responses,
+            "bytes_in": merged.bytes_in,
+            "bytes_out": merged.bytes_out,
+            "connections": connections,
+            "active_connections": active_connections,
+            "threads": threading.active_count(),
+            "collected": collected,
+        }
+
+    def share(self, slots: int, slot_size: int = None) -> None:
+        """
+        preforkエンジンのマスタープロセスで、fork前に共有メモリを確保する
+        """
+        if not self.enabled:
+            return
+        if slot_size is None:
+            slot_size = getattr(settings, "METRICS_SHARED_SLOT_SIZE", 1024 * 1024)
+        self.shared = SharedSnapshots(slots, slot_size)
+
+    def attach(self, slot: int) -> None:
+        """
+        preforkエンジンのワーカープロセスで、自分のスロットを決めてスナップショットの書き込みを始める
+        再起動したワーカープロセスは、前のプロセスが最後に書き込んだ値から数え始める(合計値が減らないようにする)
+        """
+        if self.shared is None:
+            return
+        self.slot = slot
+
+        data = self.shared.read(slot)
+        if data is not None:
+            previous = marshal.loads(data)
+            with self._lock:
+                merge_shard(self._base, shard_from_snapshot(previous))
+                self.connections += previous["connections"]
+            self._carried = {
+                name: value for name, metric_type, _, value in previous["collected"] if metric_type == "counter"
+            }
+
+        interval = getattr(settings, "METRICS_PUBLISH_INTERVAL", 1.0)
+        Thread(target=self._publish_loop, args=(interval,), name="henango-metrics", daemon=True).start()
+
+    def publish(self) -> None:
+        """
+        このプロセスのスナップショットを共有メモリに書き込む
+        """
+        if self.shared is None or self.slot is None:
+            return
+        if not self.shared.write(self.slot, marshal.dumps(self.snapshot())) and not self._too_large_reported:
+            self._too_large_reported = True
+            logger.warning("=== Metrics: スナップショットが METRICS_SHARED_SLOT_SIZE を超えたため書き込めません ===")
+
+    def _publish_loop(self, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            self.publish()
+
+    def render(self) -> str:
+        """
+        Prometheusのテキスト形式(text/plain; version=0.0.4)で出力する
+        """
+        if self.shared is not None and self.slot is not None:
+            # 自分の最新の値を書き込んでから、全プロセスの値を読んで合計する
+            self.publish()
+            snapshots = []
+            for slot in range(self.shared.slots):
+                data = self.shared.read(slot)
+                if data is not None:
+                    snapshots.append(marshal.loads(data))
+            total = merge_snapshots(snapshots)
+            processes = len(snapshots)
+        else:
+            total = self.snapshot()
+            processes = 1
+
+        lines = [
+            "# HELP henango_request_duration_seconds Request latency by route and processing stage.",
+            "# TYPE henango_request_duration_seconds histogram",
+        ]
+        for route, histograms in sorted(total["latencies"].items()):
+            for stage, (counts, sum_ns) in sorted(histograms.items()):
+                labels = f'route="{escape_label(route)}",stage="{stage}"'
+                cumulative = 0
+                for bucket, bucket_count in zip(BUCKETS, counts):
+                    cumulative += bucket_count
+                    lines.append(f'henango_request_duration_seconds_bucket{{{labels},le="{bucket}"}} {cumulative}')
+                count = sum(counts)
+                lines.append(f'henango_request_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+                lines.append(f"henango_request_duration_seconds_sum{{{labels}}} {sum_ns / 1e9}")
+                lines.append(f"henango_request_duration_seconds_count{{{labels}}} {count}")
+
+        lines += [
+            "# HELP henango_responses_total Responses by status code.",
+            "# TYPE henango_responses_total counter",
+        ]
+        for status, count in sorted(total["responses"].items()):
+            lines.append(f'henango_responses_total{{status="{status}"}} {count}')
+
+        lines += (
+            format_metric("henango_received_bytes_total", "counter", "Bytes received in request heads and bodies.", total["bytes_in"])
+            + format_metric("henango_sent_bytes_total", "counter", "Bytes sent in responses.", total["bytes_out"])
+            + format_metric("henango_connections_total", "counter", "Accepted connections.", total["connections"])
+            + format_metric("henango_active_connections", "gauge", "Connections currently open.", total["active_connections"])
+            + format_metric("henango_threads", "gauge", "Threads currently alive in all worker processes.", total["threads"])
+            + format_metric("henango_processes", "gauge", "Worker processes reporting metrics.", processes)
+        )
+        for name, metric_type, description, value in total["collected"]:
+            lines += format_metric(name, metric_type, description, value)
+        return "\n".join(lines) + "\n"
+
+
+def merge_shard(into: Shard, shard: Shard) -> None:
+    """
+    shardの計測値をintoに加算する
+    """
+    for route, histograms in list(shard.latencies.items()):
+        into_histograms = into.latencies.setdefault(route, {})
+        for stage, histogram in list(histograms.items()):
+            into_histogram = into_histograms.get(stage)
+            if into_histogram is None:
+                into_histogram = into_histograms[stage] = Histogram()
+            into_histogram.counts = [a + b for a, b in zip(into_histogram.counts, histogram.counts)]
+            into_histogram.sum_ns += histogram.sum_ns
+    for status, count in list(shard.responses.items()):
+        into.responses[status] = into.responses.get(status, 0) + count
+    into.bytes_in += shard.bytes_in
+    into.bytes_out += shard.bytes_out
+
+
+def shard_from_snapshot(snapshot: dict) -> Shard:
+    """
+    snapshot()で生成した値から、計測値(Shard)を復元する
+    """
+    shard = Shard()
+    for route, histograms in snapshot["latencies"].items():
+        for stage, (counts, sum_ns) in histograms.items():
+            histogram = shard.latencies.setdefault(route, {})[stage] = Histogram()
+            histogram.counts = list(counts)
+            histogram.sum_ns = sum_ns
+    shard.responses = dict(snapshot["responses"])
+    shard.bytes_in = snapshot["bytes_in"]
+    shard.bytes_out = snapshot["bytes_out"]
+    return shard
+
+
+def merge_snapshots(snapshots: List[dict]) -> dict:
+    """
+    複数のプロセスのスナップショットを合計する
+    """
+    merged = Shard()
+    total = {"connections": 0, "active_connections": 0, "threads": 0}
+    collected: Dict[str, list] = {}
+    for snapshot in snapshots:
+        merge_shard(merged, shard_from_snapshot(snapshot))
+        for key in total:
+            total[key] += snapshot[key]
+        for name, metric_type, description, value in snapshot["collected"]:
+            if name not in collected:
+                collected[name] = [name, metric_type, description, value]
+            elif name.endswith("_max"):
+                collected[name][3] = max(collected[name][3], value)
+            else:
+                collected[name][3] += value
+
+    return {
+        "latencies": {
+            route: {stage: (h.counts, h.sum_ns) for stage, h in histograms.items()}
+            for route, histograms in merged.latencies.items()
+        },
+        "responses": merged.responses,
+        "bytes_in": merged.bytes_in,
+        "bytes_out": merged.bytes_out,
+        "collected": [tuple(metric) for metric in collected.values()],
+        **total,
+    }
+
+
+def format_metric(name: str, metric_type: str, description: str, value) -> List[str]:
+    """
+    ラベルのない1つのメトリクスを、Prometheusのテキスト形式の行にする
+    """
+    return [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}", f"{name} {value}"]
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# サーバ全体で共有するインスタンス
+metrics = Metrics()
@@ -0,0 +1,180 @@
+import socket
+import time
+from queue import Queue, Full
+from threading import Thread, Lock
+from typing import List, Tuple
+
+import settings
+from henango.server.metrics import Collected, metrics
+from henango.server.worker import Worker
+
+
+class WorkerPool:
+    """
+    固定数のワーカースレッドと、接続を受け渡すための上限つきキューを管理するクラス
+    """
+
+    # キューが満杯の時にクライアントへ返すレスポンス
+    SERVICE_UNAVAILABLE_RESPONSE = (
+        b"HTTP/1.1 503 Service Unavailable\r\n"
+        b"Content-Length: 0\r\n"
+        b"Retry-After: 1\r\n"
+        b"Connection: Close\r\n"
+        b"\r\n"
+    )
+
+    def __init__(self, size: int = None, queue_size: int = None, policy: str = None, keep_alive_timeout: float = None):
+        if size is None:
+            size = getattr(settings, "WORKER_POOL_SIZE", 16)
+        if keep_alive_timeout is None:
+            keep_alive_timeout = min(
+                getattr(settings, "KEEP_ALIVE_TIMEOUT", 5), getattr(settings, "WORKER_POOL_KEEP_ALIVE_TIMEOUT", 1)
+            )
+        if queue_size is None:
+            queue_size = getattr(settings, "WORKER_QUEUE_SIZE", 64)
+        if policy is None:
+            policy = getattr(settings, "WORKER_QUEUE_FULL_POLICY", "block")
+        if policy not in ("block", "reject"):
+            raise ValueError(f"unknown WORKER_QUEUE_FULL_POLICY: {policy}")
+
+        self.size = size
+        self.policy = policy
+        # keep-aliveで次のリクエストを待つ間もスレッドを占有するので、スレッドごとの接続より短く区切る
+        self.keep_alive_timeout = keep_alive_timeout
+        self.queue = Queue(maxsize=queue_size)
+        self.threads = []
+
+        # 統計情報
+        self._lock = Lock()
+        self._busy = 0
+        self._max_busy = 0
+        self._accepted = 0
+        self._rejected = 0
+        self._dequeued = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def start(self) -> None:
+        """
+        ワーカースレッドを起動する
+        """
+        for i in range(self.size):
+            thread = Thread(target=self._work, name=f"henango-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+        # 飽和度とキュー待ち時間をメトリクスに含める
+        metrics.register_collector(self.collect_metrics)
+
+    def submit(self, client_socket: socket, address: Tuple[str, int]) -> bool:
+        """
+        接続済みのsocketをキューに積む
+        キューが満杯の場合、policyが"block"なら空きが出るまで待ち(= acceptを止めてbacklogで待たせる)、
+        "reject"なら503を返して接続を閉じる
+        受け付けた場合はTrue、拒否した場合はFalseを返す
+        """
+        item = (client_socket, address, time.monotonic())
+        try:
+            if self.policy == "block":
+                self.queue.put(item)
+            else:
+                self.queue.put_nowait(item)
+        except Full:
+            with self._lock:
+                self._rejected += 1
+            self.reject(client_socket)
+            return False
+
+        with self._lock:
+            self._accepted += 1
+        return True
+
+    def reject(self, client_socket: socket) -> None:
+        """
+        リクエストを読まずに503を返して接続を閉じる
+        """
+        try:
+            client_socket.sendall(self.SERVICE_UNAVAILABLE_RESPONSE)
+        except OSError:
+            pass
+        finally:
+            client_socket.close()
+
+    def has_waiting(self) -> bool:
+        """
+        キューに処理待ちの接続があるかどうか
+        """
+        return not self.queue.empty()
+
+    def stats(self) -> dict:
+        """
+        プールの飽和度とキュー待ち時間の統計を返す
+        """
+        with self._lock:
+            return {
+                "size": self.size,
+                "busy": self._busy,
+                "max_busy": self._max_busy,
+                "saturation": self._busy / self.size if self.size else 0.0,
+                "queue_depth": self.queue.qsize(),
+                "queue_size": self.queue.maxsize,
+                "accepted": self._accepted,
+                "rejected": self._rejected,
+                "dequeued": self._dequeued,
+                "queue_wait_total": self._wait_total,
+                "queue_wait_avg": self._wait_total / self._dequeued if self._dequeued else 0.0,
+                "queue_wait_max": self._wait_max,
+            }
+
+    def collect_metrics(self) -> List[Collected]:
+        """
+        stats()の内容を、メトリクスとして返す
+        (飽和度は henango_pool_busy_threads / henango_pool_threads で求める。
+        preforkエンジンでは全プロセスの値を合計するので、比率そのものは出力しない)
+        """
+        stats = self.stats()
+        return [
+            ("henango_pool_threads", "gauge", "Worker threads in the pool.", stats["size"]),
+            ("henango_pool_busy_threads", "gauge", "Pool threads handling a connection.", stats["busy"]),
+            ("henango_pool_busy_threads_max", "gauge", "Most pool threads ever busy at once.", stats["max_busy"]),
+            ("henango_pool_queue_depth", "gauge", "Connections waiting for a pool thread.", stats["queue_depth"]),
+            ("henango_pool_queue_size", "gauge", "Capacity of the pool queue.", stats["queue_size"]),
+            ("henango_pool_accepted_total", "counter", "Connections queued to the pool.", stats["accepted"]),
+            (
+                "henango_pool_rejected_total", "counter",
+                "Connections rejected with 503 because the queue was full.", stats["rejected"],
+            ),
+            (
+                "henango_pool_queue_wait_seconds_sum", "counter",
+                "Total time connections waited in the queue.", stats["queue_wait_total"],
+            ),
+            ("henango_pool_queue_wait_seconds_count", "counter", "Connections taken off the queue.", stats["dequeued"]),
+            (
+                "henango_pool_queue_wait_seconds_max", "gauge",
+                "Longest time a connection waited in the queue.", stats["queue_wait_max"],
+            ),
+        ]
+
+    def _work(self) -> None:
+        """
+        キューから接続を取り出して処理し続ける
+        """
+        while True:
+            client_socket, address, enqueued_at = self.queue.get()
+            wait = time.monotonic() - enqueued_at
+
+            with self._lock:
+                self._busy += 1
+                self._max_busy = max(self._max_busy, self._busy)
+                self._dequeued += 1
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+
+            try:
+                # スレッドは起動せず、このワーカースレッド上で接続を処理する
+                Worker(
+                    client_socket, address, keep_alive_timeout=self.keep_alive_timeout, should_release=self.has_waiting
+                ).run()
+            finally:
+                with self._lock:
+                    self._busy -= 1
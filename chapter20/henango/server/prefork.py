@@ -0,0 +1,245 @@
+import logging
+import mmap
+import os
+import signal
+import socket
+import struct
+import sys
+import time
+from typing import Dict, Optional, Tuple
+
+import settings
+from henango.server.access_log import access_log
+from henango.server.metrics import metrics
+from henango.server.server import Server
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessStats:
+    """
+    ワーカープロセスごとの統計情報を、fork前に確保した共有メモリに記録するクラス
+    1つのプロセスが1行(スロット)を持ち、各フィールドは書き込むプロセスが1つに決まっているのでロックは使わない
+    - pid / started_at / restarts: マスタープロセスが書き込む
+    - accepted: そのスロットのワーカープロセスが書き込む
+    """
+
+    FIELDS = ("pid", "started_at", "restarts", "accepted")
+    ROW = struct.Struct("4q")
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self.buffer = mmap.mmap(-1, self.ROW.size * slots)
+
+    def get(self, slot: int) -> dict:
+        return dict(zip(self.FIELDS, self.ROW.unpack_from(self.buffer, slot * self.ROW.size)))
+
+    def set(self, slot: int, **values) -> None:
+        row = self.get(slot)
+        row.update(values)
+        self.ROW.pack_into(self.buffer, slot * self.ROW.size, *(row[field] for field in self.FIELDS))
+
+    def increment(self, slot: int, field: str) -> None:
+        offset = slot * self.ROW.size + self.FIELDS.index(field) * 8
+        (value,) = struct.unpack_from("q", self.buffer, offset)
+        struct.pack_into("q", self.buffer, offset, value + 1)
+
+    def aggregate(self) -> dict:
+        """
+        全プロセスの統計を合計したものと、プロセスごとの統計を返す
+        """
+        processes = [self.get(slot) for slot in range(self.slots)]
+        return {
+            "processes": len(processes),
+            "accepted": sum(process["accepted"] for process in processes),
+            "restarts": sum(process["restarts"] for process in processes),
+            "per_process": processes,
+        }
+
+
+class PreforkWorkerServer(Server):
+    """
+    ワーカープロセス内で動くServer
+    受け付けた接続の数を共有メモリの自分のスロットに記録する
+    """
+
+    def __init__(self, stats: ProcessStats, slot: int):
+        self.stats = stats
+        self.slot = slot
+
+    def accept(self, server_socket: socket) -> Tuple[socket, Tuple[str, int]]:
+        client = super().accept(server_socket)
+        self.stats.increment(self.slot, "accepted")
+        return client
+
+
+class PreforkServer:
+    """
+    複数のワーカープロセスで接続を処理するサーバ
+    GILの制約を受けずに複数のCPUコアを使うため、マスタープロセスがワーカープロセスをforkし、
+    各ワーカープロセスはそれぞれaccept()を呼んで接続を処理する(プロセス内の処理方式はWORKER_MODEに従う)
+
+    - マスタープロセスは、終了したワーカープロセスを再起動する
+    - SIGTERM / SIGINT を受け取ると、ワーカープロセスに新しい接続の受け付けを止めさせ、処理中の接続が終わるのを待って終了する
+    - SIGUSR1 を受け取ると、全プロセスの統計情報を表示する
+    """
+
+    # 起動してからこの秒数以内に終了したワーカープロセスは、少し待ってから再起動する
+    RESTART_BACKOFF = 1.0
+
+    def __init__(self, processes: int = None, reuse_port: bool = None, graceful_timeout: float = None):
+        if processes is None:
+            processes = getattr(settings, "PREFORK_PROCESSES", None) or os.cpu_count() or 1
+        if reuse_port is None:
+            reuse_port = getattr(settings, "PREFORK_REUSE_PORT", False)
+        if graceful_timeout is None:
+            graceful_timeout = getattr(settings, "PREFORK_GRACEFUL_TIMEOUT", 10)
+
+        self.processes = processes
+        self.reuse_port = reuse_port
+        self.graceful_timeout = graceful_timeout
+        self.stats = ProcessStats(processes)
+        # 各ワーカープロセスのメトリクスを合計して出力できるよう、fork前に共有メモリを確保する
+        metrics.share(processes)
+        # pid -> スロット番号
+        self.children: Dict[int, int] = {}
+        self.stopping = False
+
+    def serve(self):
+        """
+        ワーカープロセスを起動し、終了するまで監視する
+        """
+
+        logger.info(
+            "=== PreforkServer: サーバを起動します processes: %d reuse_port: %s ===", self.processes, self.reuse_port
+        )
+
+        # SO_REUSEPORTを使わない場合は、マスタープロセスでsocketを生成し、ワーカープロセスに引き継ぐ
+        # (使う場合は、ワーカープロセスがそれぞれsocketを生成し、カーネルが接続を振り分ける)
+        server_socket = None if self.reuse_port else Server().create_server_socket()
+
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.log_stats())
+        signal.signal(signal.SIGALRM, self.handle_graceful_timeout)
+
+        try:
+            for slot in range(self.processes):
+                self.spawn(slot, server_socket)
+
+            while self.children:
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
+                    break
+
+                slot = self.children.pop(pid, None)
+                if slot is None or self.stopping:
+                    continue
+
+                logger.warning("=== PreforkServer: ワーカープロセスが終了しました pid: %d status: %d ===", pid, status)
+                # 起動直後に終了し続ける場合に、再起動を繰り返してCPUを使い切らないようにする
+                if time.time() - self.stats.get(slot)["started_at"] < self.RESTART_BACKOFF:
+                    time.sleep(self.RESTART_BACKOFF)
+                self.stats.increment(slot, "restarts")
+                self.spawn(slot, server_socket)
+
+        finally:
+            signal.alarm(0)
+            if server_socket is not None:
+                server_socket.close()
+            self.log_stats()
+            logger.info("=== PreforkServer: サーバを停止します ===")
+
+    def spawn(self, slot: int, server_socket: Optional[socket.socket]) -> None:
+        """
+        ワーカープロセスを1つforkする
+        """
+        # fork前に出力を書き出しておかないと、子プロセスでも同じ内容が出力される
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 1
+            try:
+                self.run_worker(slot, server_socket)
+                exit_code = 0
+            except BaseException:
+                logger.exception("=== PreforkServer: ワーカープロセスでエラーが発生しました ===")
+            finally:
+                # os._exitではatexitの処理が行われないので、アクセスログはここで書き出しておく
+                access_log.flush()
+                # 再起動したワーカープロセスが続きから数えられるよう、最後の値を書き込んでおく
+                metrics.publish()
+                sys.stdout.flush()
+                os._exit(exit_code)
+
+        self.children[pid] = slot
+        self.stats.set(slot, pid=pid, started_at=int(time.time()))
+        logger.info("=== PreforkServer: ワーカープロセスを起動しました slot: %d pid: %d ===", slot, pid)
+
+    def run_worker(self, slot: int, server_socket: Optional[socket.socket]) -> None:
+        """
+        ワーカープロセスの処理
+        SIGTERMを受け取るまで接続を受け付け、受け取ったら処理中の接続が終わるのを待って戻る
+        """
+        # 端末でのCtrl+Cはプロセスグループ全体に届くので、ワーカープロセスでは無視してマスタープロセスに任せる
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        signal.signal(signal.SIGALRM, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, self.handle_worker_stop)
+
+        if server_socket is None:
+            server_socket = Server().create_server_socket(reuse_port=True)
+
+        # メトリクスのスナップショットを、共有メモリの自分のスロットに書き込み始める
+        metrics.attach(slot)
+
+        server = PreforkWorkerServer(self.stats, slot)
+        try:
+            server.serve_forever(server_socket)
+        except SystemExit:
+            pass
+        finally:
+            # 新しい接続の受け付けを止めてから、処理中の接続が終わるのを待つ
+            server_socket.close()
+            server.wait_for_workers()
+
+    def handle_stop(self, signum, frame) -> None:
+        """
+        マスタープロセスが終了のシグナルを受け取った時の処理
+        """
+        if self.stopping:
+            return
+        self.stopping = True
+        logger.info("=== PreforkServer: ワーカープロセスを停止します signal: %s ===", signal.Signals(signum).name)
+        self.signal_children(signal.SIGTERM)
+        # 猶予時間を過ぎても終了しないワーカープロセスは強制終了する
+        signal.alarm(max(1, int(self.graceful_timeout)))
+
+    def handle_graceful_timeout(self, signum, frame) -> None:
+        logger.warning("=== PreforkServer: 終了しないワーカープロセスを強制終了します ===")
+        self.signal_children(signal.SIGKILL)
+
+    @staticmethod
+    def handle_worker_stop(signum, frame) -> None:
+        # accept()で待っているメインスレッドに例外を送り、受け付けのループを抜ける
+        raise SystemExit(0)
+
+    def signal_children(self, signum: int) -> None:
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def log_stats(self) -> None:
+        stats = self.stats.aggregate()
+        logger.info(
+            "=== PreforkServer: processes: %d accepted: %d restarts: %d ===",
+            stats["processes"], stats["accepted"], stats["restarts"],
+        )
+        for slot, process in enumerate(stats["per_process"]):
+            logger.info(
+                "    slot: %d pid: %d accepted: %d restarts: %d",
+                slot, process["pid"], process["accepted"], process["restarts"],
+            )
@@ -0,0 +1,479 @@
+import asyncio
+import time
+from email.utils import formatdate
+from typing import BinaryIO, Iterator, NamedTuple, Tuple, Union
+
+import settings
+from henango.http.compression import (
+    add_vary,
+    choose_encoding,
+    compress,
+    compress_stream,
+    compression_cache,
+    encoded_etag,
+    is_compressible,
+)
+from henango.http.headers import Headers
+from henango.http.request import HTTPRequest
+from henango.http.response import ByteRangesResponse, FileResponse, HTTPResponse
+from henango.server.reader import BadRequest, parse_content_length
+
+
+class FileSegment(NamedTuple):
+    """
+    ファイルのうち、sendfileで送信する範囲
+    """
+    file: BinaryIO
+    offset: int
+    count: int
+
+
+class HTTPProtocol:
+    """
+    HTTPリクエストのパースとレスポンスの構築を行うクラス
+    サーバエンジン(スレッド / asyncio)によらず共通の処理をまとめている
+    """
+    # 状態を持たないので、継承先が __slots__ を使えるように空にしておく
+    __slots__ = ()
+
+    # 拡張子とMIME Typeの対応
+    MIME_TYPES = {
+        "html": "text/html; charset=UTF-8",
+        "css": "text/css",
+        "js": "text/javascript",
+        "json": "application/json",
+        "txt": "text/plain; charset=UTF-8",
+        "png": "image/png",
+        "jpg": "image/jpg",
+        "jpeg": "image/jpeg",
+        "gif": "image/gif",
+        "svg": "image/svg+xml",
+        "webp": "image/webp",
+        "ico": "image/x-icon",
+        "mp4": "video/mp4",
+        "webm": "video/webm",
+        "mp3": "audio/mpeg",
+        "ogg": "audio/ogg",
+        "wav": "audio/wav",
+        "pdf": "application/pdf",
+        "zip": "application/zip",
+        "woff2": "font/woff2",
+    }
+    
+    # ステータスコードとステータスラインの対応
+    STATUS_LINES = {
+        200: "200 OK",
+        206: "206 Partial Content",
+        302: "302 Found",
+        304: "304 Not Modified",
+        400: "400 Bad Request",
+        404: "404 Not Found",
+        405: "405 Method Not Allowd",
+        413: "413 Payload Too Large",
+        416: "416 Range Not Satisfiable",
+        431: "431 Request Header Fields Too Large",
+        503: "503 Service Unavailable",
+    }
+    
+    def parse_http_request(self, request: bytes) -> HTTPRequest:
+        """
+        HTTPリクエストを
+        1. method: str
+        2. path: str
+        3. http_version: str
+        4. request_header: Headers
+        5. request_body: bytes
+        に分割/変換して返す
+        正規表現は使わず、bytesのまま区切り位置を探してから必要な部分だけをデコードする
+        (Cookieのパースは、viewが request.cookies を参照した時に行う)
+        """
+
+        # リクエスト全体を
+        # 1. リクエストライン
+        # 2. リクエストヘッダ
+        # 3. リクエストボディ
+        # に分けてパースする
+        line_end = request.find(b"\r\n")
+        header_end = request.find(b"\r\n\r\n")
+        if line_end == -1 or header_end == -1:
+            raise BadRequest()
+
+        # さらにリクエストラインをパースする
+        # (UTF-8としてデコードできないリクエストラインは不正なリクエストとして扱う)
+        try:
+            request_line = request[:line_end].decode().split(" ")
+        except UnicodeDecodeError:
+            raise BadRequest()
+        if len(request_line) != 3:
+            raise BadRequest()
+        method, path, http_version = request_line
+
+        # リクエストヘッダを (ヘッダ名, 値) のリストにパースする
+        # 名前も値もbytesのまま保持し、デコードはviewが参照した時に行う
+        # ヘッダ名はtokenでなければならない
+        # ("Transfer-Encoding : chunked" のように空白を含む名前を受け付けると、
+        #   前段のプロキシとボディの長さの解釈がずれてしまうので、BadRequestとする)
+        header_items = []
+        if header_end > line_end:
+            for header_row in request[line_end + 2:header_end].split(b"\r\n"):
+                name, colon, value = header_row.partition(b":")
+                if not colon or not name or name.translate(None, TOKEN_CHARS):
+                    raise BadRequest()
+                header_items.append((name, value))
+
+        return HTTPRequest(
+            method=method,
+            path=path,
+            http_version=http_version,
+            headers=Headers.from_raw(header_items),
+            body=request[header_end + 4:],
+        )
+    
+    def build_response_line(self, response: HTTPResponse) -> str:
+        """
+        レスポンスラインを構築する
+        """
+        status_line = self.STATUS_LINES[response.status_code]
+        return f"HTTP/1.1 {status_line}\r\n"
+    
+    def get_body_framing(self, request: HTTPRequest) -> Tuple[int, bool]:
+        """
+        リクエストボディの長さの指定方法を取得する
+        (Content-Lengthの値, chunked形式かどうか) を返す
+        前段のプロキシと長さの解釈がずれないよう、曖昧な指定は全てBadRequestとする
+        - Transfer-EncodingとContent-Lengthの両方がある
+        - Transfer-Encodingがchunkedだけではない(他の符号化には対応していない)
+        - Content-Lengthが数字だけではない、または複数の値が食い違っている
+        """
+        try:
+            transfer_encodings = request.headers.getall("Transfer-Encoding")
+            content_lengths = request.headers.getall("Content-Length")
+        except UnicodeDecodeError:
+            raise BadRequest()
+
+        if transfer_encodings:
+            if content_lengths:
+                raise BadRequest()
+            codings = [coding.strip(" \t").lower() for value in transfer_encodings for coding in value.split(",")]
+            if codings != ["chunked"]:
+                raise BadRequest()
+            return 0, True
+
+        return parse_content_length(content_lengths), False
+
+    def build_error_response(self, status_code: int) -> bytes:
+        """
+        リクエストを最後まで読めなかった場合に返すエラーレスポンスを構築する
+        """
+        status_line = self.STATUS_LINES[status_code]
+        response = HTTPResponse(
+            status_code=status_code,
+            content_type="text/html; charset=UTF-8",
+            body=f"<html><body><h1>{status_line}</h1></body></html>",
+        )
+        return self.build_response(response, HTTPRequest())
+
+    def call_view(self, view, request: HTTPRequest) -> HTTPResponse:
+        """
+        viewを呼び出す
+        async defで定義されたviewは、このスレッドでイベントループを動かして最後まで実行する
+        (asyncioのエンジンでは、AsyncWorkerがイベントループ上で実行するように上書きしている)
+        """
+        if asyncio.iscoroutinefunction(view):
+            return asyncio.run(view(request))
+        return view(request)
+
+    def should_keep_alive(self, request: HTTPRequest) -> bool:
+        """
+        レスポンス送信後も接続を維持するかどうかを判定する
+        HTTP/1.1ではクライアントが Connection: close を送ってこない限り維持し、
+        HTTP/1.0では Connection: keep-alive が送られてきた場合のみ維持する
+        """
+        if not getattr(settings, "KEEP_ALIVE", True):
+            return False
+
+        connection = request.headers.get("Connection", "").lower()
+        if request.http_version == "HTTP/1.1":
+            return connection != "close"
+        return connection == "keep-alive"
+
+    def get_content_type(self, path: str) -> str:
+        """
+        pathの拡張子からContent-Typeを特定する
+        """
+        path = path.partition("?")[0]
+        # pathから拡張子を取得
+        if "." in path:
+            ext = path.rsplit(".", maxsplit=1)[-1].lower()
+            # 拡張子からMIME Typeを取得
+            # 知らない・対応していない拡張子の場合はoctet-streamとする
+            return self.MIME_TYPES.get(ext, "application/octet-stream")
+        else:
+            # pathに拡張子がない場合はhtml扱いとする
+            return "text/html; charset=UTF-8"
+
+    def build_response_header(self, response: HTTPResponse, request: HTTPRequest, keep_alive: bool = False) -> bytes:
+        """
+        レスポンスヘッダを構築する
+        固定のヘッダはエンコード済みの定数を使い、最後に1回のjoinでまとめる
+        """
+
+        # Coontent_Typeが指定されていない場合はpathから特定する
+        if response.content_type is None:
+            response.content_type = self.get_content_type(request.path)
+
+        # multipart/byteranges の各パートのContent-Typeも同様
+        if isinstance(response, ByteRangesResponse) and response.part_content_type is None:
+            response.part_content_type = self.get_content_type(request.path)
+
+        # 基本ヘッダの生成
+        parts = [http_date_header(), SERVER_HEADER]
+        if response.status_code == 304:
+            # 304はボディを持たないので、長さも送らない
+            pass
+        elif response.is_streaming:
+            parts.append(CHUNKED_HEADER)
+        else:
+            parts.append(b"Content-Length: %d\r\n" % response.content_length)
+        parts.append(keep_alive_header() if keep_alive else CONNECTION_CLOSE_HEADER)
+        parts.append(f"Content-Type: {response.content_type}\r\n".encode())
+
+        # Cookieヘッダの生成
+        for cookie in response.cookies:
+            cookie_header = f"Set-Cookie: {cookie.name}={cookie.value}"
+            if cookie.expires is not None:
+                cookie_header += f"; Expires={cookie.expires.strftime('%a, %d %b %Y %H:%M:%S GMT')}"
+            if cookie.max_age is not None:
+                cookie_header += f"; Max-Age={cookie.max_age}"
+            if cookie.domain:
+                cookie_header += f"; Domain={cookie.domain}"
+            if cookie.path:
+                cookie_header += f"; Path={cookie.path}"
+            if cookie.secure:
+                cookie_header += "; Secure"
+            if cookie.http_only:
+                cookie_header += "; HttpOnly"
+
+            parts.append(f"{cookie_header}\r\n".encode())
+
+        # その他ヘッダの生成(bytesのまま組み立てる)
+        for header_name, header_value in response.headers.raw_items():
+            parts += (header_name, b": ", header_value.strip(), b"\r\n")
+
+        return b"".join(parts)
+
+    def build_response_head(self, response: HTTPResponse, request: HTTPRequest, keep_alive: bool = False) -> bytes:
+        """
+        レスポンスライン + ヘッダ + 空行 を構築する
+        """
+        # レスポンスボディを変換(str -> bytes)
+        if isinstance(response.body, str):
+            response.body = response.body.encode()
+
+        # レスポンスラインを生成
+        response_line = STATUS_LINE_BYTES.get(response.status_code)
+        if response_line is None:
+            response_line = self.build_response_line(response).encode()
+
+        response_header = self.build_response_header(response, request, keep_alive)
+
+        return b"".join((response_line, response_header, b"\r\n"))
+
+    def build_response(self, response: HTTPResponse, request: HTTPRequest, keep_alive: bool = False) -> bytes:
+        """
+        送信するレスポンス全体を構築する
+        (ストリーミング / ファイルの場合はボディを含まない)
+        """
+        response_head = self.build_response_head(response, request, keep_alive)
+
+        if response.is_streaming or isinstance(response, FileResponse):
+            return response_head
+        return response_head + response.body
+
+    def iter_response(
+        self, response: HTTPResponse, request: HTTPRequest, keep_alive: bool = False, compress: bool = True
+    ) -> Iterator[Union[Tuple[bytes, ...], FileSegment]]:
+        """
+        送信するレスポンスを、先頭から順に返す
+        返したバッファのタプルは、連結せずに1回のまとまりとして送信する
+        - bodyがbytesの場合は、(ヘッダ, ボディ) を返す
+        - bodyがイテラブルの場合は、ヘッダを返した後にボディをチャンクごとに
+          Transfer-Encoding: chunked の形式で返していく
+        - FileResponseの場合は、ヘッダを返した後にsendfileで送信するファイルの範囲(FileSegment)を返す
+        compress=Falseの場合は、呼び出し側で既にcompress_response()を済ませているものとして圧縮しない
+        """
+        try:
+            # クライアントが対応していれば、ボディを圧縮する
+            if compress:
+                response = self.compress_response(response, request)
+
+            # HTTP/1.0のクライアントはchunkedを扱えないので、ボディを全て揃えてから送る
+            if response.is_streaming and request.http_version != "HTTP/1.1":
+                response.body = b"".join(self.encode_chunk(chunk) for chunk in response.body)
+
+            response_head = self.build_response_head(response, request, keep_alive)
+
+            if isinstance(response, FileResponse):
+                yield (response_head,)
+                for part in response.body_parts():
+                    if isinstance(part, bytes):
+                        yield (part,)
+                    else:
+                        yield FileSegment(response.file, *part)
+
+            elif response.is_streaming:
+                yield (response_head,)
+                for chunk in response.body:
+                    chunk = self.encode_chunk(chunk)
+                    # 長さ0のチャンクは終端を意味してしまうので送らない
+                    if chunk:
+                        yield b"%x\r\n" % len(chunk), chunk, b"\r\n"
+                yield (b"0\r\n\r\n",)
+
+            else:
+                yield response_head, response.body
+
+        finally:
+            # 送信に失敗した場合も含めて、開いたファイルは必ず閉じる
+            if isinstance(response, FileResponse):
+                response.close()
+
+    def compress_response(self, response: HTTPResponse, request: HTTPRequest) -> HTTPResponse:
+        """
+        テキストのレスポンスボディを、Accept-Encodingに応じてgzip / deflateで圧縮し、送信するレスポンスを返す
+        - ETagを持つレスポンスは、圧縮した結果を (path, ETag) ごとにキャッシュして使い回す
+        - ストリーミングの場合は、チャンクを順に圧縮しながら送る
+        - ファイル(FileResponse)は、ETagを持っていてCOMPRESSION_FILE_MAX_SIZE以下なら、
+          圧縮した結果をキャッシュしてボディとするレスポンスに置き換える(それより大きければそのまま送る)
+        - 範囲を指定したレスポンスや、既に圧縮済みのレスポンスはそのまま送る
+        - 304には、圧縮するかどうかに関わらずVaryだけを付与する
+        """
+        if not getattr(settings, "COMPRESSION_ENABLED", True):
+            return response
+        if response.status_code == 304:
+            # 304はボディを持たないが、200で返す場合と同じVaryを付与しておく
+            if response.content_type is None:
+                response.content_type = self.get_content_type(request.path)
+            if is_compressible(response.content_type):
+                add_vary(response.headers, "Accept-Encoding")
+            return response
+        if response.status_code in (204, 206) or "Content-Encoding" in response.headers:
+            return response
+
+        is_file = isinstance(response, FileResponse)
+        if is_file and (
+            isinstance(response, ByteRangesResponse)
+            or "ETag" not in response.headers
+            or response.length > getattr(settings, "COMPRESSION_FILE_MAX_SIZE", 1024 * 1024)
+        ):
+            return response
+
+        if response.content_type is None:
+            response.content_type = self.get_content_type(request.path)
+        if not is_compressible(response.content_type):
+            return response
+
+        if isinstance(response.body, str):
+            response.body = response.body.encode()
+        if not is_file and not response.is_streaming and len(response.body) < getattr(settings, "COMPRESSION_MIN_SIZE", 1024):
+            return response
+
+        # Accept-Encodingによってレスポンスが変わることを示す(viewが設定したVaryは残す)
+        add_vary(response.headers, "Accept-Encoding")
+
+        encoding = choose_encoding(request)
+        if encoding is None:
+            return response
+
+        if is_file:
+            return self.compress_file_response(response, request, encoding)
+
+        if response.is_streaming:
+            response.body = compress_stream(response.body, encoding)
+        elif "ETag" in response.headers:
+            response.body = compression_cache.compress(
+                request.path, response.headers["ETag"], response.body, encoding
+            )
+            response.headers["ETag"] = encoded_etag(response.headers["ETag"], encoding)
+        else:
+            response.body = compress(response.body, encoding)
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+    def compress_file_response(self, response: FileResponse, request: HTTPRequest, encoding: str) -> HTTPResponse:
+        """
+        ファイルの内容を圧縮した結果をボディとするレスポンスに置き換える
+        圧縮した結果はpathとETagごとにキャッシュするので、ファイルを読み込んで圧縮するのは最初の1回だけで済む
+        """
+        etag = response.headers["ETag"]
+        try:
+            compressed = compression_cache.get(request.path, etag, encoding)
+            if compressed is None:
+                response.file.seek(response.offset)
+                compressed = compress(response.file.read(response.length), encoding)
+                compression_cache.put(request.path, etag, encoding, compressed)
+        finally:
+            response.close()
+
+        headers = response.headers
+        headers["ETag"] = encoded_etag(etag, encoding)
+        headers["Content-Encoding"] = encoding
+        return HTTPResponse(
+            status_code=response.status_code,
+            headers=headers,
+            cookies=response.cookies,
+            content_type=response.content_type,
+            body=compressed,
+        )
+
+    def encode_chunk(self, chunk) -> bytes:
+        """
+        ストリーミングするボディのチャンクをbytesに変換する
+        """
+        if isinstance(chunk, str):
+            return chunk.encode()
+        return chunk
+
+
+# エンコード済みのステータスライン ex) 200 -> b"HTTP/1.1 200 OK\r\n"
+STATUS_LINE_BYTES = {
+    status_code: f"HTTP/1.1 {status_line}\r\n".encode() for status_code, status_line in HTTPProtocol.STATUS_LINES.items()
+}
+
+# ヘッダ名(token)に使える文字 (RFC 9110 5.6.2)
+TOKEN_CHARS = b"!#$%&'*+-.^_`|~0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+# 内容が変わらないヘッダは、エンコード済みのものを使い回す
+SERVER_HEADER = b"HOST: SigmaServer/0.1\r\n"
+CHUNKED_HEADER = b"Transfer-Encoding: chunked\r\n"
+CONNECTION_CLOSE_HEADER = b"Connection: Close\r\n"
+
+# (KEEP_ALIVE_TIMEOUT, エンコード済みのヘッダ)
+_keep_alive_header = (None, b"")
+
+
+def keep_alive_header() -> bytes:
+    """
+    Connection: keep-alive と Keep-Alive ヘッダを返す
+    """
+    global _keep_alive_header
+    timeout = getattr(settings, "KEEP_ALIVE_TIMEOUT", 5)
+    if _keep_alive_header[0] != timeout:
+        _keep_alive_header = (timeout, f"Connection: keep-alive\r\nKeep-Alive: timeout={timeout}\r\n".encode())
+    return _keep_alive_header[1]
+
+
+# (UNIX時間(秒), エンコード済みのDateヘッダ)
+_date_header = (0, b"")
+
+
+def http_date_header() -> bytes:
+    """
+    Dateヘッダを返す
+    Dateヘッダは秒単位なので、同じ秒の間は前回生成したものを使い回す
+    """
+    global _date_header
+    now = int(time.time())
+    if _date_header[0] != now:
+        _date_header = (now, f"Date: {formatdate(now, usegmt=True)}\r\n".encode())
+    return _date_header[1]
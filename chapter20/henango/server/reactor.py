@@ -0,0 +1,407 @@
+import logging
+import os
+import selectors
+import socket
+import time
+from typing import Iterator, List, Optional, Set, Tuple
+
+import settings
+from henango.server.access_log import access_log
+from henango.server.capture import request_capture
+from henango.server.metrics import StageTimer, metrics
+from henango.server.protocol import FileSegment, HTTPProtocol
+from henango.server.reader import BadRequest, HTTPRequestReader
+from henango.server.server import Server
+from henango.server.writer import send_buffers_nonblocking
+from henango.urls.resolver import URLResolver
+
+logger = logging.getLogger(__name__)
+
+
+class ReactorServer:
+    """
+    selectors(Linuxではepoll)で全ての接続を1スレッドで処理するWebサーバを表すクラス
+    接続ごとにスレッドもコルーチンも持たず、接続の状態(Connection)と受信バッファだけを保持するので、
+    遅いクライアントが多数つながっていてもメモリをあまり使わない
+
+    viewはこのスレッドでそのまま呼び出すため、時間のかかるviewがあると他の接続の処理も止まる
+    """
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.connections: Set["Connection"] = set()
+        # recvで受信するためのバッファ(1スレッドで処理するので、全接続で1つを使い回す)
+        self.recv_buffer = memoryview(bytearray(getattr(settings, "RECV_BUFFER_SIZE", 16 * 1024)))
+
+    def serve(self):
+        """
+        サーバを起動する
+        """
+
+        logger.info("=== ReactorServer: サーバを起動します ===")
+
+        try:
+            # socketを生成
+            server_socket = Server().create_server_socket()
+            server_socket.setblocking(False)
+            self.selector.register(server_socket, selectors.EVENT_READ)
+
+            while True:
+                # keep-aliveのタイムアウトを確認するため、接続がなくても定期的に戻ってくる
+                for key, events in self.selector.select(timeout=1.0):
+                    connection = key.data
+                    if connection is None:
+                        self.accept(server_socket)
+                    elif events & selectors.EVENT_READ:
+                        connection.on_readable()
+                    else:
+                        connection.on_writable()
+
+                self.close_idle_connections()
+
+        finally:
+            logger.info("=== ReactorServer: サーバを停止します ===")
+
+    def accept(self, server_socket: socket) -> None:
+        """
+        backlogに溜まっている接続をまとめて受け付ける
+        """
+        while True:
+            try:
+                (client_socket, address) = server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+
+            logger.debug("=== ReactorServer: クライアントとの接続が完了しました remote_address: %s ===", address)
+            client_socket.setblocking(False)
+            connection = Connection(self, client_socket, address)
+            # 接続だけ張って何も送らないクライアントの接続は、一定時間で閉じる
+            connection.deadline = time.monotonic() + getattr(settings, "REQUEST_READ_TIMEOUT", 5)
+            self.connections.add(connection)
+            metrics.connection_opened()
+            self.selector.register(client_socket, selectors.EVENT_READ, connection)
+
+    def set_events(self, connection: "Connection", events: int) -> None:
+        """
+        接続について、読み込み / 書き込みのどちらを待つかを切り替える
+        """
+        if connection.events != events:
+            self.selector.modify(connection.client_socket, events, connection)
+            connection.events = events
+
+    def remove(self, connection: "Connection") -> None:
+        self.selector.unregister(connection.client_socket)
+        self.connections.discard(connection)
+        metrics.connection_closed()
+
+    def close_idle_connections(self) -> None:
+        """
+        リクエストの受信中、またはkeep-aliveで次のリクエストを待っている接続のうち、タイムアウトしたものを閉じる
+        """
+        now = time.monotonic()
+        for connection in [c for c in self.connections if c.deadline is not None and c.deadline < now]:
+            connection.close()
+
+
+class Connection(HTTPProtocol):
+    """
+    ReactorServerが処理する1つの接続
+    ヘッダ受信中 -> (ボディ受信中 ->) レスポンス送信中 -> (keep-aliveなら)ヘッダ受信中 ... と状態を遷移し、
+    socketが読み書きできるようになるたびに、今の状態で進められるところまで処理を進める
+    """
+
+    READING_HEAD = "reading_head"
+    READING_BODY = "reading_body"
+    WRITING = "writing"
+
+    __slots__ = (
+        "reactor", "client_socket", "client_address", "events", "state", "closed", "deadline",
+        "reader", "handled_requests", "request_head", "request", "content_length", "chunked",
+        "keep_alive", "output", "pending", "segment", "started_at", "access", "sent",
+        "first_byte_at", "timer", "route", "received",
+    )
+
+    def __init__(self, reactor: ReactorServer, client_socket: socket, address: Tuple[str, int]):
+        self.reactor = reactor
+        self.client_socket = client_socket
+        self.client_address = address
+        self.events = selectors.EVENT_READ
+        self.state = self.READING_HEAD
+        self.closed = False
+        # リクエストの続き、またはkeep-aliveで次のリクエストを待つ期限(レスポンスの送信中はNone)
+        self.deadline: Optional[float] = None
+
+        # 受信したデータを溜めておき、リクエストの区切りを判定する
+        self.reader = HTTPRequestReader()
+        self.handled_requests = 0
+        # 受信中のリクエスト
+        self.request_head = b""
+        self.request = None
+        self.content_length = 0
+        self.chunked = False
+
+        # 送信中のレスポンス
+        self.keep_alive = False
+        self.output: Optional[Iterator] = None
+        # 送信しきれていないバッファ / ファイルの範囲
+        self.pending: List[memoryview] = []
+        self.segment: Optional[FileSegment] = None
+
+        # アクセスログに記録する内容
+        # 処理時間はヘッダを受信した時点から数え、accessには (method, path, ステータスコード) を入れる
+        self.started_at = 0
+        self.access: Optional[Tuple[str, str, int]] = None
+        self.sent = 0
+
+        # メトリクスに記録する内容
+        # 受信時間はリクエストの最初のデータを受信した時点から数え、処理の段階ごとの時間をtimerで計る
+        self.first_byte_at: Optional[int] = None
+        self.timer: Optional[StageTimer] = None
+        self.route = ""
+        self.received = 0
+
+    def on_readable(self) -> None:
+        """
+        受信したデータをバッファに追加し、リクエストの処理を進める
+        """
+        if self.closed:
+            return
+
+        try:
+            size = self.client_socket.recv_into(self.reactor.recv_buffer)
+        except (BlockingIOError, InterruptedError):
+            return
+        except ConnectionError:
+            self.close()
+            return
+
+        if size == 0:
+            self.close()
+            return
+
+        if self.first_byte_at is None:
+            self.first_byte_at = time.perf_counter_ns()
+        self.reader.feed(self.reactor.recv_buffer[:size])
+        # リクエストの受信中は、次のデータをREQUEST_READ_TIMEOUTまで待つ
+        self.deadline = time.monotonic() + getattr(settings, "REQUEST_READ_TIMEOUT", 5)
+        self.advance()
+
+    def on_writable(self) -> None:
+        """
+        socketが書き込めるようになったので、レスポンスの続きを送信する
+        """
+        self.advance()
+
+    def advance(self) -> None:
+        """
+        今の状態で進められるところまで、リクエストの受信とレスポンスの送信を繰り返す
+        パイプライン化されたリクエストがバッファに揃っている間は、再帰せずにこのループで順に処理する
+        """
+        while not self.closed:
+            if self.state == self.WRITING:
+                # 送信しきれなければ、socketが書き込めるようになるのを待つ
+                if not self.write():
+                    return
+            else:
+                # リクエストが揃っていなければ、次の受信を待つ
+                if not self.process():
+                    return
+
+    def process(self) -> bool:
+        """
+        バッファに揃っている分だけ、リクエストの受信を進める
+        リクエストが揃ったらviewを呼び出してレスポンスの送信を始め、Trueを返す
+        まだ揃っていない場合はFalseを返す
+        """
+        try:
+            if self.state == self.READING_HEAD:
+                # ヘッダの終わりまで揃っていなければ、次の受信を待つ
+                request_head = self.reader.read_head()
+                if request_head is None:
+                    return False
+                self.started_at = time.perf_counter_ns()
+                self.timer = StageTimer(self.first_byte_at or self.started_at)
+                self.timer.lap("recv")
+                self.first_byte_at = None
+                self.request_head = request_head
+                self.request = self.parse_http_request(request_head)
+                self.timer.lap("parse")
+                self.content_length, self.chunked = self.get_body_framing(self.request)
+                self.state = self.READING_BODY
+
+            if self.state == self.READING_BODY:
+                # Content-Lengthの分、またはchunked形式のボディが揃っていなければ、次の受信を待つ
+                if self.content_length or self.chunked:
+                    body = self.reader.read_body(self.content_length, self.chunked)
+                    if body is None:
+                        return False
+                    self.request.body = body
+                    self.timer.lap("recv")
+                self.dispatch()
+                return True
+
+        except BadRequest as e:
+            # リクエストが不正、または大きすぎる場合はエラーを返して接続を閉じる
+            self.started_at = time.perf_counter_ns()
+            self.timer = None
+            self.route = "-"
+            self.received = 0
+            self.access = ("-", "-", e.status_code)
+            self.start_response(iter([(self.build_error_response(e.status_code),)]), keep_alive=False)
+            return True
+
+        except Exception:
+            # リクエストの処理中に例外が発生したらエラーを記録し、接続を閉じる
+            logger.exception("=== ReactorServer: リクエストの処理中にエラーが発生しました ===")
+            self.close()
+            return False
+
+    def dispatch(self) -> None:
+        """
+        受信しきったリクエストに対応するviewを呼び出し、レスポンスの送信を始める
+        """
+        request = self.request
+        request_head = self.request_head
+        self.request = None
+        self.request_head = b""
+
+        # デバッグ用にリクエストを記録する(無効な場合は何もしない)
+        if request_capture.enabled:
+            request_capture.capture(request_head + request.body, self.client_address)
+
+        # URL解決を試みる
+        self.route, view = URLResolver().resolve_route(request)
+        self.timer.lap("resolve")
+
+        # レスポンスを生成する
+        response = self.call_view(view, request)
+        self.timer.lap("view")
+        self.received = len(request_head) + len(request.body)
+
+        self.handled_requests += 1
+        keep_alive = (
+            self.should_keep_alive(request)
+            and self.handled_requests < getattr(settings, "KEEP_ALIVE_MAX_REQUESTS", 100)
+        )
+        self.access = (request.method, request.path, response.status_code)
+        self.start_response(self.iter_response(response, request, keep_alive), keep_alive)
+
+    def start_response(self, output: Iterator, keep_alive: bool) -> None:
+        """
+        レスポンスの送信を始める(実際の送信はadvance()から呼ばれるwrite()で行う)
+        """
+        self.state = self.WRITING
+        self.deadline = None
+        self.output = output
+        self.keep_alive = keep_alive
+        self.sent = 0
+
+    def write(self) -> bool:
+        """
+        送信しきれていないデータと、まだ生成していないレスポンスの続きを、送信できるところまで送信する
+        ストリーミングの場合は、送信できるようになってから次のチャンクを生成する
+        レスポンスを送信しきった場合はTrue、続きが残っている(または接続を閉じた)場合はFalseを返す
+        """
+        try:
+            while True:
+                if self.segment is not None:
+                    if not self.send_segment():
+                        break
+                    continue
+
+                if self.pending:
+                    if not send_buffers_nonblocking(self.client_socket, self.pending):
+                        break
+                    continue
+
+                data = next(self.output, None)
+                if data is None:
+                    self.finish_response()
+                    return True
+                # 最初のバッファ(ヘッダ)ができるまでをbuild_header、残りをsendとして計る
+                if self.timer is not None and self.sent == 0:
+                    self.timer.lap("build_header")
+                if isinstance(data, FileSegment):
+                    self.segment = data
+                    self.sent += data.count
+                else:
+                    self.pending = [memoryview(buffer) for buffer in data if len(buffer)]
+                    self.sent += sum(len(view) for view in self.pending)
+
+        except ConnectionError:
+            self.close()
+            return False
+
+        except Exception:
+            logger.exception("=== ReactorServer: レスポンスの送信中にエラーが発生しました ===")
+            self.close()
+            return False
+
+        # 続きはsocketが書き込めるようになってから送信する
+        self.reactor.set_events(self, selectors.EVENT_WRITE)
+        return False
+
+    def send_segment(self) -> bool:
+        """
+        ファイルの範囲をsendfileで送信する
+        全て送信できた場合はTrue、続きが残っている場合はFalseを返す
+        """
+        segment = self.segment
+        while segment.count:
+            try:
+                sent = os.sendfile(self.client_socket.fileno(), segment.file.fileno(), segment.offset, segment.count)
+            except (BlockingIOError, InterruptedError):
+                self.segment = segment
+                return False
+            if sent == 0:
+                # 送信中にファイルが短くなった場合
+                raise EOFError(f"file ended before {segment.count} more bytes were sent")
+            segment = FileSegment(segment.file, segment.offset + sent, segment.count - sent)
+
+        self.segment = None
+        return True
+
+    def finish_response(self) -> None:
+        """
+        レスポンスを送信しきった後の処理
+        keep-aliveなら次のリクエストの受信に戻り(バッファに揃っている次のリクエストはadvance()が続けて処理する)、
+        そうでなければ接続を閉じる
+        """
+        self.output = None
+
+        # アクセスログを記録する(キューに積むだけで、書き出しは別のスレッドが行う)
+        if self.access is not None:
+            method, path, status = self.access
+            stages = {}
+            if self.timer is not None:
+                self.timer.lap("send")
+                stages = self.timer.stages
+            metrics.observe(self.route, status, self.received, self.sent, stages)
+            access_log.log(
+                self.client_address, method, path, status, self.sent, time.perf_counter_ns() - self.started_at
+            )
+            self.access = None
+            self.timer = None
+
+        if not self.keep_alive:
+            self.close()
+            return
+
+        self.state = self.READING_HEAD
+        self.deadline = time.monotonic() + getattr(settings, "KEEP_ALIVE_TIMEOUT", 5)
+        self.reactor.set_events(self, selectors.EVENT_READ)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+
+        # 送信途中のレスポンスがあれば、開いているファイルなどを閉じる
+        close_output = getattr(self.output, "close", None)
+        if close_output is not None:
+            close_output()
+        self.output = None
+
+        logger.debug("=== ReactorServer: クライアントとの接続を終了します remote_address: %s ===", self.client_address)
+        self.reactor.remove(self)
+        self.client_socket.close()
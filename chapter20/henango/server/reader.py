@@ -0,0 +1,187 @@
+from typing import Iterable, List, Optional
+
+import settings
+
+# チャンクサイズの桁数の上限(これより長いサイズは、どのみち上限を超えるので読まない)
+MAX_CHUNK_SIZE_DIGITS = 16
+
+
+class BadRequest(Exception):
+    """
+    リクエストの形式が不正な場合に送出される例外
+    """
+    status_code = 400
+
+
+class RequestHeaderTooLarge(BadRequest):
+    """
+    リクエストライン+ヘッダが上限を超えた場合に送出される例外
+    """
+    status_code = 431
+
+
+class RequestBodyTooLarge(BadRequest):
+    """
+    リクエストボディが上限を超えた場合に送出される例外
+    """
+    status_code = 413
+
+
+def parse_content_length(values: Iterable[str]) -> int:
+    """
+    Content-Lengthヘッダの値(全て)から、ボディの長さを取得する
+    int()は "+5" や "1_0" や前後の空白も受け付けてしまうので、ASCIIの数字だけからなる値のみを認める
+    同じ値の繰り返し(ex: "3, 3")は認めるが、値が食い違う場合は
+    プロキシと解釈がずれてリクエストスマグリングにつながるのでBadRequestとする
+    """
+    length = None
+    for value in values:
+        for field in value.split(","):
+            field = field.strip(" \t")
+            if not (field.isascii() and field.isdigit()):
+                raise BadRequest()
+            if length is not None and int(field) != length:
+                raise BadRequest()
+            length = int(field)
+    return 0 if length is None else length
+
+
+def parse_chunk_size(line: bytes) -> int:
+    """
+    chunked形式のチャンクサイズの行から、チャンクサイズを取得する
+    int(x, 16)は "0x1f" や符号や "_" も受け付けてしまうので、ASCIIの16進数の数字だけからなる値のみを認める
+    拡張(";"以降)は無視する
+    """
+    size_field, separator, _ = line.partition(b";")
+    if separator:
+        # 拡張の前には空白を置ける
+        size_field = size_field.rstrip(b" \t")
+    if not 0 < len(size_field) <= MAX_CHUNK_SIZE_DIGITS or size_field.strip(b"0123456789abcdefABCDEF"):
+        raise BadRequest()
+    return int(size_field, 16)
+
+
+class HTTPRequestReader:
+    """
+    受信したデータを溜めておき、HTTPリクエストの区切りを判定するクラス
+    socketを直接は扱わないので、スレッド / asyncioどちらのエンジンからも使える
+
+    使い方:
+    1. 受信したデータを feed() で渡す
+    2. read_head() でリクエストライン+ヘッダを取り出す(揃っていなければNone)
+    3. ヘッダをパースした後、read_body() でボディを取り出す(揃っていなければNone)
+    """
+
+    def __init__(self, max_header_size: int = None, max_body_size: int = None):
+        if max_header_size is None:
+            max_header_size = getattr(settings, "MAX_REQUEST_HEADER_SIZE", 8 * 1024)
+        if max_body_size is None:
+            max_body_size = getattr(settings, "MAX_REQUEST_BODY_SIZE", 10 * 1024 * 1024)
+
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+
+        # 受信済みでまだ取り出していないデータ
+        # 接続ごとに1つのbytearrayを使い回し、取り出した分は先頭から削除する
+        self.buffer = bytearray()
+
+        # chunked形式のボディを途中まで読んだ状態
+        self._chunks: List[bytes] = []
+        self._chunked_size = 0
+
+    def feed(self, data) -> None:
+        """
+        受信したデータをバッファに追加する
+        """
+        self.buffer += data
+
+    def read_head(self) -> Optional[bytes]:
+        """
+        リクエストライン+ヘッダを(末尾の空行を含めて)取り出す
+        まだ揃っていない場合はNoneを返す
+        """
+        index = self.buffer.find(b"\r\n\r\n")
+        if index == -1:
+            if len(self.buffer) > self.max_header_size:
+                raise RequestHeaderTooLarge()
+            return None
+
+        index += 4
+        if index > self.max_header_size:
+            raise RequestHeaderTooLarge()
+
+        head = bytes(self.buffer[:index])
+        del self.buffer[:index]
+        return head
+
+    def read_body(self, content_length: int = 0, chunked: bool = False) -> Optional[bytes]:
+        """
+        リクエストボディを取り出す
+        chunkedの場合はデコードした結果を返し、そうでなければContent-Lengthバイトを返す
+        まだ揃っていない場合はNoneを返す
+        """
+        if chunked:
+            return self._read_chunked_body()
+
+        if content_length < 0:
+            raise BadRequest()
+        if content_length > self.max_body_size:
+            raise RequestBodyTooLarge()
+        if len(self.buffer) < content_length:
+            return None
+
+        body = bytes(self.buffer[:content_length])
+        del self.buffer[:content_length]
+        return body
+
+    def _read_chunked_body(self) -> Optional[bytes]:
+        """
+        Transfer-Encoding: chunked のボディをデコードする
+        揃っているチャンクから順に取り出していき、終端のチャンクまで揃ったらボディ全体を返す
+        """
+        while True:
+            # チャンクサイズの行
+            line_end = self.buffer.find(b"\r\n")
+            if line_end == -1:
+                if len(self.buffer) > self.max_header_size:
+                    raise BadRequest()
+                return None
+
+            chunk_size = parse_chunk_size(bytes(self.buffer[:line_end]))
+
+            if chunk_size == 0:
+                # 終端のチャンクの後には、トレーラ(無視する)と空行が続く
+                # トレーラもヘッダと同じく、max_header_sizeを超えたら受け付けない
+                trailer_start = line_end + 2
+                if self.buffer.startswith(b"\r\n", trailer_start):
+                    end = trailer_start + 2
+                else:
+                    trailer_end = self.buffer.find(b"\r\n\r\n", trailer_start)
+                    if trailer_end == -1:
+                        if len(self.buffer) - trailer_start > self.max_header_size:
+                            raise RequestHeaderTooLarge()
+                        return None
+                    end = trailer_end + 4
+                    if end - trailer_start > self.max_header_size:
+                        raise RequestHeaderTooLarge()
+                del self.buffer[:end]
+
+                body = b"".join(self._chunks)
+                self._chunks = []
+                self._chunked_size = 0
+                return body
+
+            if self._chunked_size + chunk_size > self.max_body_size:
+                raise RequestBodyTooLarge()
+
+            # チャンクデータとその後ろのCRLFが揃うまで待つ
+            data_start = line_end + 2
+            data_end = data_start + chunk_size
+            if len(self.buffer) < data_end + 2:
+                return None
+            if self.buffer[data_end:data_end + 2] != b"\r\n":
+                raise BadRequest()
+
+            self._chunks.append(bytes(self.buffer[data_start:data_end]))
+            self._chunked_size += chunk_size
+            del self.buffer[:data_end + 2]
@@ -1,6 +1,15 @@
+import logging
 import socket
+import threading
+import time
+from typing import Tuple
+
+import settings
+from henango.server.pool import WorkerPool
 from henango.server.worker import Worker
 
+logger = logging.getLogger(__name__)
+
 class Server:
     """
     Webサーバを表すクラス
@@ -10,35 +19,98 @@ class Server:
         サーバを起動する
         """
 
-        print("=== Server: サーバを起動します ===")
+        logger.info("=== Server: サーバを起動します ===")
 
         try:
             # socketを生成
             server_socket = self.create_server_socket()
+            self.serve_forever(server_socket)
+
+        finally:
+            logger.info("=== Server: サーバを停止します ===")
+
+    def serve_forever(self, server_socket: socket) -> None:
+        """
+        生成済みのserver_socketで接続を待ち受け、ワーカーに処理を任せ続ける
+        """
 
-            while True:
-                # 外部からの接続を待ち、接続があったらコネクションを確立
-                print("=== Server: クライアントからの接続を待ちます ===")
-                (client_socket, address) = server_socket.accept()
-                print(f"=== Server: クライアントとの接続が完了しました remote_address: {address} ===")
+        # プールモードの場合は、ワーカースレッドを先に起動しておく
+        pool = None
+        if getattr(settings, "WORKER_MODE", "thread") == "pool":
+            pool = WorkerPool()
+            pool.start()
+        self.pool = pool
 
-                # クライアントを処理するスレッドを生成
-                thread = Worker(client_socket, address)
-                # スレッドの実行
-                thread.start()
+        while True:
+            # 外部からの接続を待ち、接続があったらコネクションを確立
+            logger.debug("=== Server: クライアントからの接続を待ちます ===")
+            (client_socket, address) = self.accept(server_socket)
+            logger.debug("=== Server: クライアントとの接続が完了しました remote_address: %s ===", address)
 
-        finally:
-            print("=== Server: サーバを停止します ===")
+            if pool is not None:
+                # プール内のワーカーに処理を任せる
+                pool.submit(client_socket, address)
+                continue
 
-    def create_server_socket(self) -> socket:
+            # クライアントを処理するスレッドを生成
+            thread = Worker(client_socket, address)
+            # スレッドの実行
+            thread.start()
+
+    def accept(self, server_socket: socket) -> Tuple[socket, Tuple[str, int]]:
+        """
+        クライアントからの接続を1つ受け付ける
+        """
+        return server_socket.accept()
+
+    def wait_for_workers(self) -> None:
+        """
+        処理中の接続が全て終わるまで待つ(acceptを止めた後の終了処理で使う)
+        """
+        pool = getattr(self, "pool", None)
+        if pool is not None:
+            while pool.queue.qsize() or pool.stats()["busy"]:
+                time.sleep(0.1)
+            return
+
+        for thread in threading.enumerate():
+            if isinstance(thread, Worker):
+                thread.join()
+
+    def create_server_socket(self, reuse_port: bool = None) -> socket:
         """
         通信を待ち受けるためのserver_socketを生成する
+        待ち受けるアドレス / backlog / socketのオプションはsettingsで指定する
+        reuse_portがTrueの場合は、SO_REUSEPORTで複数のプロセスが同じポートを待ち受けられるようにする
         """
+        if reuse_port is None:
+            reuse_port = getattr(settings, "SERVER_REUSE_PORT", False)
+
         # socketを生成
         server_socket = socket.socket()
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+        # 以下のオプションは、待ち受け用のsocketに設定しておくとacceptした接続に引き継がれる(Linux)
+        if getattr(settings, "SERVER_TCP_NODELAY", True):
+            server_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        send_buffer_size = getattr(settings, "SERVER_SNDBUF", None)
+        if send_buffer_size:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, send_buffer_size)
+        receive_buffer_size = getattr(settings, "SERVER_RCVBUF", None)
+        if receive_buffer_size:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer_size)
+
+        # Linux以外では使えないオプションは、使える場合だけ設定する
+        defer_accept = getattr(settings, "SERVER_TCP_DEFER_ACCEPT", 0)
+        if defer_accept and hasattr(socket, "TCP_DEFER_ACCEPT"):
+            server_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_DEFER_ACCEPT, defer_accept)
+        fastopen = getattr(settings, "SERVER_TCP_FASTOPEN", 0)
+        if fastopen and hasattr(socket, "TCP_FASTOPEN"):
+            server_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_FASTOPEN, fastopen)
 
-        # socketをlocalhostのポート8080に紐付け
-        server_socket.bind(("localhost", 8080))
-        server_socket.listen(10)
+        # socketを指定されたアドレスに紐付け
+        server_socket.bind((getattr(settings, "SERVER_HOST", "localhost"), getattr(settings, "SERVER_PORT", 8080)))
+        server_socket.listen(getattr(settings, "SERVER_BACKLOG", 1024))
         return server_socket
@@ -1,130 +1,193 @@
+import logging
 import os
-import re
 import socket
-import traceback
-from datetime import datetime
+import time
 from threading import Thread
-from typing import Tuple
+from typing import Callable, Optional, Tuple
 
 import settings
+from henango.server.access_log import access_log
+from henango.server.capture import request_capture
+from henango.server.metrics import StageTimer, metrics
 from henango.http.request import HTTPRequest
 from henango.http.response import HTTPResponse
+from henango.server.protocol import FileSegment, HTTPProtocol
+from henango.server.reader import BadRequest, HTTPRequestReader
+from henango.server.writer import send_buffers
 from henango.urls.resolver import URLResolver
 
-class Worker(Thread):
-
-    # 拡張子とMIME Typeの対応
-    MIME_TYPES = {
-        "html": "text/html; charset=UTF-8",
-        "css": "text/css",
-        "png": "image/png",
-        "jpg": "image/jpg",
-        "gif": "image/gif",
-    }
-    
-    # ステータスコードとステータスラインの対応
-    STATUS_LINES = {
-        200: "200 OK",
-        302: "302 Found",
-        404: "404 Not Found",
-        405: "405 Method Not Allowd",
-    }
-    
-    def __init__(self, client_socket: socket, address: Tuple[str, int]):
+logger = logging.getLogger(__name__)
+
+class Worker(HTTPProtocol, Thread):
+
+    def __init__(
+        self,
+        client_socket: socket,
+        address: Tuple[str, int],
+        keep_alive_timeout: float = None,
+        should_release: Callable[[], bool] = None,
+    ):
         # Threadを継承
         super().__init__()
 
         # インスタンス変数に引数を代入
         self.client_socket = client_socket
         self.client_address = address
+        # keep-aliveで次のリクエストを待つ秒数
+        if keep_alive_timeout is None:
+            keep_alive_timeout = getattr(settings, "KEEP_ALIVE_TIMEOUT", 5)
+        self.keep_alive_timeout = keep_alive_timeout
+        # Trueを返した場合は、keep-aliveせずにレスポンスを返した時点で接続を閉じる
+        # (プールモードで、処理待ちの接続にスレッドを譲るために使う)
+        self.should_release = should_release
 
     def run(self) -> None:
         """
         クライアントと接続済みのsocketを引数として受け取り、
         リクエストを処理してレスポンスを送信する
+        keep-aliveの場合は、同じ接続で続けて送られてくるリクエストも順に処理する
         """
 
+        max_requests = getattr(settings, "KEEP_ALIVE_MAX_REQUESTS", 100)
+        read_timeout = getattr(settings, "REQUEST_READ_TIMEOUT", 5)
+        # 受信したデータを溜めておき、リクエストの区切りを判定する
+        # (パイプライン化された後続のリクエストもここに残る)
+        self.reader = HTTPRequestReader()
+        # recvで受信するためのバッファ(接続ごとに1つを使い回す)
+        self.recv_buffer = memoryview(bytearray(getattr(settings, "RECV_BUFFER_SIZE", 16 * 1024)))
+        # リクエストの最初のデータを受信した時刻(メトリクスの受信時間の計測に使う)
+        self.first_byte_at: Optional[int] = None
+
+        metrics.connection_opened()
         try:
-            # クライアントから送られてきたデータを取得する
-            request_bytes = self.client_socket.recv(4096)
-
-            # クライアントから送られてきたデータをファイルに書き出す
-            with open("server_recv.txt", "wb") as f:
-                f.write(request_bytes)
-
-            # HTTPリクエストをパースする
-            request = self.parse_http_request(request_bytes)
-
-            # URL解決を試みる
-            view = URLResolver().resolve(request)
+            handled_requests = 0
+            while True:
+                # 一定時間待ってもリクエストが来なければ接続を閉じる
+                # 最初のリクエストは、接続だけ張って何も送らないクライアントにスレッドを占有されないよう
+                # REQUEST_READ_TIMEOUTで、2つ目以降のリクエストはkeep-aliveのタイムアウトで区切る
+                self.client_socket.settimeout(self.keep_alive_timeout if handled_requests > 0 else read_timeout)
+
+                # クライアントから送られてきたリクエストヘッダを取得する
+                self.first_byte_at = None
+                request_head = self.receive(self.reader.read_head)
+                if request_head is None:
+                    break
+                if handled_requests > 0:
+                    self.client_socket.settimeout(read_timeout)
+
+                # アクセスログに記録する処理時間は、ヘッダを受信した時点から数える
+                started_at = time.perf_counter_ns()
+                # メトリクスの受信時間は、最初のデータを受信した時点から数える
+                # (keep-aliveで次のリクエストを待っていた時間は含めない)
+                timer = StageTimer(self.first_byte_at or started_at)
+                timer.lap("recv")
+
+                # HTTPリクエストをパースする
+                request = self.parse_http_request(request_head)
+                timer.lap("parse")
+
+                # Content-Lengthの分、またはchunked形式のリクエストボディを取得する
+                content_length, chunked = self.get_body_framing(request)
+                if content_length or chunked:
+                    request.body = self.receive(lambda: self.reader.read_body(content_length, chunked))
+                    if request.body is None:
+                        break
+                    timer.lap("recv")
+
+                # デバッグ用にリクエストを記録する(無効な場合は何もしない)
+                if request_capture.enabled:
+                    request_capture.capture(request_head + request.body, self.client_address)
+
+                # URL解決を試みる
+                route, view = URLResolver().resolve_route(request)
+                timer.lap("resolve")
+
+                # レスポンスを生成する
+                response = self.call_view(view, request)
+                timer.lap("view")
+
+                handled_requests += 1
+                keep_alive = (
+                    self.should_keep_alive(request)
+                    and handled_requests < max_requests
+                    and not (self.should_release is not None and self.should_release())
+                )
+
+                # クライアントへレスポンスを送信する
+                sent = self.send_response(response, request, keep_alive, timer)
+
+                # アクセスログを記録する(キューに積むだけで、書き出しは別のスレッドが行う)
+                access_log.log(
+                    self.client_address, request.method, request.path, response.status_code, sent,
+                    timer.last - started_at,
+                )
+                metrics.observe(route, response.status_code, len(request_head) + len(request.body), sent, timer.stages)
+
+                if not keep_alive:
+                    break
+
+        except socket.timeout:
+            # リクエストの受信、またはkeep-aliveのタイムアウト
+            logger.debug("=== Worker: タイムアウトしたため接続を閉じます remote_address: %s ===", self.client_address)
+
+        except BadRequest as e:
+            # リクエストが不正、または大きすぎる場合はエラーを返して接続を閉じる
+            error_response = self.build_error_response(e.status_code)
+            self.client_socket.sendall(error_response)
+            access_log.log(self.client_address, "-", "-", e.status_code, len(error_response), 0)
+            metrics.observe("-", e.status_code, 0, len(error_response), {})
 
-            # レスポンスを生成する
-            response = view(request)
-
-            # レスポンスボディを変換(str -> bytes)
-            if isinstance(response.body, str):
-                response.body = response.body.encode()
-
-            # レスポンスラインを生成
-            response_line = self.build_response_line(response)
-            
-            response_header = self.build_response_header(response, request)
-
-            # レスポンス全体を生成する
-            response_bytes = (response_line + response_header + "\r\n").encode() +  response.body
-
-            # クライアントへレスポンスを送信する
-            self.client_socket.send(response_bytes)
-        
         except Exception:
-            # リクエストの処理中に例外が発生したらコンソールにエラーを表示し、処理を続行
-            print("=== Worker: リクエストの処理中にエラーが発生しました ===")
-            traceback.print_exc()
+            # リクエストの処理中に例外が発生したらエラーを記録し、処理を続行
+            logger.exception("=== Worker: リクエストの処理中にエラーが発生しました ===")
 
         finally:
             # 例外の発生有無に関わらずTCP通信をclose
-            print(f"=== Worker: クライアントとの接続を終了します remote_address: {self.client_address} ===")
+            logger.debug("=== Worker: クライアントとの接続を終了します remote_address: %s ===", self.client_address)
             self.client_socket.close()
+            metrics.connection_closed()
 
-    def parse_http_request(self, request: bytes) -> HTTPRequest:
+    def send_response(
+        self, response: HTTPResponse, request: HTTPRequest, keep_alive: bool = False, timer: StageTimer = None
+    ) -> int:
         """
-        HTTPリクエストを
-        1. method: str
-        2. path: str
-        3. http_version: str
-        4. request_header: dict
-        5. request_body: bytes
-        に分割/変換して返す
+        レスポンスをクライアントへ送信し、送信したバイト数を返す
+        ヘッダとボディは連結せずにsendmsgでまとめて送信し、
+        ストリーミングの場合はボディを生成しながら順に送信し、
+        ファイルの場合はsendfileでカーネルから直接送信する
+        timerを渡した場合は、最初のバッファ(ヘッダ)ができるまでをbuild_header、残りをsendとして計る
         """
+        sent = 0
+        for data in self.iter_response(response, request, keep_alive):
+            if timer is not None and sent == 0:
+                timer.lap("build_header")
+            if isinstance(data, FileSegment):
+                sent += self.client_socket.sendfile(data.file, data.offset, data.count)
+            else:
+                send_buffers(self.client_socket, data)
+                sent += sum(len(buffer) for buffer in data)
+        if timer is not None:
+            timer.lap("send")
+        return sent
+
+    def receive(self, read: Callable[[], Optional[bytes]]) -> Optional[bytes]:
+        """
+        read()が値を返すまでクライアントからデータを受信する
+        バッファに既に受信済みのデータで足りる場合は、recvせずにそれを返す
+        揃う前に接続が閉じられた場合はNoneを返す
+        """
+        while True:
+            data = read()
+            if data is not None:
+                return data
+
+            size = self.client_socket.recv_into(self.recv_buffer)
+            if size == 0:
+                return None
+            if self.first_byte_at is None:
+                self.first_byte_at = time.perf_counter_ns()
+            self.reader.feed(self.recv_buffer[:size])
 
-        # リクエスト全体を
-        # 1. リクエストライン
-        # 2. リクエストヘッダ
-        # 3. リクエストボディ
-        # に分けてパースする
-        request_line, remain = request.split(b"\r\n", maxsplit=1)
-        request_header, request_body = remain.split(b"\r\n\r\n", maxsplit=1)
-
-        # さらにリクエストラインをパースする
-        method, path, http_version = request_line.decode().split(" ")
-
-        # リクエストヘッダを辞書にパースする
-        headers = {}
-        for header_row in request_header.decode().split("\r\n"):
-            key, value = re.split(r": *", header_row, maxsplit=1)
-            headers[key] = value
-        
-        cookies = {}
-        if "Cookie" in headers:
-            # str から list へ変換 (ex) "name1=value1; name2=value2" => ["name1=value1", "name2=value2"]
-            cookie_strings = headers["Cookie"].split("; ")
-            # list から dict へ変換 (ex) ["name1=value1", "name2=value2"] => {"name1": "value1", "name2": "value2"}
-            for cookie_string in cookie_strings:
-                name, value = cookie_string.split("=", maxsplit=1)
-                cookies[name] = value
-
-        return HTTPRequest(method=method, path=path, http_version=http_version, headers=headers, cookies=cookies, body=request_body)
-    
     def get_static_file_content(self, path: str) -> bytes:
         """
         リクエストpathから、staticファイルの内容を取得する
@@ -140,61 +203,3 @@ class Worker(Thread):
         # ファイルからレスポンスボティを生成
         with open(static_file_path, "rb") as f:
             return f.read()
-        
-    def build_response_line(self, response: HTTPResponse) -> str:
-        """
-        レスポンスラインを構築する
-        """
-        status_line = self.STATUS_LINES[response.status_code]
-        return f"HTTP/1.1 {status_line}"
-    
-    def build_response_header(self, response: HTTPResponse, request: HTTPRequest) -> str:
-        """
-        レスポンスヘッダを構築する
-        """
-
-        # Coontent_Typeが指定されていない場合はpathから特定する
-        if response.content_type is None:
-            # pathから拡張子を取得
-            if "." in request.path:
-                ext = request.path.rsplit(".", maxsplit=1)[-1]
-                # 拡張子からMIME Typeを取得
-                # 知らない・対応していない拡張子の場合はoctet-streamとする
-                response.content_type = self.MIME_TYPES.get(ext, "application/octet-stream")
-            else:
-                # pathに拡張子がない場合はhtml扱いとする
-                response.content_type = "text/html; charset=UTF-8"
-
-
-        # 基本ヘッダの生成
-        response_header = ""
-        response_header += f"Date: {datetime.utcnow().strftime('%a, %d %b %Y %H:%M:%S GMT')}\r\n"
-        response_header += "HOST: SigmaServer/0.1\r\n"
-        response_header += f"Content-Length: {len(response.body)}\r\n"
-        response_header += "Connection: Close\r\n"
-        response_header += f"Content-Type: {response.content_type}\r\n"
-
-        # Cookieヘッダの生成
-        for cookie in response.cookies:
-            cookie_header = f"Set-Cookie: {cookie.name}={cookie.value}"
-            if cookie.expires is not None:
-                cookie_header += f"; Expires={cookie.expires.strftime('%a, %d %b %Y %H:%M:%S GMT')}"
-            if cookie.max_age is not None:
-                cookie_header += f"; Max-Age={cookie.max_age}"
-            if cookie.domain:
-                cookie_header += f"; Domain={cookie.domain}"
-            if cookie.path:
-                cookie_header += f"; Path={cookie.path}"
-            if cookie.secure:
-                cookie_header += "; Secure"
-            if cookie.http_only:
-                cookie_header += "; HttpOnly"
-
-            response_header += cookie_header + "\r\n"
-
-        # その他ヘッダの生成
-        for header_name, header_value in response.headers.items():
-            response_header += f"{header_name}: {header_value}\r\n"
-
-        return response_header
-    
\ No newline at end of file
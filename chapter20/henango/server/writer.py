@@ -0,0 +1,53 @@
+import socket
+from typing import List, Sequence
+
+# 1回のsendmsgで渡すバッファの最大数
+IOV_MAX = 1024
+
+
+def send_buffers(client_socket: socket.socket, buffers: Sequence[bytes]) -> None:
+    """
+    複数のバッファを、連結せずにsendmsgでまとめて送信する(scatter/gather I/O)
+    一部しか送信できなかった場合は、残りの部分から送信し直す
+    """
+    # 送信済みの部分を切り出す時にコピーしないよう、memoryviewで扱う
+    views: List[memoryview] = [memoryview(buffer) for buffer in buffers if len(buffer)]
+
+    if not hasattr(client_socket, "sendmsg"):
+        # sendmsgが使えない環境では、連結してから送信する
+        client_socket.sendall(b"".join(views))
+        return
+
+    while views:
+        sent = client_socket.sendmsg(views[:IOV_MAX])
+        discard_sent(views, sent)
+
+
+def send_buffers_nonblocking(client_socket: socket.socket, views: List[memoryview]) -> bool:
+    """
+    ノンブロッキングのsocketへ、送信できるところまでviewsを送信する
+    送信した分はviewsから取り除き、全て送信できた場合はTrue、続きが残っている場合はFalseを返す
+    """
+    while views:
+        try:
+            if hasattr(client_socket, "sendmsg"):
+                sent = client_socket.sendmsg(views[:IOV_MAX])
+            else:
+                sent = client_socket.send(views[0])
+        except (BlockingIOError, InterruptedError):
+            return False
+        discard_sent(views, sent)
+    return True
+
+
+def discard_sent(views: List[memoryview], sent: int) -> None:
+    """
+    送信しきったバッファを取り除き、途中まで送ったバッファは残りの部分だけにする
+    """
+    index = 0
+    while index < len(views) and sent >= len(views[index]):
+        sent -= len(views[index])
+        index += 1
+    del views[:index]
+    if sent:
+        views[0] = views[0][sent:]
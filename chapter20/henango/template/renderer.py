@@ -1,10 +1,189 @@
 import os
+from string import Formatter
+from threading import Lock
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import settings
+from henango.server.metrics import Collected
+from henango.views.static_manifest import static_manifest
+
+# テンプレートの置換フィールドを評価するためのFormatter
+formatter = Formatter()
+
+
+class Template:
+    """
+    読み込み済みのテンプレート
+    """
+
+    def __init__(self, path: str, source: str, mtime: float):
+        self.path = path
+        self.source = source
+        self.mtime = mtime
+        self._segments: Optional[List[Tuple[str, Optional[str], Optional[str], Optional[str]]]] = None
+
+    def render(self, context: dict) -> str:
+        return self.source.format(**context)
+
+    @property
+    def segments(self) -> List[Tuple[str, Optional[str], Optional[str], Optional[str]]]:
+        """
+        テンプレートを (直前の文字列, フィールド名, 書式指定, 変換指定) の並びに分解したもの
+        ストリーミングで描画する時に初めて分解し、以降は使い回す
+        """
+        if self._segments is None:
+            self._segments = list(formatter.parse(self.source))
+        return self._segments
+
+    def render_stream(self, context: dict, chunk_size: int) -> Iterator[bytes]:
+        """
+        テンプレートを先頭から順に描画し、chunk_sizeバイト程度ずつエンコードして返す
+        """
+        buffer = []
+        buffered_size = 0
+        for literal_text, field_name, format_spec, conversion in self.segments:
+            if literal_text:
+                buffer.append(literal_text)
+                buffered_size += len(literal_text)
+
+            if field_name is not None:
+                value, _ = formatter.get_field(field_name, (), context)
+                value = formatter.convert_field(value, conversion)
+                if format_spec and "{" in format_spec:
+                    format_spec = formatter.vformat(format_spec, (), context)
+                text = formatter.format_field(value, format_spec)
+                buffer.append(text)
+                buffered_size += len(text)
+
+            if buffered_size >= chunk_size:
+                yield "".join(buffer).encode()
+                buffer = []
+                buffered_size = 0
+
+        if buffer:
+            yield "".join(buffer).encode()
+
+
+class TemplateCache:
+    """
+    読み込んだテンプレートをメモリ上に保持しておくクラス
+    auto_reloadが有効な場合は、ファイルの更新日時が変わっていれば読み込み直す
+    """
+
+    def __init__(self, templates_dir: str = None, auto_reload: bool = None):
+        if templates_dir is None:
+            templates_dir = settings.TEMPLATES_DIR
+        if auto_reload is None:
+            auto_reload = getattr(settings, "TEMPLATE_AUTO_RELOAD", True)
+
+        self.templates_dir = templates_dir
+        self.auto_reload = auto_reload
+        self.templates: Dict[str, Template] = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+    def get(self, template_name: str) -> Template:
+        """
+        テンプレートを取得する
+        キャッシュにない場合、または更新されている場合はファイルから読み込む
+        """
+        template = self.templates.get(template_name)
+
+        if template is not None:
+            if not self.auto_reload or os.stat(template.path).st_mtime == template.mtime:
+                self.hits += 1
+                return template
+
+        self.misses += 1
+        template = self.load(template_name)
+        with self._lock:
+            self.templates[template_name] = template
+        return template
+
+    def load(self, template_name: str) -> Template:
+        """
+        テンプレートをファイルから読み込む
+        """
+        template_path = os.path.join(self.templates_dir, template_name)
+        with open(template_path) as f:
+            mtime = os.fstat(f.fileno()).st_mtime
+            source = f.read()
+
+        return Template(template_path, source, mtime)
+
+    def preload(self) -> None:
+        """
+        テンプレートディレクトリ内のテンプレートを全て読み込んでおく
+        """
+        for dir_path, _, file_names in os.walk(self.templates_dir):
+            for file_name in file_names:
+                template_name = os.path.relpath(os.path.join(dir_path, file_name), self.templates_dir)
+                self.templates[template_name] = self.load(template_name)
+
+    def stats(self) -> dict:
+        """
+        キャッシュのヒット数 / ミス数を返す
+        """
+        total = self.hits + self.misses
+        return {
+            "templates": len(self.templates),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+    def collect_metrics(self) -> List[Collected]:
+        """
+        stats()の内容を、メトリクスとして返す
+        """
+        stats = self.stats()
+        return [
+            ("henango_template_cache_hits_total", "counter", "Templates served from the cache.", stats["hits"]),
+            ("henango_template_cache_misses_total", "counter", "Templates loaded from disk.", stats["misses"]),
+            ("henango_template_cache_templates", "gauge", "Templates held in the cache.", stats["templates"]),
+        ]
+
+
+# サーバ全体で共有するキャッシュ(最初に使われた時に生成する)
+template_cache: Optional[TemplateCache] = None
+
+
+def get_template_cache() -> TemplateCache:
+    global template_cache
+    if template_cache is None:
+        template_cache = TemplateCache()
+    return template_cache
+
+
+def preload_templates() -> None:
+    """
+    起動時にテンプレートを全て読み込んでおく
+    """
+    get_template_cache().preload()
+
+
+def with_helpers(context: dict) -> dict:
+    """
+    テンプレートから使えるヘルパーをcontextに追加する
+    - static: 静的ファイルのURL ex) {static[index.css]} -> '/index.3f2a1b9c0d4e.css'
+    """
+    return {"static": static_manifest, **context}
+
 
 def render(template_name: str, context: dict):
-    template_path = os.path.join(settings.TEMPLATES_DIR, template_name)
-    with open(template_path) as f:
-        template = f.read()
+    template = get_template_cache().get(template_name)
+    return template.render(with_helpers(context))
+
+
+def render_stream(template_name: str, context: dict, chunk_size: int = None) -> Iterator[bytes]:
+    """
+    テンプレートを描画した結果を、エンコード済みのチャンクとして順に返すジェネレータ
+    HTTPResponseのbodyに渡すと、Transfer-Encoding: chunked で送信される
+    """
+    if chunk_size is None:
+        chunk_size = getattr(settings, "TEMPLATE_STREAM_CHUNK_SIZE", 8 * 1024)
 
-    return template.format(**context)
\ No newline at end of file
+    template = get_template_cache().get(template_name)
+    return template.render_stream(with_helpers(context), chunk_size)
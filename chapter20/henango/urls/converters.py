@@ -0,0 +1,48 @@
+import uuid
+
+
+class StringConverter:
+    """
+    URLパラメータの値を取り出して変換するクラス
+    regexにマッチした文字列をto_pythonで変換してviewに渡す
+    """
+    regex = "[^/]+"
+
+    def to_python(self, value: str):
+        return value
+
+
+class IntConverter(StringConverter):
+    regex = "[0-9]+"
+
+    def to_python(self, value: str) -> int:
+        return int(value)
+
+
+class SlugConverter(StringConverter):
+    regex = "[-a-zA-Z0-9_]+"
+
+
+class UUIDConverter(StringConverter):
+    regex = "[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"
+
+    def to_python(self, value: str) -> uuid.UUID:
+        return uuid.UUID(value)
+
+
+class PathConverter(StringConverter):
+    """
+    /を含む残りのpath全体にマッチする
+    """
+    regex = ".+"
+
+
+# URLパターンで指定する型名とコンバータの対応
+# ex) '/user/<int:user_id>/profile'
+CONVERTERS = {
+    "str": StringConverter(),
+    "int": IntConverter(),
+    "slug": SlugConverter(),
+    "uuid": UUIDConverter(),
+    "path": PathConverter(),
+}
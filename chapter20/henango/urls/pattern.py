@@ -1,24 +1,81 @@
 import re
 from re import Match
-from typing import Callable, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 
 from henango.http.request import HTTPRequest
 from henango.http.response import HTTPResponse
+from henango.urls.converters import CONVERTERS, StringConverter
 
 class URLPattern:
     pattern: str
     view: Callable[[HTTPRequest], HTTPResponse]
+    regex: re.Pattern
+    converters: Dict[str, StringConverter]
+
+    # URLパターン中のパラメータ ex) '<user_id>', '<int:user_id>'
+    PARAMETER_PATTERN = re.compile(r"<(?:(?P<converter>[^<>:]+):)?(?P<name>[^<>:]+)>")
 
     def __init__(self, pattern: str, view: Callable[[HTTPRequest], HTTPResponse]):
         self.pattern = pattern
         self.view = view
 
+        # パラメータ名とコンバータの対応
+        self.converters = {}
+        for match in self.PARAMETER_PATTERN.finditer(pattern):
+            converter_name = match.group("converter") or "str"
+            if converter_name not in CONVERTERS:
+                raise ValueError(f"URLパターン {pattern} に未知の型 {converter_name} が指定されています")
+            self.converters[match.group("name")] = CONVERTERS[converter_name]
+
+        # 正規表現への変換は登録時に一度だけ行う
+        self.regex = re.compile(self.build_regex(pattern))
+
     def match(self, path: str) -> Optional[Match]:
         """
         pathがURLパターンにマッチするか判定する
         マッチした場合はMatchオブジェクトを返し、マッチしなかった場合はNoneを返す
         """
-        # URLパターンを正規表現パターンに変換する
-        # ex) '/user/<user_id>/profile' -> '/user/(?P<user_id>[^/]+)/profile'
-        pattern = re.sub(r"<(.+?)>", r"(?P<\1>[^/]+)", self.pattern)
-        return re.match(pattern, path)
\ No newline at end of file
+        return self.regex.fullmatch(path)
+
+    def build_regex(self, pattern: str, group_prefix: str = "") -> str:
+        """
+        URLパターンを正規表現パターンに変換する
+        ex) '/user/<user_id>/profile' -> '/user/(?P<user_id>[^/]+)/profile'
+            '/user/<int:user_id>/profile' -> '/user/(?P<user_id>[0-9]+)/profile'
+        group_prefixを指定すると、グループ名の先頭に付与する
+        """
+        regex = ""
+        position = 0
+        for match in self.PARAMETER_PATTERN.finditer(pattern):
+            name = match.group("name")
+            regex += re.escape(pattern[position:match.start()])
+            regex += f"(?P<{group_prefix}{name}>{self.converters[name].regex})"
+            position = match.end()
+        regex += re.escape(pattern[position:])
+
+        return regex
+
+    def parameter_names(self) -> List[str]:
+        """
+        URLパターンに含まれるパラメータ名の一覧を返す
+        """
+        return list(self.converters)
+
+    def convert(self, params: Dict[str, str]) -> dict:
+        """
+        pathから取り出したパラメータを、コンバータで変換する
+        """
+        return {name: self.converters[name].to_python(value) for name, value in params.items()}
+
+    def split_static_prefix(self) -> Tuple[List[str], Optional[str]]:
+        """
+        URLパターンを、パラメータを含まない先頭のセグメントと、それ以降に分ける
+        ex) '/user/<user_id>/profile' -> (['user'], '<user_id>/profile')
+            '/now' -> (['now'], None)
+        """
+        segments = self.pattern[1:].split("/")
+        for i, segment in enumerate(segments):
+            if "<" in segment:
+                return segments[:i], "/".join(segments[i:])
+
+        return segments, None
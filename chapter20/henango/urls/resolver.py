@@ -1,21 +1,55 @@
-from typing import Callable, Optional
+from typing import Callable, List, Optional, Tuple
 
+import settings
 from henango.http.request import HTTPRequest
 from henango.http.response import HTTPResponse
+from henango.urls.pattern import URLPattern
+from henango.urls.router import URLRouter
+from henango.views.metrics import metrics
 from henango.views.static import static
 from urls import url_patterns
 
 class URLResolver:
+    # URLパターンをコンパイルしたもの(最初のURL解決時に一度だけ生成する)
+    router: Optional[URLRouter] = None
+
+    # static viewで処理した場合のルート名
+    STATIC_ROUTE = "static"
+
     def resolve(self, request: HTTPRequest) -> Optional[Callable[[HTTPRequest], HTTPResponse]]:
         """
         URL解決を行う
         pathにマッチするURLパターンが存在した場合は、対応するviewを返す
         存在しなかった場合は、static viewを返す
         """
-        for url_pattern in url_patterns:
-            match = url_pattern.match(request.path)
-            if match:
-                request.params.update(match.groupdict())
-                return url_pattern.view
-        
-        return static
\ No newline at end of file
+        return self.resolve_route(request)[1]
+
+    def resolve_route(self, request: HTTPRequest) -> Tuple[str, Callable[[HTTPRequest], HTTPResponse]]:
+        """
+        URL解決を行い、(ルート, view) を返す
+        ルートはマッチしたURLパターンの文字列で、static viewの場合は STATIC_ROUTE になる
+        (パラメータを含むpathごとではなくURLパターンごとに集計するため、メトリクスのラベルに使う)
+        """
+        if URLResolver.router is None:
+            URLResolver.router = URLRouter(self.get_url_patterns())
+
+        # クエリ文字列はURL解決に使わない
+        path = request.path.partition("?")[0]
+        resolved = URLResolver.router.resolve(path)
+        if resolved is not None:
+            url_pattern, params = resolved
+            if params:
+                request.params.update(params)
+            return url_pattern.pattern, url_pattern.view
+
+        return self.STATIC_ROUTE, static
+
+    @staticmethod
+    def get_url_patterns() -> List[URLPattern]:
+        """
+        urls.pyのURLパターンに、フレームワークが提供するURLパターンを加えたもの
+        """
+        patterns = list(url_patterns)
+        if getattr(settings, "METRICS_ENABLED", True):
+            patterns.append(URLPattern(getattr(settings, "METRICS_URL", "/metrics"), metrics))
+        return patterns
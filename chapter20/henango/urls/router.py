@@ -0,0 +1,114 @@
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from henango.urls.pattern import URLPattern
+
+
+class RouteNode:
+    """
+    URLのセグメント単位のトライ木のノード
+    """
+
+    def __init__(self):
+        # 次のセグメント -> 子ノード
+        self.children: Dict[str, "RouteNode"] = {}
+        # このノードでpathが終わる場合にマッチする、パラメータを含まないURLパターン
+        self.url_pattern: Optional[URLPattern] = None
+        # このノードまでの固定のセグメントに続いて、パラメータを含むURLパターン
+        self.tails: List[Tuple[str, URLPattern]] = []
+        # tailsをまとめた正規表現と、グループ名 -> (URLパターン, [(グループ名, パラメータ名)])
+        self.tail_regex: Optional[re.Pattern] = None
+        self.tail_groups: Dict[str, Tuple[URLPattern, List[Tuple[str, str]]]] = {}
+
+
+class URLRouter:
+    """
+    URLパターンを登録時にコンパイルしておき、pathから高速にviewを引くクラス
+
+    - パラメータを含まないセグメントはトライ木で辿る
+    - パラメータを含む残りの部分は、同じノードに登録されたパターンをまとめた1つの正規表現で判定する
+
+    同じpathに複数のパターンがマッチする場合は、
+    パラメータを含まないパターン > 固定のセグメントが長いパターン > 先に登録されたパターン
+    の順に優先する
+    """
+
+    def __init__(self, url_patterns: Iterable[URLPattern]):
+        self.root = RouteNode()
+        for url_pattern in url_patterns:
+            self.add(url_pattern)
+        self.compile()
+
+    def add(self, url_pattern: URLPattern) -> None:
+        """
+        URLパターンをトライ木に登録する
+        """
+        segments, tail = url_pattern.split_static_prefix()
+
+        node = self.root
+        for segment in segments:
+            node = node.children.setdefault(segment, RouteNode())
+
+        if tail is None:
+            # 同じpathが複数登録された場合は、先に登録された方を優先する
+            if node.url_pattern is None:
+                node.url_pattern = url_pattern
+        else:
+            node.tails.append((tail, url_pattern))
+
+    def compile(self) -> None:
+        """
+        各ノードのパラメータを含むパターンを、1つの正規表現にまとめてコンパイルする
+        ex) '(?P<_r0>(?P<_r0_user_id>[^/]+)/profile)|(?P<_r1>...)'
+        """
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            nodes.extend(node.children.values())
+            if not node.tails:
+                continue
+
+            alternatives = []
+            for i, (tail, url_pattern) in enumerate(node.tails):
+                group_name = f"_r{i}"
+                alternatives.append(f"(?P<{group_name}>{url_pattern.build_regex(tail, group_name + '_')})")
+                groups = [(f"{group_name}_{name}", name) for name in url_pattern.parameter_names()]
+                node.tail_groups[group_name] = (url_pattern, groups)
+            node.tail_regex = re.compile("|".join(alternatives))
+
+    def resolve(self, path: str) -> Optional[Tuple[URLPattern, dict]]:
+        """
+        pathにマッチするURLパターンと、pathから取り出してコンバータで変換したパラメータを返す
+        マッチするURLパターンがない場合はNoneを返す
+        """
+        if not path.startswith("/"):
+            return None
+
+        # 固定のセグメントを辿りつつ、パラメータを含むパターンを持つノードを記録しておく
+        candidates = []
+        node = self.root
+        position = 1
+        for segment in path[1:].split("/"):
+            if node.tail_regex is not None:
+                candidates.append((node, position))
+            node = node.children.get(segment)
+            if node is None:
+                break
+            position += len(segment) + 1
+        else:
+            if node.url_pattern is not None:
+                return node.url_pattern, {}
+
+        # 固定のセグメントが長いノードから順に、残りのpathを正規表現で判定する
+        for node, position in reversed(candidates):
+            match = node.tail_regex.fullmatch(path, position)
+            if match:
+                url_pattern, groups = node.tail_groups[match.lastgroup]
+                try:
+                    params = url_pattern.convert({name: match.group(group_name) for group_name, name in groups})
+                except ValueError:
+                    # 正規表現にはマッチしたが、値として不正な場合はマッチしなかったものとする
+                    continue
+                return url_pattern, params
+
+        return None
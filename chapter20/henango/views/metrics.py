@@ -0,0 +1,10 @@
+from henango.http.request import HTTPRequest
+from henango.http.response import HTTPResponse
+from henango.server.metrics import metrics as server_metrics
+
+
+def metrics(request: HTTPRequest) -> HTTPResponse:
+    """
+    サーバのメトリクスをPrometheusのテキスト形式で返す
+    """
+    return HTTPResponse(body=server_metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
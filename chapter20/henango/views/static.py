@@ -1,9 +1,17 @@
+import logging
 import os
-import traceback
+from typing import BinaryIO, List, Tuple
 
 import settings
+from henango.http.compression import choose_encoding
+from henango.http.conditional import is_not_modified, make_etag, not_modified, validator_headers
+from henango.http.ranges import RangeNotSatisfiable, if_range_matches, parse_range_header
 from henango.http.request import HTTPRequest
-from henango.http.response import HTTPResponse
+from henango.http.response import ByteRangesResponse, FileResponse, HTTPResponse
+from henango.views.static_cache import static_file_cache
+from henango.views.static_manifest import static_manifest
+
+logger = logging.getLogger(__name__)
 
 def static(request: HTTPRequest) -> HTTPResponse:
     """
@@ -13,22 +21,129 @@ def static(request: HTTPRequest) -> HTTPResponse:
     try:
         static_root = getattr(settings, "STATIC_ROOT")
 
-        # pathの先頭の/を削除し、相対パスにしておく
-        relative_path = request.path.lstrip("/")
+        # pathの先頭の/を削除し、正規化した相対パスにしておく
+        relative_path = os.path.normpath(request.path.partition("?")[0].lstrip("/"))
+        # STATIC_ROOTの外のファイルは配信しない
+        if relative_path.startswith(".."):
+            raise FileNotFoundError(relative_path)
+        extra_headers = {}
+        # collectstaticで書き出したフィンガープリント付きのファイルは、内容が変わることがないので
+        # ブラウザに長期間キャッシュさせる(再検証のリクエストも来なくなる)
+        if static_manifest.is_fingerprinted(relative_path):
+            static_root = settings.STATIC_COLLECT_ROOT
+            extra_headers["Cache-Control"] = getattr(
+                settings, "STATIC_IMMUTABLE_CACHE_CONTROL", "public, max-age=31536000, immutable"
+            )
+
         # ファイルのpathを取得
         static_file_path = os.path.join(static_root, relative_path)
 
-        # ファイルからレスポンスボティを生成
-        with open(static_file_path, "rb") as f:
-            response_body =  f.read()
-        
-        content_type = None
-        return HTTPResponse(body=response_body, content_type=content_type, status_code=200)
-    
+        # クライアントがgzipに対応していて、事前に圧縮した .gz ファイルがあればそれを返す
+        # (範囲を指定したリクエストには、圧縮していないファイルを返す)
+        # .gz ファイルがないことは覚えておき、リクエストのたびにopenして確かめないようにする
+        gzip_file_path = static_file_path + ".gz"
+        if (
+            "Range" not in request.headers
+            and choose_encoding(request) == "gzip"
+            and not static_file_cache.is_missing(gzip_file_path)
+        ):
+            try:
+                return serve_file(
+                    request,
+                    gzip_file_path,
+                    {**extra_headers, "Content-Encoding": "gzip", "Vary": "Accept-Encoding"},
+                )
+            except FileNotFoundError:
+                static_file_cache.mark_missing(gzip_file_path)
+
+        return serve_file(request, static_file_path, extra_headers)
+
     except OSError:
         # ファイルが見つからなかった場合は、ログを出力してから404を返す
-        traceback.print_exc()
+        logger.debug("=== static: ファイルを配信できませんでした path: %s ===", request.path, exc_info=True)
 
         response_body = b"<html><body><h1>404 Not Found</h1></body></html>"
         content_type = "text/html;"
-        return HTTPResponse(body=response_body, content_type=content_type, status_code=404)
\ No newline at end of file
+        return HTTPResponse(body=response_body, content_type=content_type, status_code=404)
+
+
+def serve_file(request: HTTPRequest, static_file_path: str, extra_headers: dict = None) -> HTTPResponse:
+    """
+    ファイルの内容を返すレスポンスを生成する
+    """
+    # 範囲を指定したリクエスト(Range)はファイルから直接返すので、キャッシュは使わない
+    range_header = request.headers.get("Range") if request.method == "GET" else None
+
+    # キャッシュにあればそれを返す
+    if range_header is None:
+        cached = static_file_cache.get(static_file_path)
+        if cached is not None:
+            # クライアントのキャッシュから変更がなければ、ボディなしの304を返す
+            if is_not_modified(request, cached.etag, cached.mtime):
+                return not_modified(cached.etag, cached.mtime, extra_headers)
+            return HTTPResponse(
+                body=cached.body, headers=static_headers(cached.etag, cached.mtime, extra_headers), status_code=200
+            )
+
+    f = open(static_file_path, "rb")
+    stat = os.fstat(f.fileno())
+    etag = make_etag(stat)
+
+    # クライアントのキャッシュから変更がなければ、ボディなしの304を返す
+    if is_not_modified(request, etag, stat.st_mtime):
+        f.close()
+        return not_modified(etag, stat.st_mtime, extra_headers)
+
+    # 範囲が指定されていれば、その範囲だけを返す
+    if range_header is not None and if_range_matches(request, etag, stat.st_mtime):
+        try:
+            ranges = parse_range_header(range_header, stat.st_size)
+        except RangeNotSatisfiable:
+            f.close()
+            return HTTPResponse(
+                status_code=416,
+                headers={"Content-Range": f"bytes */{stat.st_size}"},
+                content_type="text/html; charset=UTF-8",
+                body=b"<html><body><h1>416 Range Not Satisfiable</h1></body></html>",
+            )
+
+        if ranges is not None:
+            return partial_response(f, ranges, stat.st_size, static_headers(etag, stat.st_mtime, extra_headers))
+
+    # 大きなファイルはメモリに読み込まず、sendfileで送信する
+    if stat.st_size >= getattr(settings, "STATIC_SENDFILE_MIN_SIZE", 64 * 1024):
+        return FileResponse(f, length=stat.st_size, headers=static_headers(etag, stat.st_mtime, extra_headers), status_code=200)
+
+    # 小さなファイルはそのまま読み込んでレスポンスボディを生成し、キャッシュしておく
+    with f:
+        response_body = f.read()
+    static_file_cache.put(static_file_path, response_body, stat)
+    
+    content_type = None
+    return HTTPResponse(
+        body=response_body, content_type=content_type, headers=static_headers(etag, stat.st_mtime, extra_headers), status_code=200
+    )
+
+
+def static_headers(etag: str, last_modified: float, extra_headers: dict = None) -> dict:
+    """
+    静的ファイルのレスポンスに付与するヘッダを生成する
+    """
+    headers = validator_headers(etag, last_modified)
+    headers["Accept-Ranges"] = "bytes"
+    if extra_headers:
+        headers.update(extra_headers)
+    return headers
+
+
+def partial_response(f: BinaryIO, ranges: List[Tuple[int, int]], file_size: int, headers: dict) -> FileResponse:
+    """
+    ファイルの指定された範囲だけを返す206レスポンスを生成する
+    範囲が1つの場合はそのまま、複数の場合は multipart/byteranges で返す
+    """
+    if len(ranges) == 1:
+        first, last = ranges[0]
+        headers["Content-Range"] = f"bytes {first}-{last}/{file_size}"
+        return FileResponse(f, offset=first, length=last - first + 1, headers=headers, status_code=206)
+
+    return ByteRangesResponse(f, ranges, file_size, headers=headers)
@@ -0,0 +1,164 @@
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import List, NamedTuple, Optional
+
+import settings
+from henango.http.conditional import make_etag
+from henango.server.metrics import Collected
+
+
+class CachedFile(NamedTuple):
+    body: bytes
+    mtime: float
+    size: int
+    etag: str
+    # 最後にファイルの更新を確認した時刻
+    checked_at: float
+
+
+class StaticFileCache:
+    """
+    小さな静的ファイルの内容をメモリ上に保持しておくクラス
+    合計サイズがmax_bytesを超えたら、最近使われていないものから捨てる(LRU)
+    キャッシュした内容は、revalidate_interval秒に1回までファイルの更新日時とサイズで検証する
+    """
+
+    # 存在しないことを覚えておくpathの数の上限
+    MAX_MISSING = 4096
+
+    def __init__(self, max_bytes: int = None, max_file_size: int = None, revalidate_interval: float = None):
+        if max_bytes is None:
+            max_bytes = getattr(settings, "STATIC_CACHE_MAX_BYTES", 16 * 1024 * 1024)
+        if max_file_size is None:
+            max_file_size = getattr(settings, "STATIC_SENDFILE_MIN_SIZE", 64 * 1024)
+        if revalidate_interval is None:
+            revalidate_interval = getattr(settings, "STATIC_CACHE_REVALIDATE_INTERVAL", 1.0)
+
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.revalidate_interval = revalidate_interval
+
+        self.files: "OrderedDict[str, CachedFile]" = OrderedDict()
+        # 存在しないことを確認したpath -> 確認した時刻
+        # (事前に圧縮した .gz ファイルがないことを、リクエストのたびにopenして確かめないようにする)
+        self.missing: "OrderedDict[str, float]" = OrderedDict()
+        self.bytes_resident = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+    def get(self, path: str) -> Optional[CachedFile]:
+        """
+        キャッシュしているファイルの内容と、その時点の更新日時 / ETagを返す
+        キャッシュしていない場合や、ファイルが更新されていた場合はNoneを返す
+        """
+        with self._lock:
+            cached = self.files.get(path)
+            if cached is None:
+                self.misses += 1
+                return None
+            self.files.move_to_end(path)
+
+        now = time.monotonic()
+        if now - cached.checked_at >= self.revalidate_interval:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stat = None
+
+            if stat is None or stat.st_mtime != cached.mtime or stat.st_size != cached.size:
+                with self._lock:
+                    self._remove(path)
+                    self.misses += 1
+                return None
+
+            cached = cached._replace(checked_at=now)
+            with self._lock:
+                if path in self.files:
+                    self.files[path] = cached
+
+        with self._lock:
+            self.hits += 1
+        return cached
+
+    def put(self, path: str, body: bytes, stat: os.stat_result) -> None:
+        """
+        ファイルの内容をキャッシュする
+        大きすぎるファイルはキャッシュしない
+        """
+        size = len(body)
+        if size > self.max_file_size or size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._remove(path)
+            self.files[path] = CachedFile(body, stat.st_mtime, stat.st_size, make_etag(stat), time.monotonic())
+            self.bytes_resident += size
+
+            # 上限を超えた分は、最近使われていないものから捨てる
+            while self.bytes_resident > self.max_bytes:
+                _, evicted = self.files.popitem(last=False)
+                self.bytes_resident -= len(evicted.body)
+
+    def is_missing(self, path: str) -> bool:
+        """
+        pathのファイルが存在しないことを確認済みかどうか
+        確認してからrevalidate_interval秒が経っていれば、作られている可能性があるのでFalseを返す
+        """
+        with self._lock:
+            checked_at = self.missing.get(path)
+            if checked_at is None:
+                return False
+            if time.monotonic() - checked_at >= self.revalidate_interval:
+                del self.missing[path]
+                return False
+            return True
+
+    def mark_missing(self, path: str) -> None:
+        """
+        pathのファイルが存在しないことを記録する
+        """
+        with self._lock:
+            self.missing[path] = time.monotonic()
+            self.missing.move_to_end(path)
+            while len(self.missing) > self.MAX_MISSING:
+                self.missing.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+        キャッシュのヒット率と、保持しているバイト数を返す
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "files": len(self.files),
+                "bytes_resident": self.bytes_resident,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+    def collect_metrics(self) -> List[Collected]:
+        """
+        stats()の内容を、メトリクスとして返す
+        (ヒット率は hits / (hits + misses) で求める。preforkエンジンでは全プロセスの値を合計するので、比率そのものは出力しない)
+        """
+        stats = self.stats()
+        return [
+            ("henango_static_cache_hits_total", "counter", "Static file lookups served from memory.", stats["hits"]),
+            ("henango_static_cache_misses_total", "counter", "Static file lookups not in memory.", stats["misses"]),
+            ("henango_static_cache_files", "gauge", "Static files held in memory.", stats["files"]),
+            ("henango_static_cache_bytes", "gauge", "Bytes of static files held in memory.", stats["bytes_resident"]),
+        ]
+
+    def _remove(self, path: str) -> None:
+        cached = self.files.pop(path, None)
+        if cached is not None:
+            self.bytes_resident -= len(cached.body)
+
+
+# サーバ全体で共有するキャッシュ
+static_file_cache = StaticFileCache()
@@ -0,0 +1,68 @@
+import json
+import os
+from threading import Lock
+from typing import Dict, Optional
+
+import settings
+
+
+class StaticManifest:
+    """
+    collectstaticが出力したマニフェスト(元のファイル名 -> フィンガープリント付きのファイル名)を扱うクラス
+
+    テンプレートからは {static[index.css]} のように参照すると、
+    フィンガープリント付きのURL(ex: '/index.3f2a1b9c0d4e.css')に置き換わる
+    マニフェストにないファイルは、元のURLのまま返す
+    """
+
+    def __init__(self, path: str = None):
+        if path is None:
+            path = getattr(settings, "STATIC_MANIFEST", None)
+
+        self.path = path
+        self._paths: Optional[Dict[str, str]] = None
+        self._fingerprinted: frozenset = frozenset()
+        self._lock = Lock()
+
+    @property
+    def paths(self) -> Dict[str, str]:
+        """
+        元のファイル名 -> フィンガープリント付きのファイル名
+        最初に参照された時にマニフェストを読み込む
+        """
+        if self._paths is None:
+            self.load()
+        return self._paths
+
+    def load(self) -> None:
+        """
+        マニフェストを読み込む(マニフェストがなければ空として扱う)
+        """
+        paths = {}
+        if self.path and os.path.exists(self.path):
+            with open(self.path) as f:
+                paths = json.load(f)["paths"]
+
+        with self._lock:
+            self._paths = paths
+            self._fingerprinted = frozenset(paths.values())
+
+    def is_fingerprinted(self, relative_path: str) -> bool:
+        """
+        フィンガープリント付きのファイル名かどうか
+        """
+        self.paths
+        return relative_path in self._fingerprinted
+
+    def url(self, name: str) -> str:
+        """
+        元のファイル名から、配信に使うURLを返す
+        """
+        return "/" + self.paths.get(name.lstrip("/"), name.lstrip("/"))
+
+    def __getitem__(self, name: str) -> str:
+        return self.url(name)
+
+
+# サーバ全体で共有するマニフェスト
+static_manifest = StaticManifest()
@@ -7,4 +7,185 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 STATIC_ROOT = os.path.join(BASE_DIR, "static")
 
 # テンプレートファイルを置くディレクトリ
-TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
\ No newline at end of file
+TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
+
+# 待ち受けるホストとポート
+SERVER_HOST = "localhost"
+SERVER_PORT = 8080
+
+# acceptされるのを待つ接続を溜めておける数(OSの上限 net.core.somaxconn を超える値は切り詰められる)
+# 小さすぎると、接続が集中した時にSYNが捨てられ、クライアントの再送待ちで1秒以上の遅延が発生する
+SERVER_BACKLOG = 1024
+
+# TCP_NODELAY(Nagleアルゴリズムを無効にし、小さなパケットもすぐに送信する)
+SERVER_TCP_NODELAY = True
+
+# SO_REUSEPORT(同じポートを複数のsocketで待ち受ける。preforkエンジンのPREFORK_REUSE_PORTでは常に有効)
+SERVER_REUSE_PORT = False
+
+# TCP_DEFER_ACCEPT(接続後、データが届くまでacceptさせない最大秒数。0の場合は設定しない。Linuxのみ)
+SERVER_TCP_DEFER_ACCEPT = 0
+
+# TCP_FASTOPEN(TFOで受け付ける接続のキューの長さ。0の場合は設定しない)
+SERVER_TCP_FASTOPEN = 0
+
+# 送信 / 受信バッファのサイズ(バイト数, Noneの場合はOSのデフォルト値)
+SERVER_SNDBUF = None
+SERVER_RCVBUF = None
+
+# 接続の処理方式
+# "thread": 接続ごとにスレッドを生成する
+# "pool": 起動済みのワーカースレッドに接続を割り当てる
+WORKER_MODE = "thread"
+
+# プールモードのワーカースレッド数
+WORKER_POOL_SIZE = 16
+
+# プールモードで処理待ちの接続を溜めておけるキューの長さ
+WORKER_QUEUE_SIZE = 64
+
+# キューが満杯の時の挙動
+# "block": 空きが出るまでacceptを止める
+# "reject": 即座に503を返して接続を閉じる
+WORKER_QUEUE_FULL_POLICY = "block"
+
+# プールモードでkeep-aliveの次のリクエストを待つ秒数(KEEP_ALIVE_TIMEOUTより長くはならない)
+# 待っている間もワーカースレッドを占有するので短くしておく
+# また、処理待ちの接続がある場合は、keep-aliveせずにレスポンスを返した時点で接続を閉じる
+WORKER_POOL_KEEP_ALIVE_TIMEOUT = 1
+
+# サーバエンジン
+# "thread": Server(スレッドで接続を処理する)
+# "asyncio": AsyncServer(イベントループで接続を処理する)
+# "reactor": ReactorServer(selectorsで全ての接続を1スレッドで処理する。viewもこのスレッドで呼び出す)
+# "prefork": PreforkServer(複数のワーカープロセスをforkし、各プロセス内ではWORKER_MODEに従って接続を処理する)
+SERVER_ENGINE = "thread"
+
+# preforkエンジンのワーカープロセス数(Noneの場合はCPUコア数)
+PREFORK_PROCESSES = None
+
+# preforkエンジンで、各ワーカープロセスがSO_REUSEPORTで個別にsocketを生成するかどうか
+# Falseの場合は、マスタープロセスが生成したsocketを全ワーカープロセスで共有する
+PREFORK_REUSE_PORT = False
+
+# preforkエンジンの停止時に、処理中の接続が終わるのを待つ最大秒数
+PREFORK_GRACEFUL_TIMEOUT = 10
+
+# asyncioエンジンで同期的なviewを実行するスレッド数(Noneの場合はPythonのデフォルト値)
+ASYNC_EXECUTOR_WORKERS = None
+
+# サーバのログを表示するレベル("DEBUG" / "INFO" / "WARNING" / "ERROR")
+# "DEBUG"にすると、接続ごとのログやviewのデバッグ用の出力も表示する
+LOG_LEVEL = "INFO"
+
+# リクエストごとに1行のアクセスログ(JSON)を書き出すかどうか
+ACCESS_LOG_ENABLED = True
+
+# アクセスログの書き出し先のファイル(Noneの場合は標準出力)
+ACCESS_LOG_FILE = None
+
+# 書き出し待ちのアクセスログを溜めておける数(溢れた場合は新しいものを捨てる)
+ACCESS_LOG_BUFFER_SIZE = 4096
+
+# アクセスログをまとめて書き出す間隔(秒)
+ACCESS_LOG_FLUSH_INTERVAL = 0.2
+
+# 処理の段階ごとのレイテンシやレスポンス数などのメトリクスを集計するかどうか
+METRICS_ENABLED = True
+
+# メトリクスをPrometheusのテキスト形式で返すURL
+METRICS_URL = "/metrics"
+
+# preforkエンジンで、各ワーカープロセスがメトリクスを共有メモリに書き込む間隔(秒)
+# (/metricsは全プロセスの値を合計して返すので、他のプロセスの値はこの間隔だけ遅れることがある)
+METRICS_PUBLISH_INTERVAL = 1.0
+
+# preforkエンジンで、1つのワーカープロセスがメトリクスを書き込む共有メモリのサイズ(バイト数)
+METRICS_SHARED_SLOT_SIZE = 1024 * 1024
+
+# HTTP/1.1の持続的接続(keep-alive)を有効にするかどうか
+KEEP_ALIVE = True
+
+# keep-aliveで次のリクエストを待つ秒数
+KEEP_ALIVE_TIMEOUT = 5
+
+# 接続してから最初のリクエストを受信しきるまで、またはリクエストの受信中に次のデータを待つ秒数
+# (接続だけ張って何も送らないクライアントに、スレッドや接続を占有され続けないようにする)
+REQUEST_READ_TIMEOUT = 5
+
+# 1つの接続で処理するリクエストの最大数
+KEEP_ALIVE_MAX_REQUESTS = 100
+
+# 1回のrecvで受信する最大バイト数
+RECV_BUFFER_SIZE = 16 * 1024
+
+# リクエストライン+ヘッダの最大バイト数(超えた場合は431を返す)
+MAX_REQUEST_HEADER_SIZE = 8 * 1024
+
+# リクエストボディの最大バイト数(超えた場合は413を返す)
+MAX_REQUEST_BODY_SIZE = 10 * 1024 * 1024
+
+# 1つのRangeヘッダで指定できる範囲の数の上限(超えた場合はRangeヘッダを無視して全体を返す)
+MAX_RANGES = 16
+
+# 受信したリクエストをデバッグ用にファイルへ記録するかどうか
+REQUEST_CAPTURE_ENABLED = False
+
+# 記録するリクエストの割合(0.0 ~ 1.0)
+REQUEST_CAPTURE_SAMPLE_RATE = 1.0
+
+# 記録先のファイル
+REQUEST_CAPTURE_FILE = os.path.join(BASE_DIR, "server_recv.txt")
+
+# 記録ファイルがこのサイズを超えたらローテートする
+REQUEST_CAPTURE_MAX_BYTES = 1024 * 1024
+
+# ローテートしたファイルを何世代残すか
+REQUEST_CAPTURE_BACKUP_COUNT = 3
+
+# 書き出し待ちのリクエストを溜めておく数(溢れた場合は古いものから捨てる)
+REQUEST_CAPTURE_BUFFER_SIZE = 1024
+
+# テンプレートファイルが更新されていたら読み込み直すかどうか(本番ではFalseにするとファイルの確認を省ける)
+TEMPLATE_AUTO_RELOAD = True
+
+# 起動時にテンプレートを全て読み込んでおくかどうか
+TEMPLATE_PRELOAD = False
+
+# render_streamで描画する時に、1つのチャンクにまとめるおおよそのバイト数
+TEMPLATE_STREAM_CHUNK_SIZE = 8 * 1024
+
+# このサイズ以上の静的ファイルは、メモリに読み込まずsendfileで送信する
+STATIC_SENDFILE_MIN_SIZE = 64 * 1024
+
+# 静的ファイルのキャッシュに使うメモリの上限(バイト数, 0の場合はキャッシュしない)
+# STATIC_SENDFILE_MIN_SIZE 未満のファイルのみキャッシュする
+STATIC_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+# キャッシュした静的ファイルが更新されていないか確認する間隔(秒)
+STATIC_CACHE_REVALIDATE_INTERVAL = 1.0
+
+# レスポンスボディを圧縮(gzip / deflate)するかどうか
+COMPRESSION_ENABLED = True
+
+# このサイズ未満のレスポンスボディは圧縮しない
+COMPRESSION_MIN_SIZE = 1024
+
+# 圧縮レベル(1: 速い ~ 9: 小さい)
+COMPRESSION_LEVEL = 6
+
+# このサイズ以下のテキストの静的ファイル(sendfileで送るもの)も、圧縮した結果をキャッシュして返す
+# (これより大きいファイルは、事前に .gz ファイルを用意しない限り圧縮せずに送る)
+COMPRESSION_FILE_MAX_SIZE = 1024 * 1024
+
+# 静的ファイルなどを圧縮した結果のキャッシュに使うメモリの上限(バイト数)
+COMPRESSION_CACHE_MAX_BYTES = 8 * 1024 * 1024
+
+# collectstatic(python -m henango.collectstatic)でフィンガープリント付きの静的ファイルを書き出すディレクトリ
+STATIC_COLLECT_ROOT = os.path.join(BASE_DIR, "collected_static")
+
+# collectstaticが書き出すマニフェスト(元のファイル名 -> フィンガープリント付きのファイル名)
+STATIC_MANIFEST = os.path.join(STATIC_COLLECT_ROOT, "manifest.json")
+
+# フィンガープリント付きの静的ファイルに付与するCache-Control
+STATIC_IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
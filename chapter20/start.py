@@ -1,4 +1,36 @@
+import logging
+
+import settings
+from henango.http.compression import compression_cache
+from henango.server.aio import AsyncServer
+from henango.server.metrics import metrics
+from henango.server.prefork import PreforkServer
+from henango.server.reactor import ReactorServer
 from henango.server.server import Server
+from henango.template.renderer import get_template_cache, preload_templates
+from henango.views.static_cache import static_file_cache
 
 if __name__ == "__main__":
-    Server().serve()
\ No newline at end of file
+    # サーバのログ(起動 / 停止、エラー、接続ごとのデバッグ用の出力)をsettingsのレベル以上だけ表示する
+    logging.basicConfig(level=getattr(settings, "LOG_LEVEL", "INFO"), format="%(message)s")
+
+    # 本番用の設定では、テンプレートを起動時に全て読み込んでおく
+    if getattr(settings, "TEMPLATE_PRELOAD", False):
+        preload_templates()
+
+    # キャッシュのヒット数などを /metrics に出力する
+    # (preforkエンジンでは、ここで登録したものをワーカープロセスが引き継ぐ)
+    metrics.register_collector(static_file_cache.collect_metrics)
+    metrics.register_collector(compression_cache.collect_metrics)
+    metrics.register_collector(lambda: get_template_cache().collect_metrics())
+
+    # settingsで指定されたエンジンでサーバを起動する
+    engine = getattr(settings, "SERVER_ENGINE", "thread")
+    if engine == "asyncio":
+        AsyncServer().serve()
+    elif engine == "reactor":
+        ReactorServer().serve()
+    elif engine == "prefork":
+        PreforkServer().serve()
+    else:
+        Server().serve()
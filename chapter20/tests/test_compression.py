@@ -0,0 +1,42 @@
+import gzip
+import unittest
+import zlib
+
+from henango.http.compression import compress_stream
+from henango.http.request import HTTPRequest
+from henango.http.response import HTTPResponse
+from henango.server.protocol import HTTPProtocol
+
+
+def compressed_body(path: str, body: bytes, etag: str) -> bytes:
+    request = HTTPRequest(path=path, headers={"Accept-Encoding": "gzip"})
+    response = HTTPResponse(body=body, content_type="text/html; charset=UTF-8", headers={"ETag": etag})
+    return HTTPProtocol().compress_response(response, request).body
+
+
+class CompressResponseTest(unittest.TestCase):
+    def test_same_etag_on_different_paths(self):
+        a = b"a" * 2048
+        b = b"b" * 2048
+        self.assertEqual(gzip.decompress(compressed_body("/compression/a", a, '"v1"')), a)
+        self.assertEqual(gzip.decompress(compressed_body("/compression/b", b, '"v1"')), b)
+        # 同じpath・同じETagならキャッシュした結果を使い回す
+        self.assertEqual(gzip.decompress(compressed_body("/compression/a", b, '"v1"')), a)
+
+
+class CompressStreamTest(unittest.TestCase):
+    def test_each_chunk_is_flushed(self):
+        chunks = [f"<p>chunk {i}</p>".encode() * 100 for i in range(5)]
+        for encoding, wbits in (("gzip", 16 + zlib.MAX_WBITS), ("deflate", zlib.MAX_WBITS)):
+            with self.subTest(encoding=encoding):
+                decompressor = zlib.decompressobj(wbits)
+                compressed = compress_stream(iter(chunks), encoding)
+                # 次のチャンクを渡す前に、それまでのチャンクを全て復元できる
+                for chunk in chunks:
+                    self.assertEqual(decompressor.decompress(next(compressed)), chunk)
+                decompressor.decompress(b"".join(compressed))
+                self.assertTrue(decompressor.eof)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+from henango.http.conditional import condition, not_modified
+from henango.http.request import HTTPRequest
+from henango.http.response import HTTPResponse
+from henango.server.protocol import HTTPProtocol
+
+
+class NotModifiedTest(unittest.TestCase):
+    def test_validators(self):
+        response = not_modified('"abc"', 0)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["ETag"], '"abc"')
+        self.assertEqual(response.headers["Last-Modified"], "Thu, 01 Jan 1970 00:00:00 GMT")
+
+    def test_extra_headers_are_kept(self):
+        extra_headers = {
+            "Cache-Control": "public, max-age=31536000, immutable",
+            "Vary": "Accept-Encoding",
+            "Content-Encoding": "gzip",
+        }
+        response = not_modified('"abc"', extra_headers=extra_headers)
+        self.assertEqual(response.headers["Cache-Control"], "public, max-age=31536000, immutable")
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        # ボディに関するヘッダは304には付与しない
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_condition_keeps_view_headers(self):
+        @condition()
+        def view(request):
+            return HTTPResponse(body=b"hello", headers={"Cache-Control": "no-cache", "Vary": "Cookie"})
+
+        etag = view(HTTPRequest(method="GET")).headers["ETag"]
+        response = view(HTTPRequest(method="GET", headers={"If-None-Match": etag}))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["Cache-Control"], "no-cache")
+        self.assertEqual(response.headers["Vary"], "Cookie")
+
+
+class CompressResponseTest(unittest.TestCase):
+    def test_not_modified_has_same_vary(self):
+        request = HTTPRequest(path="/index.css", headers={"Accept-Encoding": "gzip"})
+        response = HTTPProtocol().compress_response(not_modified('"abc"', extra_headers={"Vary": "Cookie"}), request)
+        self.assertEqual(response.headers["Vary"], "Cookie, Accept-Encoding")
+        self.assertNotIn("Content-Encoding", response.headers)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,24 @@
+import asyncio
+import unittest
+
+from henango.http.request import HTTPRequest
+from henango.http.response import HTTPResponse
+from henango.server.protocol import HTTPProtocol
+
+
+class CallViewTest(unittest.TestCase):
+    def test_sync_view(self):
+        response = HTTPProtocol().call_view(lambda request: HTTPResponse(body=request.path), HTTPRequest(path="/sync"))
+        self.assertEqual(response.body, "/sync")
+
+    def test_async_view(self):
+        async def view(request):
+            await asyncio.sleep(0)
+            return HTTPResponse(body=request.path)
+
+        response = HTTPProtocol().call_view(view, HTTPRequest(path="/async"))
+        self.assertEqual(response.body, "/async")
+
+
+if __name__ == "__main__":
+    unittest.main()
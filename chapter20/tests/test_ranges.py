@@ -0,0 +1,49 @@
+import unittest
+
+from henango.http.ranges import RangeNotSatisfiable, merge_ranges, parse_range_header
+
+
+class ParseRangeHeaderTest(unittest.TestCase):
+    def test_single_range(self):
+        self.assertEqual(parse_range_header("bytes=0-99", 1000), [(0, 99)])
+        self.assertEqual(parse_range_header("bytes=900-", 1000), [(900, 999)])
+        self.assertEqual(parse_range_header("bytes=-50", 1000), [(950, 999)])
+        self.assertEqual(parse_range_header("bytes=990-2000", 1000), [(990, 999)])
+
+    def test_multiple_ranges(self):
+        self.assertEqual(parse_range_header("bytes=0-99, -50", 1000), [(0, 99), (950, 999)])
+
+    def test_overlapping_and_adjacent_ranges_are_merged(self):
+        self.assertEqual(parse_range_header("bytes=500-599, 0-99, 50-149", 1000), [(0, 149), (500, 599)])
+        self.assertEqual(parse_range_header("bytes=0-99, 100-199", 1000), [(0, 199)])
+
+    def test_too_many_ranges_are_ignored(self):
+        self.assertIsNone(parse_range_header(",".join(["bytes=0-"] + ["0-"] * 999), 1000))
+        self.assertIsNone(parse_range_header("bytes=" + ",".join(f"{i}-{i}" for i in range(17)), 1000))
+        self.assertEqual(len(parse_range_header("bytes=" + ",".join(f"{i * 2}-{i * 2}" for i in range(16)), 1000)), 16)
+
+    def test_ranges_larger_than_file_are_ignored(self):
+        self.assertIsNone(parse_range_header("bytes=0-,0-", 1000))
+        self.assertIsNone(parse_range_header("bytes=0-599,400-999", 1000))
+
+    def test_invalid_ranges_are_ignored(self):
+        for value in ("items=0-1", "bytes=abc", "bytes=5-1", "bytes=+1-2", "bytes=²-5", "bytes=0-²", "bytes=-²"):
+            with self.subTest(value=value):
+                self.assertIsNone(parse_range_header(value, 1000))
+
+    def test_unsatisfiable(self):
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range_header("bytes=1000-", 1000)
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range_header("bytes=-0", 1000)
+        for value in ("bytes=-5", "bytes=0-", "bytes=0-0, -5"):
+            with self.subTest(value=value):
+                with self.assertRaises(RangeNotSatisfiable):
+                    parse_range_header(value, 0)
+
+    def test_merge_ranges(self):
+        self.assertEqual(merge_ranges([(5, 9), (0, 3), (4, 4), (20, 30), (25, 26)]), [(0, 9), (20, 30)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+import unittest
+
+from henango.server.protocol import HTTPProtocol
+from henango.server.reader import (
+    BadRequest,
+    HTTPRequestReader,
+    RequestBodyTooLarge,
+    RequestHeaderTooLarge,
+    parse_chunk_size,
+    parse_content_length,
+)
+
+
+def framing(*headers: str):
+    """
+    ヘッダを並べたリクエストをパースし、get_body_framing()の結果を返す
+    """
+    head = "POST /parameters HTTP/1.1\r\nHost: localhost\r\n" + "".join(f"{h}\r\n" for h in headers) + "\r\n"
+    protocol = HTTPProtocol()
+    return protocol.get_body_framing(protocol.parse_http_request(head.encode()))
+
+
+class BodyFramingTest(unittest.TestCase):
+    def test_content_length(self):
+        self.assertEqual(framing("Content-Length: 10"), (10, False))
+        self.assertEqual(framing(), (0, False))
+
+    def test_repeated_identical_content_length(self):
+        self.assertEqual(framing("Content-Length: 3", "Content-Length: 3"), (3, False))
+        self.assertEqual(framing("Content-Length: 3, 3"), (3, False))
+
+    def test_content_length_must_be_digits(self):
+        for value in ("+5", "-5", "1_0", "0x10", "", "5 5", "１０", "²"):
+            with self.subTest(value=value):
+                with self.assertRaises(BadRequest):
+                    framing(f"Content-Length: {value}")
+
+    def test_conflicting_content_length(self):
+        with self.assertRaises(BadRequest):
+            framing("Content-Length: 1_0", "Content-Length: 3")
+        with self.assertRaises(BadRequest):
+            framing("Content-Length: 10", "Content-Length: 3")
+        with self.assertRaises(BadRequest):
+            framing("Content-Length: 10, 3")
+
+    def test_chunked(self):
+        self.assertEqual(framing("Transfer-Encoding: chunked"), (0, True))
+        self.assertEqual(framing("Transfer-Encoding: Chunked"), (0, True))
+
+    def test_transfer_encoding_with_content_length(self):
+        with self.assertRaises(BadRequest):
+            framing("Transfer-Encoding: chunked", "Content-Length: 3")
+        with self.assertRaises(BadRequest):
+            framing("Content-Length: 3", "Transfer-Encoding: chunked")
+
+    def test_header_name_must_be_token(self):
+        for header in ("Transfer-Encoding : chunked", "Content-Length\t: 5", ": 5", " Content-Length: 5", "Cont(ent: 5"):
+            with self.subTest(header=header):
+                with self.assertRaises(BadRequest):
+                    framing(header)
+
+    def test_non_utf8_request(self):
+        protocol = HTTPProtocol()
+        with self.assertRaises(BadRequest):
+            protocol.parse_http_request(b"GET /\xff HTTP/1.1\r\nHost: x\r\n\r\n")
+        with self.assertRaises(BadRequest):
+            protocol.get_body_framing(protocol.parse_http_request(b"POST / HTTP/1.1\r\nContent-Length: \xff\r\n\r\n"))
+
+    def test_unsupported_transfer_encoding(self):
+        for value in ("gzip, chunked", "chunked, chunked", "xchunked", "identity", ""):
+            with self.subTest(value=value):
+                with self.assertRaises(BadRequest):
+                    framing(f"Transfer-Encoding: {value}")
+
+
+class ParseTest(unittest.TestCase):
+    def test_parse_content_length(self):
+        self.assertEqual(parse_content_length([]), 0)
+        self.assertEqual(parse_content_length(["007"]), 7)
+
+    def test_parse_chunk_size(self):
+        self.assertEqual(parse_chunk_size(b"1f"), 31)
+        self.assertEqual(parse_chunk_size(b"1F;name=value"), 31)
+        self.assertEqual(parse_chunk_size(b"a ;name"), 10)
+
+    def test_chunk_size_must_be_hex_digits(self):
+        for line in (b"0x1f", b"-2", b"+2", b"1_0", b" 1", b"1 ", b"", b"g", b"1" * 17):
+            with self.subTest(line=line):
+                with self.assertRaises(BadRequest):
+                    parse_chunk_size(line)
+
+
+class HTTPRequestReaderTest(unittest.TestCase):
+    def test_read_head_waits_for_blank_line(self):
+        reader = HTTPRequestReader()
+        reader.feed(b"GET / HTTP/1.1\r\nHost: x\r\n")
+        self.assertIsNone(reader.read_head())
+        reader.feed(b"\r\nGET /next")
+        self.assertEqual(reader.read_head(), b"GET / HTTP/1.1\r\nHost: x\r\n\r\n")
+        self.assertEqual(bytes(reader.buffer), b"GET /next")
+
+    def test_header_too_large(self):
+        reader = HTTPRequestReader(max_header_size=16)
+        reader.feed(b"GET / HTTP/1.1\r\nHost: localhost\r\n")
+        with self.assertRaises(RequestHeaderTooLarge):
+            reader.read_head()
+
+    def test_content_length_body(self):
+        reader = HTTPRequestReader()
+        reader.feed(b"abc")
+        self.assertIsNone(reader.read_body(5))
+        reader.feed(b"defg")
+        self.assertEqual(reader.read_body(5), b"abcde")
+        self.assertEqual(bytes(reader.buffer), b"fg")
+
+    def test_body_too_large(self):
+        reader = HTTPRequestReader(max_body_size=4)
+        with self.assertRaises(RequestBodyTooLarge):
+            reader.read_body(5)
+
+    def test_chunked_body(self):
+        reader = HTTPRequestReader()
+        reader.feed(b"3\r\nabc\r\n")
+        self.assertIsNone(reader.read_body(chunked=True))
+        reader.feed(b"2;ext\r\nde\r\n0\r\nTrailer: x\r\n\r\nNEXT")
+        self.assertEqual(reader.read_body(chunked=True), b"abcde")
+        self.assertEqual(bytes(reader.buffer), b"NEXT")
+
+    def test_chunked_trailer_too_large(self):
+        reader = HTTPRequestReader(max_header_size=100)
+        reader.feed(b"3\r\nabc\r\n0\r\n")
+        for _ in range(20):
+            reader.feed(b"X-Trailer: " + b"x" * 10)
+        with self.assertRaises(RequestHeaderTooLarge):
+            reader.read_body(chunked=True)
+
+        reader = HTTPRequestReader(max_header_size=100)
+        reader.feed(b"0\r\nX-Trailer: " + b"x" * 200 + b"\r\n\r\n")
+        with self.assertRaises(RequestHeaderTooLarge):
+            reader.read_body(chunked=True)
+
+    def test_negative_chunk_size(self):
+        reader = HTTPRequestReader()
+        reader.feed(b"-2\r\nabc\r\n0\r\n\r\n")
+        with self.assertRaises(BadRequest):
+            reader.read_body(chunked=True)
+
+    def test_chunk_without_trailing_crlf(self):
+        reader = HTTPRequestReader()
+        reader.feed(b"3\r\nabcX\r\n0\r\n\r\n")
+        with self.assertRaises(BadRequest):
+            reader.read_body(chunked=True)
+
+    def test_chunked_body_too_large(self):
+        reader = HTTPRequestReader(max_body_size=4)
+        reader.feed(b"5\r\nabcde\r\n0\r\n\r\n")
+        with self.assertRaises(RequestBodyTooLarge):
+            reader.read_body(chunked=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
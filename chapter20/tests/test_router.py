@@ -0,0 +1,67 @@
+import unittest
+import uuid
+
+from henango.urls.pattern import URLPattern
+from henango.urls.router import URLRouter
+
+
+def view(name: str):
+    def _view(request):
+        return name
+    _view.__name__ = name
+    return _view
+
+
+class URLRouterTest(unittest.TestCase):
+    def setUp(self):
+        self.router = URLRouter([
+            URLPattern("/now", view("now")),
+            URLPattern("/user/<int:user_id>/profile", view("profile")),
+            URLPattern("/user/me/profile", view("my_profile")),
+            URLPattern("/user/<user_id>/posts/<slug:slug>", view("post")),
+            URLPattern("/items/<uuid:item_id>", view("item")),
+            URLPattern("/files/<path:path>", view("file")),
+            URLPattern("/files/readme", view("readme")),
+        ])
+
+    def resolve(self, path: str):
+        resolved = self.router.resolve(path)
+        if resolved is None:
+            return None
+        url_pattern, params = resolved
+        return url_pattern.view.__name__, params
+
+    def test_static_path(self):
+        self.assertEqual(self.resolve("/now"), ("now", {}))
+
+    def test_no_match(self):
+        self.assertIsNone(self.resolve("/nothing"))
+        self.assertIsNone(self.resolve("/now/extra"))
+        self.assertIsNone(self.resolve("now"))
+        self.assertIsNone(self.resolve("/user/1/profile/extra"))
+
+    def test_converted_parameters(self):
+        self.assertEqual(self.resolve("/user/42/profile"), ("profile", {"user_id": 42}))
+        item_id = uuid.uuid4()
+        self.assertEqual(self.resolve(f"/items/{item_id}"), ("item", {"item_id": item_id}))
+        self.assertIsNone(self.resolve("/items/not-a-uuid"))
+
+    def test_static_pattern_wins_over_parameters(self):
+        self.assertEqual(self.resolve("/user/me/profile"), ("my_profile", {}))
+        self.assertEqual(self.resolve("/files/readme"), ("readme", {}))
+
+    def test_multiple_parameters(self):
+        self.assertEqual(self.resolve("/user/alice/posts/hello-world"), ("post", {"user_id": "alice", "slug": "hello-world"}))
+        self.assertIsNone(self.resolve("/user/alice/posts/hello world"))
+
+    def test_path_converter(self):
+        self.assertEqual(self.resolve("/files/a/b/c.txt"), ("file", {"path": "a/b/c.txt"}))
+
+    def test_first_registered_pattern_wins(self):
+        router = URLRouter([URLPattern("/same", view("first")), URLPattern("/same", view("second"))])
+        url_pattern, _ = router.resolve("/same")
+        self.assertEqual(url_pattern.view.__name__, "first")
+
+
+if __name__ == "__main__":
+    unittest.main()
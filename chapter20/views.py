@@ -1,3 +1,4 @@
+import logging
 import urllib.parse
 from datetime import datetime
 from pprint import pformat
@@ -7,6 +8,8 @@ from henango.http.response import HTTPResponse
 from henango.http.cookie import Cookie
 from henango.template.renderer import render
 
+logger = logging.getLogger(__name__)
+
 def now(request: HTTPRequest) -> HTTPResponse:
     """
     現在時刻を表示するHTMLを生成する
@@ -73,7 +76,7 @@ def login(request: HTTPRequest) -> HTTPResponse:
         )
     
 def welcome(request: HTTPRequest) -> HTTPResponse:
-    print("request.cookies=", request.cookies)
+    logger.debug("request.cookies= %s", request.cookies)
     # Cookieにusernameが含まれていなければ、ログインしていないとみなして/loginへリダイレクト
     if "username" not in request.cookies:
         return HTTPResponse(status_code=302, headers={"Location": "/login"})